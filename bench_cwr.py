@@ -0,0 +1,224 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+# Ensure we can import from local directory
+sys.path.append(os.getcwd())
+
+import pandas as pd
+from cwr_engine import FormatterEngine, generate_cwr_content
+from cwr_gatekeeper import find_violations
+from cwr_ingest import load_csv_buffer
+from cwr_validator import CWRValidator
+
+# ==============================================================================
+# BENCHMARK SUITE
+# ==============================================================================
+# Deterministic synthetic Harvest-format catalogs (metadata preamble, header,
+# PUBLISHER:n: / WRITER:n: slots) timed and memory-profiled through
+# FormatterEngine.build, generate_cwr_content (row and vectorized), the
+# validator (with and without the mirror audit) and the pre-flight gatekeeper.
+# ORN cut_number is 4 digits, so one transmission holds at most 9,999 works.
+# Larger sizes are benchmarked as consecutive full transmissions, the way a
+# batch run would ship them, each mirror-audited against its own slice of the
+# CSV. Results go to JSON. --compare flags regressions
+# against a stored baseline.
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+MAX_WORKS_PER_TRANSMISSION = 9_999
+DEFAULT_THRESHOLD = 0.20
+WORDS = ["NIGHT", "DRIVE", "GOLDEN", "HOUR", "ECHO", "RIVER", "STATIC", "BLOOM", "NEON", "HARBOUR", "VELVET", "SIGNAL"]
+
+# ==============================================================================
+# SYNTHETIC CATALOG
+# ==============================================================================
+def agreement_names(size: int) -> dict:
+    return {f"PUBLISHER {n:04d} MUSIC": f"{4300000 + n}" for n in range(size)}
+
+def synthetic_catalog(works: int, writers: int = 3, publishers: int = 2, title_length=(8, 60),
+                      agreements: int = 50, seed: int = 0) -> tuple:
+    # Returns (csv bytes, agreement map). Every work is valid: writer shares sum
+    # to exactly 100% and every publisher is in the map.
+    rnd = random.Random(seed)
+    agreement_map = agreement_names(agreements)
+    names = list(agreement_map)
+    columns = ['Track: Title', 'Code: ISRC', 'Album: Code', 'Library: Name']
+    for p in range(1, publishers + 1):
+        columns += [f'PUBLISHER:{p}: {f}' for f in ("Name", "Owner Performance Share %", "IPI", "PRO", "MRO")]
+    for w in range(1, writers + 1):
+        columns += [f'WRITER:{w}: {f}' for f in ("Last Name", "First Name", "Owner Performance Share %", "IPI", "PRO", "Original Publisher")]
+
+    rows = []
+    for i in range(works):
+        length = rnd.randint(*title_length)
+        title = f"{' '.join(rnd.choice(WORDS) for _ in range(12))} {i}"[-length:].strip()
+        row = [title, f"GBLUM{i % 10**7:07d}", f"RC{i // 500:04d}", rnd.choice(["RED COLA", "LUMINA", "EKONOMIC PROPAGANDA"])]
+        pub_names = rnd.sample(names, min(len(names), rnd.randint(1, publishers)))
+        for p in range(publishers):
+            if p < len(pub_names):
+                row += [pub_names[p], round(100 / len(pub_names), 2), f"{rnd.randrange(10**10):011d}", "52", "33"]
+            else:
+                row += [""] * 5
+        n_writers = rnd.randint(1, writers)
+        cents = [10000 // n_writers] * n_writers
+        cents[-1] += 10000 - sum(cents)
+        for w in range(writers):
+            if w < n_writers:
+                row += [f"WRITER{rnd.randrange(500):03d}", rnd.choice(["ANNA", "JOHN", ""]), cents[w] / 100,
+                        f"{rnd.randrange(10**10):011d}", "52", rnd.choice(pub_names)]
+            else:
+                row += [""] * 6
+        rows.append(row)
+
+    return catalog_csv(pd.DataFrame(rows, columns=columns)), agreement_map
+
+def catalog_csv(df: pd.DataFrame) -> bytes:
+    # Harvest export bytes: metadata preamble, header, rows.
+    buf = io.StringIO()
+    buf.write("Lumina Harvest Export,Synthetic\n")
+    buf.write(f"Generated,{len(df)} works\n\n")
+    df.to_csv(buf, index=False)
+    return buf.getvalue().encode("utf-8")
+
+def transmissions(df: pd.DataFrame) -> list:
+    # Full transmissions of at most MAX_WORKS_PER_TRANSMISSION works, each indexed from 0.
+    return [df.iloc[start:start + MAX_WORKS_PER_TRANSMISSION].reset_index(drop=True)
+            for start in range(0, len(df), MAX_WORKS_PER_TRANSMISSION)]
+
+def bench_context(csv_bytes: bytes, agreement_map: dict) -> dict:
+    # Catalog, its transmissions, and each transmission's own CSV for the mirror audit.
+    _, df = load_csv_buffer(csv_bytes)
+    parts = transmissions(df)
+    part_csvs = [csv_bytes] if len(parts) == 1 else [catalog_csv(part) for part in parts]
+    return {"df": df, "csv": csv_bytes, "agreements": agreement_map, "parts": parts, "part_csvs": part_csvs}
+
+# ==============================================================================
+# BENCHMARKS
+# ==============================================================================
+def bench_formatter_build(ctx):
+    engine = FormatterEngine()
+    titles = ctx["df"].iloc[:, 0].tolist()
+    for i, title in enumerate(titles):
+        engine.build("NWR", {"title": title, "t_seq": f"{i % 10**8:08d}", "work_id": f"{i + 1:014d}", "isrc": "GBLUM0000001"})
+
+def bench_generate(mode):
+    def run(ctx):
+        ctx["content"] = [generate_cwr_content(part.copy(deep=False), agreement_map=ctx["agreements"], mode=mode)[0] for part in ctx["parts"]]
+    return run
+
+def bench_validate(mirror):
+    def run(ctx):
+        ctx["reports"] = [CWRValidator().process_file(content, csv_content=csv_content if mirror else None)[0]
+                          for content, csv_content in zip(ctx["content"], ctx["part_csvs"])]
+    return run
+
+def bench_gatekeeper(ctx):
+    find_violations(ctx["df"])
+
+BENCHMARKS = {
+    "formatter_build": bench_formatter_build,
+    "generate_rows": bench_generate("rows"),
+    "generate_vectorized": bench_generate("vectorized"),
+    "validate": bench_validate(mirror=False),
+    "validate_mirror": bench_validate(mirror=True),
+    "gatekeeper": bench_gatekeeper,
+}
+
+def measure(fn, ctx, memory: bool) -> dict:
+    # Wall time from an untraced run; peak traced allocation from a second run.
+    t0 = time.perf_counter()
+    fn(ctx)
+    result = {"seconds": round(time.perf_counter() - t0, 4)}
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(ctx)
+            result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        finally:
+            tracemalloc.stop()
+    return result
+
+def run_suite(sizes, benchmarks=None, memory: bool = True, writers: int = 3, publishers: int = 2,
+              agreements: int = 50, title_length=(8, 60), seed: int = 0) -> dict:
+    names = benchmarks or list(BENCHMARKS)
+    results = []
+    for label in sizes:
+        works = SIZES[label] if label in SIZES else int(label)
+        csv_bytes, agreement_map = synthetic_catalog(works, writers, publishers, title_length, agreements, seed)
+        ctx = bench_context(csv_bytes, agreement_map)
+        # Validation benchmarks need generated content; generate it untimed unless a generate bench runs first
+        first_validate = next((k for k, n in enumerate(names) if n.startswith("validate")), None)
+        if first_validate is not None and not any(n.startswith("generate") for n in names[:first_validate]):
+            bench_generate("vectorized")(ctx)
+        for name in names:
+            entry = {"bench": name, "works": works, **measure(BENCHMARKS[name], ctx, memory)}
+            entry["us_per_work"] = round(entry["seconds"] / works * 1e6, 2) if works else 0.0
+            results.append(entry)
+            print(f"{name:<22}{works:>10,} works {entry['seconds']:>9.3f}s {entry.get('peak_mb', float('nan')):>9.1f} MB")
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "catalog": {"writers": writers, "publishers": publishers, "agreements": agreements,
+                        "title_length": list(title_length), "seed": seed},
+        },
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    # Entries slower (or with a higher peak) than baseline * (1 + threshold).
+    base = {(r["bench"], r["works"]): r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        ref = base.get((r["bench"], r["works"]))
+        if ref is None: continue
+        for metric in ("seconds", "peak_mb"):
+            if metric in r and ref.get(metric) and r[metric] > ref[metric] * (1 + threshold):
+                regressions.append({"bench": r["bench"], "works": r["works"], "metric": metric,
+                                    "baseline": ref[metric], "current": r[metric], "ratio": round(r[metric] / ref[metric], 3)})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CWR engine, validator and gatekeeper on synthetic catalogs.")
+    parser.add_argument("--sizes", default="1k,10k", help="Comma-separated: 1k, 10k, 100k, 1m or a work count.")
+    parser.add_argument("--bench", default=None, help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--writers", type=int, default=3)
+    parser.add_argument("--publishers", type=int, default=2)
+    parser.add_argument("--agreements", type=int, default=50)
+    parser.add_argument("--title-length", default="8,60", help="min,max title length")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass.")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    report = run_suite(
+        args.sizes.split(","), args.bench.split(",") if args.bench else None, memory=not args.no_memory,
+        writers=args.writers, publishers=args.publishers, agreements=args.agreements,
+        title_length=tuple(int(v) for v in args.title_length.split(",")), seed=args.seed,
+    )
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['bench']} @ {r['works']:,} works: {r['metric']} {r['baseline']} -> {r['current']} (x{r['ratio']})")
+        if regressions: return 1
+        print(f"No regressions beyond {args.threshold:.0%}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from cwr_output import latin1_chunks
+
+# ==============================================================================
+# SESSION ARTIFACT STORE
+# ==============================================================================
+# Generated transmissions live on disk, not in st.session_state. The layout is
+# <root>/<session>/<content hash>/<filename>. Each ZIP is compressed once from
+# the .V22 on disk, kept beside it, and served from the file on every later
+# rerun. Artifacts are evicted when their last use is older than max_age, then
+# least-recently-used first until the store fits in max_bytes.
+
+ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), "lumina_cwr_artifacts")
+MAX_AGE = 6 * 3600
+MAX_BYTES = 1 << 30
+
+class ArtifactStore:
+    """Disk-spilled generated outputs with cached ZIP archives."""
+    def __init__(self, root=ARTIFACT_DIR, max_age: float = MAX_AGE, max_bytes: int = MAX_BYTES):
+        self.root = os.fspath(root)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, session: str, digest: str) -> str:
+        return os.path.join(self.root, os.path.basename(session), os.path.basename(digest))
+
+    def put(self, session: str, filename: str, content: str) -> str:
+        # Spills a transmission to disk (latin-1) and returns its content hash.
+        # Identical content in the same session is stored once.
+        session_dir = os.path.join(self.root, os.path.basename(session))
+        os.makedirs(session_dir, exist_ok=True)
+        digest = hashlib.blake2b(digest_size=16)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=session_dir)
+        try:
+            with os.fdopen(fd, "wb", buffering=1 << 20) as fh:
+                for chunk in latin1_chunks(content):
+                    digest.update(chunk)
+                    fh.write(chunk)
+            key = digest.hexdigest()
+            target_dir = self._dir(session, key)
+            os.makedirs(target_dir, exist_ok=True)
+            target = os.path.join(target_dir, os.path.basename(filename))
+            if os.path.exists(target):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+        self._touch(target_dir)
+        self.evict(keep=target_dir)
+        return key
+
+    def path(self, session: str, digest: str, filename: str):
+        # The stored transmission, or None once it has been evicted.
+        path = os.path.join(self._dir(session, digest), os.path.basename(filename))
+        return path if os.path.exists(path) else None
+
+    def zip_path(self, session: str, digest: str, filename: str):
+        # <filename>.zip beside the transmission, compressed from disk on first use.
+        source = self.path(session, digest, filename)
+        if source is None: return None
+        target = f"{source}.zip"
+        if not os.path.exists(target):
+            fd, tmp = tempfile.mkstemp(suffix=".zip.tmp", dir=os.path.dirname(source))
+            os.close(fd)
+            try:
+                with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+                    zf.write(source, arcname=os.path.basename(filename))
+                os.replace(tmp, target)
+            except BaseException:
+                if os.path.exists(tmp): os.remove(tmp)
+                raise
+        self._touch(os.path.dirname(source))
+        return target
+
+    # --- EVICTION ---
+    @staticmethod
+    def _touch(artifact_dir: str):
+        os.utime(artifact_dir)
+
+    def _artifacts(self) -> list:
+        # (last use, bytes, directory) for every artifact in the store
+        found = []
+        for session in os.scandir(self.root):
+            if not session.is_dir(): continue
+            for entry in os.scandir(session.path):
+                if not entry.is_dir(): continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                found.append((entry.stat().st_mtime, size, entry.path))
+        return found
+
+    def evict(self, keep: str = None) -> int:
+        # Returns the number of artifacts removed.
+        now = time.time()
+        artifacts = sorted(self._artifacts())
+        total = sum(size for _, size, _ in artifacts)
+        removed = 0
+        for used, size, path in artifacts:
+            if path == keep: continue
+            if now - used <= self.max_age and total <= self.max_bytes: continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        for session in os.scandir(self.root):
+            # Idle empty session folders only; a fresh one may be about to receive a put()
+            if session.is_dir() and now - session.stat().st_mtime > self.max_age and not os.listdir(session.path):
+                try:
+                    os.rmdir(session.path)
+                except OSError:
+                    pass
+        return removed
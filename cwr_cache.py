@@ -0,0 +1,163 @@
+import hashlib
+import json
+import sqlite3
+from config import LUMINA_CONFIG
+from cwr_schema import CWR_SCHEMA
+from cwr_engine import COMPILED_SCHEMA, ColumnPlan, AgreementResolver, sequence_values
+
+# ==============================================================================
+# TRANSACTION CACHE
+# ==============================================================================
+# Disk-backed (sqlite) store of rendered NWR..ORN transaction bodies. The key is
+# a hash of the row's values in every column the ColumnPlan reads, scoped by the
+# plan layout, agreement map, LUMINA_CONFIG and IPI. Bodies are stored with the
+# sequence fields (t_seq, work_id, cut_number) blanked, so a row that only moved
+# in the catalog is still a hit; the fields are re-stamped from the new index.
+# Entries are evicted least-recently-used past max_bytes, and the whole store is
+# dropped when CWR_SCHEMA changes. The store runs in WAL mode, so the batch
+# runner's worker processes can share one cache file.
+
+DEFAULT_MAX_BYTES = 256 << 20
+PLACEHOLDER = "#"
+FLUSH_EVERY = 5_000
+
+def schema_fingerprint() -> str:
+    return hashlib.sha256(repr(sorted(CWR_SCHEMA.items())).encode("utf-8")).hexdigest()
+
+def _sequence_spans() -> dict:
+    # record type -> [(field name, offset, width)] for the sequence fields
+    spans = {}
+    sequence_fields = sequence_values(0).keys()
+    for record_type, record in COMPILED_SCHEMA.items():
+        for name, offset, length, width, numeric, pad_char in record.slots:
+            if name in sequence_fields and width:
+                spans.setdefault(record_type, []).append((name, offset, length, width))
+    return spans
+
+SEQUENCE_SPANS = _sequence_spans()
+
+def _plan_positions(plan: ColumnPlan) -> list:
+    positions = [plan.title, plan.isrc, plan.album, plan.library]
+    for slot in plan.publishers + plan.writers:
+        positions.extend(p for p in slot[1:] if p is not None)
+    return positions
+
+class TransactionCache:
+    """LRU-bounded sqlite cache of rendered transaction bodies."""
+    def __init__(self, path, max_bytes: int = DEFAULT_MAX_BYTES, timeout: float = 30.0):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(str(path), timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tx (key BLOB PRIMARY KEY, body TEXT NOT NULL, size INTEGER NOT NULL, used INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tx_used ON tx (used)")
+        meta = dict(self._conn.execute("SELECT k, v FROM meta"))
+        fingerprint = schema_fingerprint()
+        if meta.get("schema") != fingerprint:
+            self._conn.execute("DELETE FROM tx")
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (fingerprint,))
+            meta["clock"] = "0"
+        self._clock = int(meta.get("clock", 0))
+        self._puts = []
+        self._touched = []
+        self._conn.commit()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM tx").fetchone()[0]
+
+    def bind(self, plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str) -> "BoundTransactionCache":
+        context = json.dumps([
+            [plan.title, plan.isrc, plan.album, plan.library, plan.publishers, plan.writers],
+            resolver.fingerprint(), sorted(LUMINA_CONFIG.items()), full_ipi,
+        ])
+        return BoundTransactionCache(self, hashlib.sha256(context.encode("utf-8")).digest(), _plan_positions(plan))
+
+    # --- STORAGE ---
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _lookup(self, key: bytes):
+        hit = self._conn.execute("SELECT body FROM tx WHERE key = ?", (key,)).fetchone()
+        if hit is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append((self._tick(), key))
+        if len(self._touched) >= FLUSH_EVERY: self.flush()
+        return hit[0]
+
+    def _store(self, key: bytes, body: str):
+        self._puts.append((key, body, len(body), self._tick()))
+        if len(self._puts) >= FLUSH_EVERY: self.flush()
+
+    def flush(self):
+        if self._puts:
+            self._conn.executemany("INSERT OR REPLACE INTO tx VALUES (?, ?, ?, ?)", self._puts)
+        if self._touched:
+            self._conn.executemany("UPDATE tx SET used = ? WHERE key = ?", self._touched)
+        self._puts, self._touched = [], []
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('clock', ?)", (str(self._clock),))
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM tx").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0: return
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM tx ORDER BY used"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0: break
+        self._conn.executemany("DELETE FROM tx WHERE key = ?", doomed)
+
+class BoundTransactionCache:
+    """A TransactionCache scoped to one generation run (plan, agreements, config)."""
+    def __init__(self, cache: TransactionCache, context: bytes, positions: list):
+        self.cache = cache
+        self.context = context
+        self.positions = positions
+
+    def key(self, row) -> bytes:
+        values = "\x1f".join(repr(row[p]) for p in self.positions)
+        return hashlib.blake2b(values.encode("utf-8", "surrogatepass"), digest_size=16, key=self.context[:64]).digest()
+
+    def get(self, key: bytes, i):
+        # Cached lines re-stamped with row index i, or None. Rows whose sequence
+        # values would overflow their fields miss, so the firewall raises as usual.
+        body = self.cache._lookup(key)
+        if body is None: return None
+        seq = sequence_values(i)
+        lines = body.split("\r\n")
+        for n, line in enumerate(lines):
+            spans = SEQUENCE_SPANS.get(line[:3])
+            if not spans: continue
+            for name, offset, length, width in spans:
+                if len(seq[name]) != length: return None
+                line = line[:offset] + seq[name][:width] + line[offset + width:]
+            lines[n] = line
+        return lines
+
+    def put(self, key: bytes, lines: list):
+        blanked = []
+        for line in lines:
+            for name, offset, length, width in SEQUENCE_SPANS.get(line[:3], ()):
+                line = line[:offset] + PLACEHOLDER * width + line[offset + width:]
+            blanked.append(line)
+        self.cache._store(key, "\r\n".join(blanked))
+
+    def flush(self):
+        self.cache.flush()
@@ -1,22 +1,39 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
+import hashlib
+import io
+import itertools
 import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from config import LUMINA_CONFIG, AGREEMENT_MAP
 from cwr_schema import CWR_SCHEMA
+from cwr_trace import NULL_TRACER
+
+def clean_value(value) -> str:
+    val_str = str(value if value is not None else "").strip().upper()
+    return "" if val_str in ['NAN', 'NONE'] else val_str
+
+def clean_column(values: pd.Series) -> pd.Series:
+    val_col = values.str.strip().str.upper()
+    return val_col.mask(val_col.isin(['NAN', 'NONE']), "")
+
+def truncation_error(data_dict: dict, field_name: str, length: int) -> ValueError:
+    track_info = data_dict.get('title', 'Unknown Track')
+    return ValueError(
+        f"CRITICAL: Data truncation prevented. Track '{track_info}' - Field '{field_name}' "
+        f"exceeds max length of {length}. Automation halted."
+    )
 
 class FormatterEngine:
     def stamp(self, canvas: list, position: int, length: int, value: str, data_type: str, pad_char: str, field_name: str, data_dict: dict):
         start_idx = position - 1
-        val_str = str(value if value is not None else "").strip().upper()
-        if val_str in ['NAN', 'NONE']: val_str = ""
+        val_str = clean_value(value)
         
         # Data Integrity Firewall: Check length BEFORE padding
         if len(val_str) > length:
-            track_info = data_dict.get('title', 'Unknown Track')
-            raise ValueError(
-                f"CRITICAL: Data truncation prevented. Track '{track_info}' - Field '{field_name}' "
-                f"exceeds max length of {length}. Automation halted."
-            )
+            raise truncation_error(data_dict, field_name, length)
             
         if data_type == "numeric":
             padded_val = val_str.zfill(length)[:length]
@@ -27,13 +44,90 @@ class FormatterEngine:
             if pos < len(canvas): canvas[pos] = char
 
     def build(self, record_type: str, data_dict: dict) -> str:
-        record_def = CWR_SCHEMA.get(record_type)
-        if not record_def: raise ValueError(f"Schema not found for: {record_type}")
+        record = COMPILED_SCHEMA.get(record_type)
+        if not record: raise ValueError(f"Schema not found for: {record_type}")
+        return record.render(data_dict)
+
+class CompiledRecord:
+    """A RecordDef with its constants pre-stamped into a template and its
+    variable fields reduced to (name, offset, length, width, numeric, pad) slots."""
+
+    def __init__(self, record_def):
+        self.type = record_def.type
+        self.length = record_def.length
+        ordered = sorted(record_def.fields, key=lambda f: f.start)
+        for prev, field in zip(ordered, ordered[1:]):
+            if field.start < prev.start + prev.length:
+                raise ValueError(f"Schema overlap in {self.type}: Field '{field.name}' starts inside '{prev.name}'.")
+
         canvas = [' '] * record_def.length
+        variable = []
         for field in record_def.fields:
-            val = field.name if field.is_constant else data_dict.get(field.name, "")
-            self.stamp(canvas, field.start, field.length, val, field.data_type, field.pad_char, field.name, data_dict)
-        return "".join(canvas)
+            if field.is_constant:
+                FormatterEngine().stamp(canvas, field.start, field.length, field.name, field.data_type, field.pad_char, field.name, {})
+            else:
+                variable.append(field)
+        self.template = "".join(canvas)
+
+        # Fields are written left to right, so every variable slot owns the gap before it.
+        self.slots = []
+        self.gaps = []
+        cursor = 0
+        for field in sorted(variable, key=lambda f: f.start):
+            offset = field.start - 1
+            width = max(0, min(field.length, self.length - offset))
+            self.gaps.append(self.template[cursor:offset] if width else "")
+            self.slots.append((field.name, offset, field.length, width, field.data_type == "numeric", field.pad_char))
+            if width: cursor = offset + width
+        self.tail = self.template[cursor:]
+
+    def render(self, data_dict: dict) -> str:
+        parts = []
+        for gap, (name, offset, length, width, numeric, pad_char) in zip(self.gaps, self.slots):
+            val_str = clean_value(data_dict.get(name, ""))
+            # Data Integrity Firewall: Check length BEFORE padding
+            if len(val_str) > length:
+                raise truncation_error(data_dict, name, length)
+            if not width: continue
+            parts.append(gap)
+            parts.append((val_str.zfill(length) if numeric else val_str.ljust(length, pad_char))[:width])
+        parts.append(self.tail)
+        return "".join(parts)
+
+    def render_columns(self, data: dict, size: int, render: bool = True):
+        """Column-wise render(): `data` maps field names to string Series (all sharing one index) or scalars.
+        Returns the rendered lines and the firewall violations as (field_order, field_name, length, mask).
+        With render=False only the firewall runs and the lines come back as None."""
+        lines = ""
+        violations = []
+        for field_order, (gap, (name, offset, length, width, numeric, pad_char)) in enumerate(zip(self.gaps, self.slots)):
+            value = data.get(name, "")
+            if isinstance(value, pd.Series):
+                # Normalize and pad each distinct value once, then broadcast back by code
+                codes, uniques = pd.factorize(value, use_na_sentinel=False)
+                val_col = clean_column(pd.Series(uniques, dtype=object))
+                too_long_u = (val_col.str.len() > length).to_numpy()
+                if not render:
+                    if too_long_u.any(): violations.append((field_order, name, length, too_long_u[codes]))
+                    continue
+                padded_u = val_col.str.zfill(length) if numeric else val_col.str.ljust(length, pad_char)
+                if width < length or too_long_u.any(): padded_u = padded_u.str[:width]
+                too_long = too_long_u[codes]
+                if too_long.any(): violations.append((field_order, name, length, too_long))
+                padded = pd.Series(padded_u.to_numpy(dtype=object)[codes], index=value.index, dtype=object)
+            else:
+                val_str = clean_value(value)
+                if len(val_str) > length: violations.append((field_order, name, length, np.ones(size, dtype=bool)))
+                if not render: continue
+                padded = (val_str.zfill(length) if numeric else val_str.ljust(length, pad_char))[:width]
+            if not width: continue
+            lines = lines + gap + padded
+        if not render: return None, violations
+        lines = lines + self.tail
+        if not isinstance(lines, pd.Series): lines = pd.Series([lines] * size, dtype=object)
+        return lines, violations
+
+COMPILED_SCHEMA = {record_type: CompiledRecord(record_def) for record_type, record_def in CWR_SCHEMA.items()}
 
 def fmt_share(v): 
     try: return f"{int(round(float(v)*100)):05d}"
@@ -42,121 +136,557 @@ def fmt_share(v):
 def pad_ipi(v):
     return re.sub(r'\D', '', str(v)).zfill(11) if v and str(v).upper() != 'NAN' else "00000000000"
 
-def generate_cwr_content(df, agreement_map=None):
-    df.columns = [str(c).strip().upper() for c in df.columns]
-    REQUIRED = ['TRACK: TITLE', 'CODE: ISRC', 'ALBUM: CODE', 'LIBRARY: NAME']
+class AgreementResolver:
+    """Publisher name -> agreement number. Same precedence as a linear scan of the
+    map: the earliest key (in map order) contained in the name, case-insensitive."""
 
-    for col in REQUIRED:
-        if col not in df.columns: raise KeyError(f"MANDATORY COLUMN MISSING: {col}")
+    def __init__(self, agreement_map: dict):
+        self._index = {}
+        for pos, (k, v) in enumerate(agreement_map.items()):
+            self._index.setdefault(k.upper(), (pos, v))
+        self._lengths = sorted({len(k) for k in self._index})
+        self._memo = {}
 
-    lines = []
-    engine = FormatterEngine()
-    now = datetime.utcnow()
-    full_ipi = str(LUMINA_CONFIG.get("ipi", "00000000000")).zfill(11)
-    active_map = agreement_map if agreement_map is not None else AGREEMENT_MAP
+    def __len__(self):
+        return len(self._index)
 
-    # HDR/GRH
-    lines.append(engine.build("HDR", {"sender_ipi_short": full_ipi[-9:], "sender_name": LUMINA_CONFIG.get("name", "LUMINA"), "creation_date": now.strftime("%Y%m%d"), "creation_time": now.strftime("%H%M%S"), "transmission_date": now.strftime("%Y%m%d")}))
-    lines.append(engine.build("GRH", {}))
+    def fingerprint(self) -> str:
+        # Stable digest of the effective map (first position wins per upper-cased key).
+        return hashlib.sha256(repr(sorted(self._index.items())).encode("utf-8")).hexdigest()
+
+    def resolve(self, p_name: str) -> str:
+        name = p_name.upper()
+        if name in self._memo: return self._memo[name]
+        # Probe every substring whose length matches some key: O(len(name) x distinct key lengths)
+        best = None
+        for n in self._lengths:
+            if n > len(name): break
+            for start in range(len(name) - n + 1):
+                hit = self._index.get(name[start:start + n])
+                if hit is not None and (best is None or hit[0] < best[0]): best = hit
+        agr = best[1] if best is not None else ""
+        self._memo[name] = agr
+        return agr
+
+SLOT_PATTERN = re.compile(r"^(PUBLISHER|WRITER):([1-9][0-9]*): (.+)$")
+PUBLISHER_FIELDS = ("NAME", "OWNER PERFORMANCE SHARE %", "IPI", "PRO", "MRO")
+WRITER_FIELDS = ("LAST NAME", "FIRST NAME", "OWNER PERFORMANCE SHARE %", "IPI", "PRO", "MRO", "SRO", "ORIGINAL PUBLISHER")
+
+class ColumnPlan:
+    """Built once per header: every column the engine reads, as an integer column
+    position (None if absent), with PUBLISHER:n: / WRITER:n: slots discovered
+    from the header instead of probed."""
+
+    def __init__(self, columns):
+        positions = {}
+        for pos, col in enumerate(columns):
+            positions.setdefault(col, pos)
+        self.title = positions['TRACK: TITLE']
+        self.isrc = positions['CODE: ISRC']
+        self.album = positions['ALBUM: CODE']
+        self.library = positions['LIBRARY: NAME']
 
-    for i, row in df.iterrows():
-        t_seq = f"{i:08d}"
-        rec_seq = 1
-        pub_map = {}
+        slots = {"PUBLISHER": {}, "WRITER": {}}
+        for col, pos in positions.items():
+            m = SLOT_PATTERN.match(col)
+            if m: slots[m.group(1)].setdefault(int(m.group(2)), {})[m.group(3)] = pos
+        # (slot, *column positions in *_FIELDS order), ascending by slot number
+        self.publishers = [(idx, *(fields.get(f) for f in PUBLISHER_FIELDS)) for idx, fields in sorted(slots["PUBLISHER"].items())]
+        self.writers = [(idx, *(fields.get(f) for f in WRITER_FIELDS)) for idx, fields in sorted(slots["WRITER"].items())]
+
+def sequence_values(i) -> dict:
+    # Per-transaction sequence fields, all derived from the row index label.
+    return {"t_seq": f"{i:08d}", "work_id": f"{i+1:014d}", "cut_number": f"{i+1:04d}"}
+
+def _render_rows(df, plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str, engine: FormatterEngine, cache=None):
+    # Row loop: one NWR..ORN transaction per DataFrame row, in index order. With
+    # a bound transaction cache (see cwr_cache), unchanged rows are spliced from
+    # the cache and only new or edited rows are rendered.
+    rows = zip(df.index, df.itertuples(index=False, name=None))
+    if cache is None:
+        for i, row in rows:
+            yield from _render_transaction(i, row, plan, resolver, full_ipi, engine)
+        return
+    try:
+        for i, row in rows:
+            key = cache.key(row)
+            lines = cache.get(key, i)
+            if lines is None:
+                lines = list(_render_transaction(i, row, plan, resolver, full_ipi, engine))
+                cache.put(key, lines)
+            yield from lines
+    finally:
+        cache.flush()
+
+def _render_transaction(i, row, plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str, engine: FormatterEngine):
+    # Slot columns missing from the header fall back to the defaults row.get() used.
+    seq = sequence_values(i)
+    rec_seq = 1
+    pub_map = {}
+    
+    work_data = {"title": row[plan.title], "t_seq": seq["t_seq"], "work_id": seq["work_id"], "isrc": row[plan.isrc]}
+    yield engine.build("NWR", work_data)
+    
+    # Publisher Loop
+    for p_idx, c_name, c_share, c_ipi, c_pro, c_mro in plan.publishers:
+        p_name = str(row[c_name]).strip() if c_name is not None else ""
+        if not p_name or p_name.upper() in ['NAN', 'NONE']: continue
         
-        work_data = {"title": row['TRACK: TITLE'], "t_seq": t_seq, "work_id": f"{i+1:014d}", "isrc": row['CODE: ISRC']}
-        lines.append(engine.build("NWR", work_data))
+        agr = resolver.resolve(p_name)
+        if not agr: raise KeyError(f"Missing Agreement for '{p_name}'")
         
-        # Publisher Loop
-        for p_idx in range(1, 4):
-            p_name = str(row.get(f"PUBLISHER:{p_idx}: NAME", "")).strip()
-            if not p_name or p_name.upper() in ['NAN', 'NONE']: continue
-            
-            agr = next((v for k, v in active_map.items() if k.upper() in p_name.upper()), "")
-            if not agr: raise KeyError(f"Missing Agreement for '{p_name}'")
-            
-            pr_share = fmt_share(row.get(f"PUBLISHER:{p_idx}: OWNER PERFORMANCE SHARE %", "0"))
-            p_ipi = pad_ipi(row.get(f"PUBLISHER:{p_idx}: IPI", "00000000000"))
-            p_pr_soc = str(row.get(f"PUBLISHER:{p_idx}: PRO", "021")).split('.')[0].zfill(3)
-            p_mr_soc = str(row.get(f"PUBLISHER:{p_idx}: MRO", "021")).split('.')[0].zfill(3)
-            p_mr_soc = str(row.get(f"PUBLISHER:{p_idx}: MRO", "021")).split('.')[0].zfill(3)
-            # DO NOT RE-INTRODUCE sr_soc OR sr_share HERE. SPU Share Block must be exactly 16 digits long.
-            lines.append(engine.build("SPU", {
-                **work_data, "rec_seq": f"{rec_seq:08d}", "chain_id": f"{p_idx:02d}",
-                "pub_id": f"00000000{p_idx}", "pub_name": p_name, "role": "E ", "ipi": p_ipi,
-                "pr_soc": p_pr_soc if p_pr_soc != "000" and p_pr_soc.upper() != "NAN" else "021",
-                "mr_soc": p_mr_soc if p_mr_soc != "000" and p_mr_soc.upper() != "NAN" else "021",
-                # DO NOT RE-INTRODUCE sr_share INTO SPU RECORD
-                "pr_share": pr_share, "mr_share": "10000", 
-                "agreement_1": agr, "agreement_2": agr
-            }))
-            rec_seq += 1
-            
-            lum_id = "000000012"
-            lines.append(engine.build("SPU", {
-                **work_data, "rec_seq": f"{rec_seq:08d}", "chain_id": f"{p_idx:02d}",
-                "pub_id": lum_id, "pub_name": LUMINA_CONFIG.get('name', 'LUMINA'), "role": "SE", "ipi": full_ipi,
-                "pr_soc": "052", "mr_soc": "033", 
-                "pr_share": "00000", "mr_share": "00000",
-                "agreement_1": agr, "agreement_2": agr
-            }))
-            rec_seq += 1
-            
-            lines.append(engine.build("SPT", {
-                **work_data, "rec_seq": f"{rec_seq:08d}", "pub_id": lum_id,
-                "pr_share": pr_share, "mr_share": "10000", "sr_share": "10000",
-                "territory": LUMINA_CONFIG.get('territory', '2136')
-            }))
-            rec_seq += 1
-            
-            pub_map[p_name.upper()] = {"chain": f"{p_idx:02d}", "id": f"00000000{p_idx}", "agr": agr}
+        pr_share = fmt_share(row[c_share] if c_share is not None else "0")
+        p_ipi = pad_ipi(row[c_ipi] if c_ipi is not None else "00000000000")
+        p_pr_soc = str(row[c_pro] if c_pro is not None else "021").split('.')[0].zfill(3)
+        p_mr_soc = str(row[c_mro] if c_mro is not None else "021").split('.')[0].zfill(3)
+        p_id = f"{p_idx:09d}"
+        # DO NOT RE-INTRODUCE sr_soc OR sr_share HERE. SPU Share Block must be exactly 16 digits long.
+        yield engine.build("SPU", {
+            **work_data, "rec_seq": f"{rec_seq:08d}", "chain_id": f"{p_idx:02d}",
+            "pub_id": p_id, "pub_name": p_name, "role": "E ", "ipi": p_ipi,
+            "pr_soc": p_pr_soc if p_pr_soc != "000" and p_pr_soc.upper() != "NAN" else "021",
+            "mr_soc": p_mr_soc if p_mr_soc != "000" and p_mr_soc.upper() != "NAN" else "021",
+            # DO NOT RE-INTRODUCE sr_share INTO SPU RECORD
+            "pr_share": pr_share, "mr_share": "10000", 
+            "agreement_1": agr, "agreement_2": agr
+        })
+        rec_seq += 1
+        
+        lum_id = "000000012"
+        yield engine.build("SPU", {
+            **work_data, "rec_seq": f"{rec_seq:08d}", "chain_id": f"{p_idx:02d}",
+            "pub_id": lum_id, "pub_name": LUMINA_CONFIG.get('name', 'LUMINA'), "role": "SE", "ipi": full_ipi,
+            "pr_soc": "052", "mr_soc": "033", 
+            "pr_share": "00000", "mr_share": "00000",
+            "agreement_1": agr, "agreement_2": agr
+        })
+        rec_seq += 1
+        
+        yield engine.build("SPT", {
+            **work_data, "rec_seq": f"{rec_seq:08d}", "pub_id": lum_id,
+            "pr_share": pr_share, "mr_share": "10000", "sr_share": "10000",
+            "territory": LUMINA_CONFIG.get('territory', '2136')
+        })
+        rec_seq += 1
+        
+        pub_map[p_name.upper()] = {"chain": f"{p_idx:02d}", "id": p_id, "agr": agr}
 
-        # Writer Loop
-        for w_idx in range(1, 4):
-            w_last = str(row.get(f"WRITER:{w_idx}: LAST NAME", "")).strip()
-            if not w_last or w_last.upper() in ['NAN', 'NONE']: continue
-            w_first = str(row.get(f"WRITER:{w_idx}: FIRST NAME", "")).strip()
-            
-            w_share = fmt_share(row.get(f"WRITER:{w_idx}: OWNER PERFORMANCE SHARE %", "0"))
-            w_ipi = pad_ipi(row.get(f"WRITER:{w_idx}: IPI", "00000000000"))
-            w_pr_soc = str(row.get(f"WRITER:{w_idx}: PRO", "021")).split('.')[0].zfill(3)
-            w_mr_soc = str(row.get(f"WRITER:{w_idx}: MRO", "099")).split('.')[0].zfill(3)
-            w_sr_soc = str(row.get(f"WRITER:{w_idx}: SRO", "099")).split('.')[0].zfill(3)
-
-            lines.append(engine.build("SWR", {
-                **work_data, "rec_seq": f"{rec_seq:08d}", "writer_id": f"00000000{w_idx}",
-                "last_name": w_last, "first_name": "" if w_first.upper() in ["NAN", "NONE"] else w_first,
-                "ipi": w_ipi,
-                "pr_soc": w_pr_soc if w_pr_soc != "000" and w_pr_soc.upper() != "NAN" else "021",
-                "mr_soc": w_mr_soc if w_mr_soc != "000" and w_mr_soc.upper() != "NAN" else "099",
-                "sr_soc": w_sr_soc if w_sr_soc != "000" and w_sr_soc.upper() != "NAN" else "099",
-                "pr_share": w_share, "mr_share": "00000", "sr_share": "00000"
-            }))
-            rec_seq += 1
-            
-            lines.append(engine.build("SWT", {
-                **work_data, "rec_seq": f"{rec_seq:08d}", "writer_id": f"00000000{w_idx}",
-                "pr_share": w_share, "mr_share": "00000", "sr_share": "00000"
-            }))
-            rec_seq += 1
-            
-            orig_pub = str(row.get(f"WRITER:{w_idx}: ORIGINAL PUBLISHER", "")).strip().upper()
-            if orig_pub not in ["", "NAN", "NONE"] and orig_pub in pub_map:
-                p_i = pub_map[orig_pub]
-                lines.append(engine.build("PWR", {
-                    **work_data, "rec_seq": f"{rec_seq:08d}", "pub_id": p_i['id'],
-                    "pub_name": orig_pub[:45], "agreement": p_i['agr'], "writer_id": f"00000000{w_idx}",
-                    "chain_id": p_i['chain']
-                }))
-                rec_seq += 1
-
-        label = str(row['LIBRARY: NAME'])
-        cat = str(row['ALBUM: CODE'])
-        lines.append(engine.build("REC", {**work_data, "rec_seq": f"{rec_seq:08d}", "cd_id": cat, "source": "CD", "label": label}))
+    # Writer Loop
+    for w_idx, c_last, c_first, c_share, c_ipi, c_pro, c_mro, c_sro, c_orig in plan.writers:
+        w_last = str(row[c_last]).strip() if c_last is not None else ""
+        if not w_last or w_last.upper() in ['NAN', 'NONE']: continue
+        w_first = str(row[c_first]).strip() if c_first is not None else ""
+        
+        w_share = fmt_share(row[c_share] if c_share is not None else "0")
+        w_ipi = pad_ipi(row[c_ipi] if c_ipi is not None else "00000000000")
+        w_pr_soc = str(row[c_pro] if c_pro is not None else "021").split('.')[0].zfill(3)
+        w_mr_soc = str(row[c_mro] if c_mro is not None else "099").split('.')[0].zfill(3)
+        w_sr_soc = str(row[c_sro] if c_sro is not None else "099").split('.')[0].zfill(3)
+        w_id = f"{w_idx:09d}"
+
+        yield engine.build("SWR", {
+            **work_data, "rec_seq": f"{rec_seq:08d}", "writer_id": w_id,
+            "last_name": w_last, "first_name": "" if w_first.upper() in ["NAN", "NONE"] else w_first,
+            "ipi": w_ipi,
+            "pr_soc": w_pr_soc if w_pr_soc != "000" and w_pr_soc.upper() != "NAN" else "021",
+            "mr_soc": w_mr_soc if w_mr_soc != "000" and w_mr_soc.upper() != "NAN" else "099",
+            "sr_soc": w_sr_soc if w_sr_soc != "000" and w_sr_soc.upper() != "NAN" else "099",
+            "pr_share": w_share, "mr_share": "00000", "sr_share": "00000"
+        })
         rec_seq += 1
-        lines.append(engine.build("ORN", {**work_data, "rec_seq": f"{rec_seq:08d}", "library": label, "cd_id": cat, "cut_number": f"{i+1:04d}", "label": label}))
         
-    grp_count = len(lines)
-    lines.append(engine.build("GRT", {"t_count": f"{len(df):08d}", "r_count": f"{grp_count:08d}"}))
-    lines.append(engine.build("TRL", {"t_count": f"{len(df):08d}", "r_count": f"{grp_count+1:08d}"}))
-    return "\r\n".join(lines) + "\r\n", []
+        yield engine.build("SWT", {
+            **work_data, "rec_seq": f"{rec_seq:08d}", "writer_id": w_id,
+            "pr_share": w_share, "mr_share": "00000", "sr_share": "00000"
+        })
+        rec_seq += 1
+        
+        orig_pub = str(row[c_orig]).strip().upper() if c_orig is not None else ""
+        if orig_pub not in ["", "NAN", "NONE"] and orig_pub in pub_map:
+            p_i = pub_map[orig_pub]
+            yield engine.build("PWR", {
+                **work_data, "rec_seq": f"{rec_seq:08d}", "pub_id": p_i['id'],
+                "pub_name": orig_pub[:45], "agreement": p_i['agr'], "writer_id": w_id,
+                "chain_id": p_i['chain']
+            })
+            rec_seq += 1
+
+    label = str(row[plan.library])
+    cat = str(row[plan.album])
+    yield engine.build("REC", {**work_data, "rec_seq": f"{rec_seq:08d}", "cd_id": cat, "source": "CD", "label": label})
+    rec_seq += 1
+    yield engine.build("ORN", {**work_data, "rec_seq": f"{rec_seq:08d}", "library": label, "cd_id": cat, "cut_number": seq["cut_number"], "label": label})
+
+GENERATION_MODES = ("rows", "vectorized")
+
+# ==============================================================================
+# SHARDED MODE
+# ==============================================================================
+# Transaction blocks only depend on their own row (t_seq, work_id and cut_number
+# come from the row index), so row ranges render independently. Shards are
+# merged back strictly in submission order; HDR/GRH/GRT/TRL and the record
+# counts are applied by the caller at merge time.
+
+DEFAULT_SHARD_SIZE = 2_000
+
+def _render_shard(df, plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str, mode: str, engine: FormatterEngine = None) -> list:
+    if mode == "vectorized": return _render_vectorized(df, plan, resolver, full_ipi)
+    return list(_render_rows(df, plan, resolver, full_ipi, engine or FormatterEngine()))
+
+# Per-worker render context, set once by the pool initializer so each shard
+# submission only pickles its own rows, not the plan and resolver.
+_WORKER = {}
+
+def _init_worker(plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str, mode: str):
+    _WORKER.update(plan=plan, resolver=resolver, full_ipi=full_ipi, mode=mode, engine=FormatterEngine())
+
+def _render_worker_shard(df) -> list:
+    return _render_shard(df, **_WORKER)
+
+def _render_parallel(chunks, plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str, mode: str, workers: int, shard_size: int):
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(plan, resolver, full_ipi, mode))
+    pending = deque()
+    try:
+        for chunk in chunks:
+            for start in range(0, len(chunk), shard_size):
+                pending.append(pool.submit(_render_worker_shard, chunk.iloc[start:start + shard_size]))
+                # Bounded look-ahead keeps memory flat on chunked input
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+# ==============================================================================
+# VECTORIZED MODE
+# ==============================================================================
+# Column-wise twin of the row loop in generate_cwr_content. Every field is
+# normalized and padded for all rows at once, each record family is rendered as
+# one column, and the columns are interleaved back into transaction order by
+# (row position, rec_seq). Output and the first raised error are byte-identical
+# to the row loop.
+
+def _text(values: pd.Series) -> pd.Series:
+    # Exact str() of every cell; astype(str) leaves missing cells missing on pandas 3.
+    text = values.astype(str).astype(object)
+    missing = text.isna().to_numpy()
+    if missing.any():
+        text[missing] = [str(v) for v in values.to_numpy(dtype=object)[missing]]
+    return text
+
+def _column(df, pos: int, default: str) -> pd.Series:
+    if pos is not None: return _text(df.iloc[:, pos])
+    return pd.Series([default] * len(df), index=df.index, dtype=object)
+
+def _map_unique(df, pos: int, default: str, fn) -> pd.Series:
+    if pos is None: return pd.Series([fn(default)] * len(df), index=df.index, dtype=object)
+    codes, uniques = pd.factorize(df.iloc[:, pos], use_na_sentinel=False)
+    mapped = np.array([fn(u) for u in uniques] or [""], dtype=object)
+    return pd.Series(mapped[codes], index=df.index, dtype=object)
+
+def _soc(df, pos: int, default: str, fallback: str) -> pd.Series:
+    codes, uniques = pd.factorize(_column(df, pos, default), use_na_sentinel=False)
+    soc = pd.Series(uniques, dtype=object).str.split('.', n=1).str[0].str.zfill(3)
+    soc = soc.where((soc != "000") & (soc.str.upper() != "NAN"), fallback)
+    return pd.Series(soc.to_numpy(dtype=object)[codes], index=df.index, dtype=object)
+
+def _is_blank(values: pd.Series) -> np.ndarray:
+    return ((values == "") | values.str.upper().isin(['NAN', 'NONE'])).to_numpy()
+
+def _seq_column(seqs: np.ndarray, index) -> pd.Series:
+    return pd.Series(seqs, index=index).astype(str).astype(object).str.zfill(8)
+
+def _share_error(v) -> bool:
+    # A non-blank share fmt_share would silently write as 00000, or one outside 0-100%.
+    if clean_value(v) == "": return False
+    try: return not 0 <= int(round(float(v) * 100)) <= 10000
+    except (TypeError, ValueError, OverflowError): return True
+
+def _render_vectorized(df, plan: ColumnPlan, resolver: AgreementResolver, full_ipi: str, collect: list = None) -> list:
+    # With a `collect` list nothing is rendered: every violation is appended to it
+    # as a dict, in the order the row loop would have hit them, and share values
+    # are checked too (generation writes unparseable ones as 00000).
+    labels = df.index.tolist()
+    df = df.reset_index(drop=True)
+    size = len(df)
+    positions = np.arange(size)
+    cur = np.ones(size, dtype=np.int64)
+    title = _text(df.iloc[:, plan.title])
+    work = {
+        "title": title,
+        "t_seq": pd.Series([f"{i:08d}" for i in labels], dtype=object),
+        "work_id": pd.Series([f"{i+1:014d}" for i in labels], dtype=object),
+        "isrc": _text(df.iloc[:, plan.isrc]),
+    }
+    blocks = []
+    violations = []  # (row position, rec_seq, field order, record type, field, value, level, error factory)
+
+    def emit(record_type, mask, seqs, data):
+        if not mask.any(): return
+        rows = positions[mask]
+        sub = {k: (v[mask] if isinstance(v, pd.Series) else v) for k, v in {**work, **data}.items()}
+        sub["rec_seq"] = _seq_column(seqs[mask], rows)
+        lines, bad = COMPILED_SCHEMA[record_type].render_columns(sub, len(rows), render=collect is None)
+        for field_order, name, length, too_long in bad:
+            value = sub.get(name, "")
+            for r, seq in zip(rows[too_long], seqs[mask][too_long]):
+                violations.append((r, seq, field_order, record_type, name, value[r] if isinstance(value, pd.Series) else value, "CRITICAL",
+                                   lambda r=r, name=name, length=length: truncation_error({"title": title[r]}, name, length)))
+        if collect is None: blocks.append((rows, seqs[mask], lines.to_numpy(dtype=object)))
+
+    def check_share(record_type, pos, present, seqs):
+        if collect is None or pos is None: return
+        bad = present & _map_unique(df, pos, "0", _share_error).to_numpy(dtype=bool)
+        col = df.columns[pos]
+        for r in positions[bad]:
+            value = df.iat[r, pos]
+            violations.append((r, seqs[r], -1, record_type, col, value, "WARNING",
+                               lambda r=r, value=value: ValueError(f"CRITICAL: Track '{title[r]}' - Field '{col}' is not a valid share ('{value}').")))
+
+    everyone = np.ones(size, dtype=bool)
+    emit("NWR", everyone, np.zeros(size, dtype=np.int64), {})
+
+    # Publisher Slots
+    lum_id = "000000012"
+    pub_slots = []
+    for p_idx, c_name, c_share, c_ipi, c_pro, c_mro in plan.publishers:
+        p_name = _column(df, c_name, "").str.strip()
+        present = ~_is_blank(p_name)
+        if not present.any(): continue
+        lookup = {name: resolver.resolve(name) for name in p_name[present].unique()}
+        agr = p_name.map(lookup).where(present, "")
+        for r in positions[present & (agr == "").to_numpy()]:
+            violations.append((r, cur[r], -1, "SPU", df.columns[c_name], p_name[r], "CRITICAL", lambda name=p_name[r]: KeyError(f"Missing Agreement for '{name}'")))
+        check_share("SPU", c_share, present, cur)
+
+        pr_share = _map_unique(df, c_share, "0", fmt_share)
+        shared = {"chain_id": f"{p_idx:02d}", "agreement_1": agr, "agreement_2": agr}
+        emit("SPU", present, cur, {
+            **shared, "pub_id": f"{p_idx:09d}", "pub_name": p_name, "role": "E ",
+            "ipi": _map_unique(df, c_ipi, "00000000000", pad_ipi),
+            "pr_soc": _soc(df, c_pro, "021", "021"),
+            "mr_soc": _soc(df, c_mro, "021", "021"),
+            "pr_share": pr_share, "mr_share": "10000"
+        })
+        emit("SPU", present, cur + 1, {
+            **shared, "pub_id": lum_id, "pub_name": LUMINA_CONFIG.get('name', 'LUMINA'), "role": "SE", "ipi": full_ipi,
+            "pr_soc": "052", "mr_soc": "033", "pr_share": "00000", "mr_share": "00000"
+        })
+        emit("SPT", present, cur + 2, {
+            "pub_id": lum_id, "pr_share": pr_share, "mr_share": "10000", "sr_share": "10000",
+            "territory": LUMINA_CONFIG.get('territory', '2136')
+        })
+        cur = cur + 3 * present
+        pub_slots.append((p_idx, present, p_name.str.upper(), agr))
+
+    # Writer Slots
+    for w_idx, c_last, c_first, c_share, c_ipi, c_pro, c_mro, c_sro, c_orig in plan.writers:
+        w_last = _column(df, c_last, "").str.strip()
+        present = ~_is_blank(w_last)
+        if not present.any(): continue
+        w_first = _column(df, c_first, "").str.strip()
+        w_share = _map_unique(df, c_share, "0", fmt_share)
+        check_share("SWR", c_share, present, cur)
+        writer_id = f"{w_idx:09d}"
+        emit("SWR", present, cur, {
+            "writer_id": writer_id, "last_name": w_last, "first_name": w_first.mask(_is_blank(w_first), ""),
+            "ipi": _map_unique(df, c_ipi, "00000000000", pad_ipi),
+            "pr_soc": _soc(df, c_pro, "021", "021"),
+            "mr_soc": _soc(df, c_mro, "099", "099"),
+            "sr_soc": _soc(df, c_sro, "099", "099"),
+            "pr_share": w_share, "mr_share": "00000", "sr_share": "00000"
+        })
+        emit("SWT", present, cur + 1, {"writer_id": writer_id, "pr_share": w_share, "mr_share": "00000", "sr_share": "00000"})
+
+        # Later publisher slots with the same name win, exactly like pub_map in the row loop
+        orig_pub = _column(df, c_orig, "").str.strip().str.upper()
+        pwr = np.zeros(size, dtype=bool)
+        chain = pd.Series([""] * size, dtype=object)
+        pub_id = chain.copy()
+        agreement = chain.copy()
+        for p_idx, p_present, p_upper, p_agr in pub_slots:
+            hit = p_present & (p_upper == orig_pub).to_numpy()
+            pwr |= hit
+            chain[hit] = f"{p_idx:02d}"
+            pub_id[hit] = f"{p_idx:09d}"
+            agreement[hit] = p_agr[hit]
+        pwr &= present
+        emit("PWR", pwr, cur + 2, {
+            "pub_id": pub_id, "pub_name": orig_pub.str[:45], "agreement": agreement,
+            "writer_id": writer_id, "chain_id": chain
+        })
+        cur = cur + 2 * present + pwr
+
+    label = _text(df.iloc[:, plan.library])
+    cat = _text(df.iloc[:, plan.album])
+    emit("REC", everyone, cur, {"cd_id": cat, "source": "CD", "label": label})
+    emit("ORN", everyone, cur + 1, {
+        "library": label, "cd_id": cat, "label": label,
+        "cut_number": pd.Series([f"{i+1:04d}" for i in labels], dtype=object)
+    })
+
+    if collect is not None:
+        for r, seq, _, record_type, field, value, level, error in sorted(violations, key=lambda v: v[:3]):
+            collect.append({"level": level, "row": labels[r] + 1, "record": record_type, "field": field, "value": value, "message": error().args[0]})
+        return []
+    if violations:
+        raise min(violations, key=lambda v: v[:3])[-1]()
+    if not blocks: return []
+    rows = np.concatenate([b[0] for b in blocks])
+    seqs = np.concatenate([b[1] for b in blocks])
+    lines = np.concatenate([b[2] for b in blocks])
+    return lines[np.lexsort((seqs, rows))].tolist()
+
+REQUIRED_COLUMNS = ['TRACK: TITLE', 'CODE: ISRC', 'ALBUM: CODE', 'LIBRARY: NAME']
+
+def _open_frames(df):
+    # ColumnPlan of the first chunk plus every chunk with normalized headers.
+    chunks = iter([df] if isinstance(df, pd.DataFrame) else df)
+    first = next(chunks, None)
+    if first is None: first = pd.DataFrame()
+    first.columns = [str(c).strip().upper() for c in first.columns]
+
+    for col in REQUIRED_COLUMNS:
+        if col not in first.columns: raise KeyError(f"MANDATORY COLUMN MISSING: {col}")
+
+    def normalized():
+        for chunk in itertools.chain([first], chunks):
+            chunk.columns = [str(c).strip().upper() for c in chunk.columns]
+            yield chunk
+    return ColumnPlan(first.columns), normalized()
+
+def _active_resolver(agreement_map) -> AgreementResolver:
+    active_map = agreement_map if agreement_map is not None else AGREEMENT_MAP
+    return active_map if isinstance(active_map, AgreementResolver) else AgreementResolver(active_map)
+
+def check_cwr(df, agreement_map=None, tracer=NULL_TRACER) -> list:
+    # Dry run of the whole catalog: every firewall (length), agreement and share
+    # check, collected instead of raised, without rendering a single record.
+    # Returns dicts (level, row, record, field, value, message) ordered by row;
+    # `row` is the 1-based row label. CRITICAL entries carry the message
+    # generation would raise; WARNING entries are shares written as 00000 or
+    # outside 0-100%, which generation lets through.
+    plan, frames = _open_frames(df)
+    resolver = _active_resolver(agreement_map)
+    full_ipi = str(LUMINA_CONFIG.get("ipi", "00000000000")).zfill(11)
+    violations = []
+    with tracer.span("engine.dry_run") as span:
+        for chunk in frames:
+            _render_vectorized(chunk, plan, resolver, full_ipi, collect=violations)
+            span.add(rows=len(chunk))
+    return violations
+
+def iter_cwr_lines(df, agreement_map=None, mode="rows", workers=None, shard_size=DEFAULT_SHARD_SIZE, cache=None):
+    # Streams every record of the transmission in order. GRT/TRL are counted on
+    # the fly, so the full file never has to exist in memory. `df` may also be an
+    # iterable of DataFrame chunks (see cwr_ingest.read_csv_chunks) whose index
+    # continues across chunks. workers > 1 renders row shards in a process pool.
+    # `cache` (a cwr_cache.TransactionCache) splices unchanged rows in row mode.
+    if mode not in GENERATION_MODES: raise ValueError(f"Unknown generation mode: {mode}")
+    if cache is not None and (mode != "rows" or (workers and workers > 1)):
+        raise ValueError("The transaction cache requires mode='rows' without workers.")
+    plan, frames = _open_frames(df)
+    engine = FormatterEngine()
+    now = datetime.utcnow()
+    full_ipi = str(LUMINA_CONFIG.get("ipi", "00000000000")).zfill(11)
+    resolver = _active_resolver(agreement_map)
+
+    # HDR/GRH
+    yield engine.build("HDR", {"sender_ipi_short": full_ipi[-9:], "sender_name": LUMINA_CONFIG.get("name", "LUMINA"), "creation_date": now.strftime("%Y%m%d"), "creation_time": now.strftime("%H%M%S"), "transmission_date": now.strftime("%Y%m%d")})
+    yield engine.build("GRH", {})
+    grp_count = 2
+    t_count = 0
+
+    if workers and workers > 1:
+        body = _render_parallel(frames, plan, resolver, full_ipi, mode, workers, shard_size)
+    elif cache is not None:
+        bound = cache.bind(plan, resolver, full_ipi)
+        body = (line for chunk in frames for line in _render_rows(chunk, plan, resolver, full_ipi, engine, bound))
+    else:
+        body = (line for chunk in frames for line in _render_shard(chunk, plan, resolver, full_ipi, mode, engine))
+    for line in body:
+        grp_count += 1
+        if line.startswith("NWR"): t_count += 1
+        yield line
+
+    yield engine.build("GRT", {"t_count": f"{t_count:08d}", "r_count": f"{grp_count:08d}"})
+    yield engine.build("TRL", {"t_count": f"{t_count:08d}", "r_count": f"{grp_count+1:08d}"})
+
+class GenerationStats:
+    """Tallies taken while a transmission is generated, so post-generation
+    checks never have to re-split the output."""
+    REC_SOURCE = next((offset, offset + width) for name, offset, _, width, _, _ in COMPILED_SCHEMA["REC"].slots if name == "source")
+
+    def __init__(self):
+        self.shapes = Counter()       # (record type, line length) -> lines
+        self.rec_sources = Counter()  # stripped REC source field -> lines
+        self.warnings = []
+
+    def observe(self, lines):
+        # Passes `lines` through unchanged, tallying each one.
+        shapes, sources = self.shapes, self.rec_sources
+        lo, hi = self.REC_SOURCE
+        for line in lines:
+            record_type = line[:3]
+            shapes[record_type, len(line)] += 1
+            if record_type == "REC": sources[line[lo:hi].strip()] += 1
+            yield line
+
+    @property
+    def counts(self) -> Counter:
+        counts = Counter()
+        for (record_type, _), n in self.shapes.items():
+            counts[record_type] += n
+        return counts
+
+    def count(self, record_type: str) -> int:
+        return sum(n for (t, _), n in self.shapes.items() if t == record_type)
+
+    def lengths(self, record_type: str) -> dict:
+        # line length -> lines, for one record type
+        return {length: n for (t, length), n in self.shapes.items() if t == record_type}
+
+def write_cwr(fileobj, df, agreement_map=None, mode="rows", workers=None, shard_size=DEFAULT_SHARD_SIZE, buffer_size=1 << 20, cache=None, stats=None, tracer=NULL_TRACER) -> int:
+    # Streams the transmission into a binary (latin-1) or text file handle in
+    # ~buffer_size batches. Returns the number of bytes written. Records already
+    # written stay in the handle if generation halts part way. A GenerationStats
+    # passed as `stats` is filled in as lines are written.
+    binary = not isinstance(fileobj, io.TextIOBase)
+    batch = []
+    pending = 0
+    written = 0
+    records = 0
+    lines = iter_cwr_lines(df, agreement_map=agreement_map, mode=mode, workers=workers, shard_size=shard_size, cache=cache)
+    with tracer.span("engine.write") as span:
+        for line in (stats.observe(lines) if stats is not None else lines):
+            batch.append(line)
+            pending += len(line) + 2
+            if pending >= buffer_size:
+                chunk = "\r\n".join(batch) + "\r\n"
+                fileobj.write(chunk.encode("latin-1") if binary else chunk)
+                written += pending
+                records += len(batch)
+                batch = []
+                pending = 0
+        if batch:
+            chunk = "\r\n".join(batch) + "\r\n"
+            fileobj.write(chunk.encode("latin-1") if binary else chunk)
+            written += pending
+            records += len(batch)
+        span.add(records=records, bytes=written, rows=stats.count("NWR") if stats is not None else 0)
+    return written
+
+def generate_cwr_content(df, agreement_map=None, mode="rows", workers=None, shard_size=DEFAULT_SHARD_SIZE, cache=None, validate_only=False, tracer=NULL_TRACER):
+    # Returns (content, GenerationStats). validate_only=True returns
+    # (None, check_cwr(...)) without generating anything. Stage timings go to
+    # `tracer` (see cwr_trace).
+    if validate_only: return None, check_cwr(df, agreement_map=agreement_map, tracer=tracer)
+    stats = GenerationStats()
+    with tracer.span("engine.render") as span:
+        lines = list(stats.observe(iter_cwr_lines(df, agreement_map=agreement_map, mode=mode, workers=workers, shard_size=shard_size, cache=cache)))
+        span.add(rows=stats.count("NWR"), records=len(lines))
+    with tracer.span("engine.join") as span:
+        content = "\r\n".join(lines) + "\r\n"
+        span.add(records=len(lines), bytes=len(content))
+    return content, stats
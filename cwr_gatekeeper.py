@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# PRE-FLIGHT DATA GATEKEEPER
+# ==============================================================================
+# Column-wise form of the per-row title / ISRC / album / label checks the app
+# runs before the engine. Each field takes the first non-null value among its
+# candidate columns (in header order), and every check is one length mask over
+# the whole frame. All offending rows are returned in a single table, ordered
+# by row and then by check, so operators can fix a CSV in one pass.
+
+GATE_COLUMNS = {
+    "title": ['TRACK: TITLE', 'TITLE', 'TRACK TITLE'],
+    "isrc": ['CODE: ISRC', 'ISRC'],
+    "album": ['ALBUM: CODE', 'ALBUM CODE', 'ALBUM'],
+    "label": ['LIBRARY NAME', 'LABEL', 'LIBRARY: NAME'],
+}
+VIOLATION_COLUMNS = ["row", "field", "value", "message"]
+
+def gate_values(df: pd.DataFrame, names: list) -> pd.Series:
+    # First non-null value per row across the matching columns, as stripped text.
+    positions = [pos for pos, col in enumerate(df.columns) if str(col).upper() in names]
+    if not positions:
+        return pd.Series("", index=df.index, dtype=object)
+    picked = df.iloc[:, positions].astype(object).bfill(axis=1).iloc[:, 0]
+    missing = picked.isna().to_numpy()
+    text = pd.Series([str(v) for v in picked.to_numpy()], index=df.index, dtype=object).str.strip()
+    text[missing] = ""
+    return text
+
+def find_violations(df: pd.DataFrame) -> pd.DataFrame:
+    values = {field: gate_values(df, names) for field, names in GATE_COLUMNS.items()}
+    lengths = {field: col.str.len().to_numpy() for field, col in values.items()}
+    checks = [
+        ("title", lengths["title"] > 60, "CRITICAL: Change the Work Title ('{}'). It exceeds 60 characters."),
+        ("isrc", (lengths["isrc"] > 0) & (lengths["isrc"] != 12), "CRITICAL: Change the ISRC ('{}'). It must be exactly 12 characters."),
+        ("album", lengths["album"] == 0, "CRITICAL: Missing ALBUM: CODE."),
+        ("album", lengths["album"] > 60, "CRITICAL: Change the Album Code ('{}'). It exceeds 60 characters."),
+        ("label", lengths["label"] > 60, "CRITICAL: Change the Label Name ('{}'). It exceeds 60 characters."),
+    ]
+    frames = []
+    for order, (field, mask, template) in enumerate(checks):
+        hits = np.flatnonzero(mask)
+        if not len(hits): continue
+        bad = values[field].iloc[hits]
+        frames.append(pd.DataFrame({
+            "position": hits, "order": order,
+            "row": hits + 1, "field": field, "value": bad.to_numpy(),
+            "message": [template.format(v) for v in bad],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=VIOLATION_COLUMNS)
+    table = pd.concat(frames, ignore_index=True).sort_values(["position", "order"], kind="stable")
+    return table[VIOLATION_COLUMNS].reset_index(drop=True)
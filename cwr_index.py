@@ -0,0 +1,188 @@
+import mmap
+import os
+import numpy as np
+
+# ==============================================================================
+# TRANSMISSION OFFSET INDEX
+# ==============================================================================
+# One vectorized pass over the raw latin-1 bytes records the record type, t_seq
+# and byte span of every non-empty line. Work id, title (NWR) and ISRC (REC) keys
+# are kept as sorted arrays, so lookups are binary searches instead of rescans.
+# The index can be saved next to the .V22 as a sidecar and reloaded while the
+# transmission is unchanged (same size and mtime).
+
+SIDECAR_SUFFIX = ".idx.npz"
+CONTROL_RECORDS = (b"HDR", b"GRH", b"GRT", b"TRL")
+# key -> (record type, start, end) as 0-based slice bounds
+KEY_FIELDS = {
+    "work_id": (b"NWR", 81, 95),
+    "title": (b"NWR", 19, 79),
+    "isrc": (b"REC", 249, 261),
+}
+
+def _field(data, starts, ends, lo, hi):
+    # Bytes [lo:hi) of each line as an S array; positions past the line end read as spaces.
+    pos = starts[:, None] + np.arange(lo, hi)
+    inside = pos < ends[:, None]
+    chars = np.where(inside, data[np.minimum(pos, len(data) - 1)], 32).astype(np.uint8)
+    return np.ascontiguousarray(chars).view(f"S{hi - lo}").ravel()
+
+def _normalize_key(value) -> bytes:
+    return str(value).strip().upper().encode("latin-1")
+
+class TransmissionIndex:
+    """Array-backed offset index of a CWR transmission."""
+    def __init__(self, offsets, lengths, types, t_seqs, keys: dict):
+        self.offsets = offsets  # int64 byte offset of each line
+        self.lengths = lengths  # int32 line length without CR/LF
+        self.types = types      # S3 record type
+        self.t_seqs = t_seqs    # int64 t_seq, -1 for HDR/GRH/GRT/TRL and malformed lines
+        self.keys = keys        # name -> (sorted S values, line numbers)
+        self._by_seq = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, buf) -> "TransmissionIndex":
+        size = len(buf)
+        # An empty buffer gets one dummy byte so the gathers below stay in bounds.
+        data = np.frombuffer(buf, dtype=np.uint8) if size else np.zeros(1, dtype=np.uint8)
+        breaks = np.flatnonzero(data[:size] == 10)
+        starts = np.concatenate(([0], breaks + 1)).astype(np.int64)
+        ends = np.concatenate((breaks, [size])).astype(np.int64)
+        # Strip CRs from both ends, as the validator does.
+        while True:
+            cr = (ends > starts) & (data[np.maximum(ends - 1, 0)] == 13)
+            if not cr.any(): break
+            ends[cr] -= 1
+        while True:
+            cr = (starts < ends) & (data[np.minimum(starts, len(data) - 1)] == 13)
+            if not cr.any(): break
+            starts[cr] += 1
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+
+        types = _field(data, starts, ends, 0, 3)
+        seq_chars = _field(data, starts, ends, 3, 11).view(np.uint8).reshape(-1, 8)
+        numeric = ((seq_chars >= 48) & (seq_chars <= 57)).all(axis=1) & ~np.isin(types, CONTROL_RECORDS)
+        digits = (seq_chars.astype(np.int64) - 48) @ (10 ** np.arange(7, -1, -1, dtype=np.int64))
+        t_seqs = np.where(numeric, digits, -1)
+
+        keys = {}
+        for name, (record_type, lo, hi) in KEY_FIELDS.items():
+            rows = np.flatnonzero(types == record_type)
+            values = np.char.upper(np.char.strip(_field(data, starts[rows], ends[rows], lo, hi)))
+            order = np.argsort(values, kind="stable")
+            keys[name] = (values[order], rows[order])
+        del data
+        return cls(starts, (ends - starts).astype(np.int32), types, t_seqs, keys)
+
+    # --- LOOKUPS ---
+    def rows_of_type(self, record_type: str) -> np.ndarray:
+        return np.flatnonzero(self.types == record_type.encode("latin-1"))
+
+    def count(self, record_type: str) -> int:
+        return int(np.count_nonzero(self.types == record_type.encode("latin-1")))
+
+    def first(self, record_type: str, min_length: int = 0) -> int:
+        # Line number (0-based) of the first record of a type, or -1.
+        hits = np.flatnonzero((self.types == record_type.encode("latin-1")) & (self.lengths >= min_length))
+        return int(hits[0]) if len(hits) else -1
+
+    def find(self, key: str, value) -> list:
+        # t_seqs of the transactions whose key field equals value (case-insensitive).
+        values, rows = self.keys[key]
+        probe = _normalize_key(value)
+        lo, hi = np.searchsorted(values, probe, "left"), np.searchsorted(values, probe, "right")
+        return [int(s) for s in self.t_seqs[rows[lo:hi]]]
+
+    def transaction_rows(self, t_seq: int) -> np.ndarray:
+        # Line numbers carrying a t_seq, in file order.
+        if self._by_seq is None:
+            self._by_seq = np.argsort(self.t_seqs, kind="stable")
+        ordered = self.t_seqs[self._by_seq]
+        lo, hi = np.searchsorted(ordered, t_seq, "left"), np.searchsorted(ordered, t_seq, "right")
+        return self._by_seq[lo:hi]
+
+    def line(self, buf, row: int) -> str:
+        start = int(self.offsets[row])
+        return buf[start:start + int(self.lengths[row])].decode("latin-1")
+
+    # --- SIDECAR ---
+    def save(self, path, source_stat=None):
+        arrays = {"offsets": self.offsets, "lengths": self.lengths, "types": self.types, "t_seqs": self.t_seqs}
+        for name, (values, rows) in self.keys.items():
+            arrays[f"key_{name}"], arrays[f"row_{name}"] = values, rows
+        if source_stat is not None:
+            arrays["source"] = np.array([source_stat.st_size, source_stat.st_mtime_ns], dtype=np.int64)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, source_stat=None) -> "TransmissionIndex":
+        # Returns None when the sidecar is missing, unreadable or stale.
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if source_stat is not None:
+                    if "source" not in z.files: return None
+                    size, mtime_ns = z["source"].tolist()
+                    if (size, mtime_ns) != (source_stat.st_size, source_stat.st_mtime_ns): return None
+                keys = {name: (z[f"key_{name}"], z[f"row_{name}"]) for name in KEY_FIELDS}
+                return cls(z["offsets"], z["lengths"], z["types"], z["t_seqs"], keys)
+        except (OSError, KeyError, ValueError):
+            return None
+
+class IndexedTransmission:
+    """A transmission buffer (bytes or mmap) paired with its offset index."""
+    def __init__(self, buf, index: TransmissionIndex = None):
+        self.buf = buf
+        self.index = index if index is not None else TransmissionIndex.build(buf)
+        self._closers = []
+
+    @classmethod
+    def open(cls, path, sidecar: bool = True) -> "IndexedTransmission":
+        # Maps the file read-only; reuses a fresh sidecar or builds (and saves) one.
+        fh = open(path, "rb")
+        st = os.fstat(fh.fileno())
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+        side = f"{path}{SIDECAR_SUFFIX}"
+        index = TransmissionIndex.load(side, st) if sidecar else None
+        if index is None:
+            index = TransmissionIndex.build(buf)
+            if sidecar:
+                index.save(side, st)
+        tx = cls(buf, index)
+        tx._closers = [buf.close] if st.st_size else []
+        tx._closers.append(fh.close)
+        return tx
+
+    def close(self):
+        for close in self._closers:
+            close()
+        self._closers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def line(self, row: int) -> str:
+        return self.index.line(self.buf, row)
+
+    def first(self, record_type: str, min_length: int = 0) -> str:
+        row = self.index.first(record_type, min_length)
+        return None if row == -1 else self.line(row)
+
+    def records(self, record_type: str) -> list:
+        return [self.line(row) for row in self.index.rows_of_type(record_type)]
+
+    def transaction(self, t_seq: int) -> list:
+        return [self.line(row) for row in self.index.transaction_rows(t_seq)]
+
+    def find(self, key: str, value) -> list:
+        # Full record lists of every transaction matching a work_id, title or isrc.
+        return [self.transaction(t_seq) for t_seq in self.index.find(key, value)]
@@ -0,0 +1,83 @@
+import csv
+import io
+import itertools
+import os
+import pandas as pd
+
+# ==============================================================================
+# CSV INGESTION
+# ==============================================================================
+# Harvest / SourceAudio exports carry a block of metadata rows above the real
+# header. The header row is detected once from a 20-row preview, then the file
+# is read in fixed-size chunks so back-catalog exports never have to fit in RAM.
+# Every column is read as text (blank cells stay NaN): per-chunk dtype
+# inference would turn a title "1999" into "1999.0" or an IPI into a float
+# depending on which other rows share its chunk.
+
+MARKERS = ["TRACK: TITLE", "SOURCEAUDIO ID", "TITLE", "LIBRARY: NAME"]
+DEFAULT_CHUNKSIZE = 50_000
+PREVIEW_ROWS = 20
+
+def _rewind(source):
+    if hasattr(source, "seek"): source.seek(0)
+
+def is_header_row(cells) -> bool:
+    row_str = " ".join(str(c) for c in cells).upper()
+    return any(m in row_str for m in MARKERS)
+
+def detect_header_row(source, **read_kw) -> int:
+    # Returns the header row index, or -1 if no MARKERS row is found in the
+    # preview. Uses find_header_row over stdlib csv rows, so ragged preamble
+    # rows (fewer fields than the header) are fine. `source` is a path or a
+    # text or binary file object; only the first rows are read.
+    encoding = read_kw.get("encoding") or "utf-8-sig"
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "r", encoding=encoding, errors="replace", newline="") as f:
+            return find_header_row(csv.reader(f))
+    _rewind(source)
+    try:
+        if isinstance(source, io.TextIOBase):
+            return find_header_row(csv.reader(source))
+        text = io.TextIOWrapper(source, encoding=encoding, errors="replace", newline="")
+        try:
+            return find_header_row(csv.reader(text))
+        finally:
+            text.detach()  # leave the caller's binary handle open
+    finally:
+        _rewind(source)
+
+def read_csv_chunks(source, chunksize: int = DEFAULT_CHUNKSIZE, header_row: int = None, **read_kw):
+    # Yields DataFrame chunks whose index continues across chunk boundaries, so
+    # the engine's t_seq, work_id and ORN cut_number stay monotonic. Columns are
+    # text, so the output does not depend on chunksize.
+    if header_row is None:
+        header_row = detect_header_row(source, **read_kw)
+    if header_row == -1:
+        raise ValueError("Schema not recognized.")
+
+    _rewind(source)
+    offset = 0
+    with pd.read_csv(source, header=header_row, chunksize=chunksize, **{"dtype": str, **read_kw}) as reader:
+        for chunk in reader:
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+
+def find_header_row(rows) -> int:
+    # Same rule as detect_header_row over already-split rows; blank rows are not
+    # counted, matching pandas' skip_blank_lines row numbering.
+    for i, row in enumerate(itertools.islice((r for r in rows if r), PREVIEW_ROWS)):
+        if is_header_row(row):
+            return i
+    return -1
+
+def load_csv_buffer(data: bytes, **read_kw) -> tuple:
+    # Single-parse load for in-memory exports: the header row is found from the
+    # first rows of the buffer with the stdlib csv reader, then pandas parses the
+    # same buffer once from that row. Returns (header_row, DataFrame), with no
+    # DataFrame when the header is not recognized.
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline="")
+    header_row = find_header_row(csv.reader(text))
+    if header_row == -1:
+        return -1, None
+    return header_row, pd.read_csv(io.BytesIO(data), header=header_row, **{"dtype": str, **read_kw})
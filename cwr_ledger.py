@@ -0,0 +1,173 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==============================================================================
+# SEQUENCE LEDGER
+# ==============================================================================
+# Transactional store for CW[YY][NNNN] sequence numbers, replacing whole-file
+# rewrites of cwr_sequence_log.json. sqlite in WAL mode lets operator sessions
+# read while another writes. A reservation takes the write lock
+# (BEGIN IMMEDIATE) before it reads the high-water mark, so two sessions can
+# never claim the same number. Sequences are kept per year: a new year starts
+# at 1 and earlier years stay on record. The legacy JSON history is imported
+# the first time the ledger is opened.
+#
+# A number moves reserved -> issued -> accepted. "reserved" only covers a
+# generation run in flight. Reservations older than reservation_ttl are
+# stale (the run crashed or the page was refreshed): next_sequence ignores
+# them, and the next write sweeps them. Once a .V22 is written under the
+# number it is "issued" and never expires, since the file exists even if
+# the registration is not yet accepted.
+#
+# One ledger may be shared between threads (the Streamlit app keeps a single
+# cached instance for all sessions); calls are serialized on a lock so one
+# thread's write transaction never interleaves with another's statements.
+
+LEDGER_FILE = "cwr_sequence_ledger.db"
+SEQ_FILE = "cwr_sequence_log.json"
+MAX_SEQUENCE = 9999
+RESERVATION_TTL = 3600
+RESERVED, ISSUED, ACCEPTED = "reserved", "issued", "accepted"
+
+class SequenceTaken(ValueError):
+    pass
+
+class SequenceLedger:
+    """Per-year sequence numbers with atomic reserve-and-commit."""
+    def __init__(self, path=LEDGER_FILE, import_json=SEQ_FILE, timeout: float = 10.0, reservation_ttl: float = RESERVATION_TTL):
+        self.reservation_ttl = reservation_ttl
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(path), timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (year INTEGER NOT NULL, sequence INTEGER NOT NULL, status TEXT NOT NULL,"
+            " label TEXT NOT NULL DEFAULT '', owner TEXT NOT NULL DEFAULT '', updated REAL NOT NULL, PRIMARY KEY (year, sequence))")
+        if import_json and os.path.exists(import_json):
+            self.import_json(import_json)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def _write(self):
+        # One write transaction, holding the database write lock throughout.
+        # Stale reservations are swept first.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM entries WHERE status = ? AND updated < ?", (RESERVED, self._stale_before()))
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _stale_before(self) -> float:
+        return time.time() - self.reservation_ttl
+
+    # --- READS ---
+    def next_sequence(self, year: int = None) -> int:
+        # One past the highest sequence accepted, issued or live-reserved for the year.
+        year = year or datetime.now().year
+        with self._lock:
+            top = self._conn.execute("SELECT MAX(sequence) FROM entries WHERE year = ? AND NOT (status = ? AND updated < ?)",
+                                     (year, RESERVED, self._stale_before())).fetchone()[0]
+        return (top or 0) + 1
+
+    def history(self, year: int = None) -> list:
+        # Accepted entries in acceptance order, shaped like the legacy JSON history.
+        year = year or datetime.now().year
+        with self._lock:
+            rows = self._conn.execute("SELECT sequence, label FROM entries WHERE year = ? AND status = ? ORDER BY updated, sequence", (year, ACCEPTED)).fetchall()
+        return [{"sequence": sequence, "label": label} for sequence, label in rows]
+
+    def status(self, sequence: int, year: int = None):
+        year = year or datetime.now().year
+        with self._lock:
+            hit = self._conn.execute("SELECT status FROM entries WHERE year = ? AND sequence = ?", (year, sequence)).fetchone()
+        return hit[0] if hit else None
+
+    # --- WRITES ---
+    def reserve(self, year: int = None, sequence: int = None, owner: str = "", minimum: int = 1) -> int:
+        # Reserves `sequence`, or the next free number >= minimum, and returns it.
+        # Re-reserving a number the same owner already holds, reserved or issued
+        # (regenerating a file under its number), is a no-op; SequenceTaken is
+        # raised when it is accepted or held by someone else.
+        year = year or datetime.now().year
+        with self._write() as conn:
+            if sequence is None:
+                sequence = max(self.next_sequence(year), minimum)
+            hit = conn.execute("SELECT status, owner FROM entries WHERE year = ? AND sequence = ?", (year, sequence)).fetchone()
+            if hit is not None:
+                if hit in ((RESERVED, owner), (ISSUED, owner)): return sequence
+                raise SequenceTaken(f"Sequence {sequence:04d} is already {hit[0]} for {year}.")
+            if not 1 <= sequence <= MAX_SEQUENCE:
+                raise ValueError(f"Sequence {sequence} is outside 1-{MAX_SEQUENCE}.")
+            conn.execute("INSERT INTO entries VALUES (?, ?, ?, '', ?, ?)", (year, sequence, RESERVED, owner, time.time()))
+        return sequence
+
+    def issue(self, sequence: int, label: str = "", year: int = None, owner: str = "") -> bool:
+        # Marks the owner's reservation as written out (label: the filename), so
+        # it no longer expires; re-issuing the owner's own number updates the
+        # label. A number nobody holds (the reservation went stale) is recorded
+        # as issued too. Returns False if someone else holds it.
+        year = year or datetime.now().year
+        with self._write() as conn:
+            hit = conn.execute("SELECT status, owner FROM entries WHERE year = ? AND sequence = ?", (year, sequence)).fetchone()
+            if hit is not None and hit not in ((RESERVED, owner), (ISSUED, owner)): return False
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", (year, sequence, ISSUED, label, owner, time.time()))
+        return True
+
+    def commit(self, sequence: int, label: str, year: int = None) -> bool:
+        # Marks a sequence as officially accepted, reserved or not. Returns False
+        # if it was already accepted.
+        year = year or datetime.now().year
+        with self._write() as conn:
+            if self.status(sequence, year) == ACCEPTED: return False
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, '', ?)", (year, sequence, ACCEPTED, label, time.time()))
+        return True
+
+    def release(self, sequence: int, year: int = None, owner: str = None) -> bool:
+        # Drops a reservation (only the owner's, when owner is given).
+        year = year or datetime.now().year
+        query = "DELETE FROM entries WHERE year = ? AND sequence = ? AND status = ?"
+        params = [year, sequence, RESERVED]
+        if owner is not None:
+            query += " AND owner = ?"
+            params.append(owner)
+        with self._write() as conn:
+            return conn.execute(query, params).rowcount > 0
+
+    def import_json(self, json_path) -> int:
+        # One-time import of the legacy {"year", "history": [...]} log as accepted
+        # entries. Returns the number of entries imported.
+        key = f"imported:{os.path.abspath(json_path)}"
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE k = ?", (key,)).fetchone(): return 0
+        with open(json_path, 'r') as f:
+            seq_data = json.load(f)
+        year = seq_data.get("year", datetime.now().year)
+        history = seq_data.get("history", [])
+        with self._write() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE k = ?", (key,)).fetchone(): return 0
+            stamp = time.time()
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, '', ?)",
+                             [(year, item["sequence"], ACCEPTED, item.get("label", ""), stamp + n * 1e-6) for n, item in enumerate(history)])
+            imported = conn.total_changes - before
+            conn.execute("INSERT INTO meta VALUES (?, ?)", (key, str(stamp)))
+        return imported
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import time
+
+# ==============================================================================
+# ATOMIC OUTPUT
+# ==============================================================================
+# A .V22 in OUTPUT_V22 is picked up by the Google Drive client as soon as it
+# appears. Writers stream latin-1 bytes through a large buffer into a hidden
+# temp file in the same directory, fsync it, and rename it over the target, so
+# the sync client only ever sees complete transmissions. The write timeout is
+# checked after every chunk instead of once at the end. mkstemp creates the
+# temp file 0600; it is given the mode a plain open() would have produced (the
+# replaced file's mode, else 0666 under the umask) before the rename.
+
+DEFAULT_BUFFER = 1 << 20
+ENCODE_CHUNK = 1 << 20
+
+class WriteTimeout(TimeoutError):
+    pass
+
+def latin1_chunks(content: str, size: int = ENCODE_CHUNK):
+    # Encodes a transmission slice by slice, so its bytes never exist in memory all at once.
+    for start in range(0, len(content), size):
+        yield content[start:start + size].encode("latin-1")
+
+class AtomicWriter:
+    """Binary file-like writer: replaces `path` only when the block exits cleanly."""
+    def __init__(self, path, timeout: float = None, buffer_size: int = DEFAULT_BUFFER):
+        self.path = os.fspath(path)
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.bytes = 0
+        self.elapsed = 0.0
+        self._fh = None
+        self._tmp = None
+
+    def __enter__(self):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, self._tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        self._fh = os.fdopen(fd, "wb", buffering=self.buffer_size)
+        self._started = time.perf_counter()
+        return self
+
+    def write(self, data) -> int:
+        self._fh.write(data)
+        self.bytes += len(data)
+        self.elapsed = time.perf_counter() - self._started
+        if self.timeout is not None and self.elapsed > self.timeout:
+            raise WriteTimeout(f"Write operation took too long: {self.elapsed:.1f}s for {self.bytes} bytes (limit {self.timeout}s). {os.path.basename(self.path)} was not replaced.")
+        return len(data)
+
+    def writelines(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+            self._fh.close()
+            if exc_type is None:
+                os.chmod(self._tmp, _target_mode(self.path))
+                os.replace(self._tmp, self.path)
+                self._tmp = None
+                _fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        finally:
+            if self._tmp is not None and os.path.exists(self._tmp):
+                os.remove(self._tmp)
+            self.elapsed = time.perf_counter() - self._started
+        return False
+
+    @property
+    def throughput(self) -> float:
+        # MB/s over the whole write, fsync and rename included.
+        return self.bytes / 1e6 / self.elapsed if self.elapsed else 0.0
+
+def _read_umask() -> int:
+    # os.umask can only be read by setting it; done once, before any threads write files
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+UMASK = _read_umask()
+
+def _target_mode(path: str) -> int:
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+def _fsync_dir(directory: str):
+    # Makes the rename itself durable; not every platform can open a directory.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
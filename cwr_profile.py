@@ -0,0 +1,124 @@
+import cProfile
+import os
+import pstats
+from collections import Counter
+from contextlib import contextmanager
+
+# ==============================================================================
+# CPU PROFILING
+# ==============================================================================
+# cProfile around a CLI run (run_harvest_cwr, verify_transparency_cwr,
+# run_batch_cwr --profile). Each run writes <prefix>.pstats for pstats/snakeviz
+# and <prefix>.collapsed.txt, one "frame;frame;frame microseconds" line per
+# stack, for flamegraph.pl / speedscope / inferno. cProfile keeps only
+# caller->callee edges, not whole stacks, so a function's time is split
+# across its callers in proportion to the time each edge carried. Recursive
+# cycles are cut at the first repeat, and branches carrying less than
+# MIN_SHARE (the 1 us output resolution) are folded into a "(small callees)"
+# leaf, which keeps the walk bounded on pandas' dense call graphs. summary()
+# lists the top-N functions by own time, plus the engine's per-row hot path
+# (WATCH) wherever it ranks.
+
+# cProfile names functions without their class: "build" is FormatterEngine.build,
+# "render" / "render_columns" are CompiledRecord's row and vectorized renderers.
+WATCH = (
+    ("cwr_engine.py", "build"),
+    ("cwr_engine.py", "render"),
+    ("cwr_engine.py", "render_columns"),
+    ("cwr_engine.py", "fmt_share"),
+    ("cwr_engine.py", "pad_ipi"),
+    ("cwr_engine.py", "resolve"),
+)
+TOP_N = 25
+MAX_DEPTH = 200
+MIN_SHARE = 1e-6
+
+def frame_label(func: tuple) -> str:
+    # ('.../cwr_engine.py', 84, 'render') -> 'cwr_engine.py:84:render'
+    filename, lineno, name = func
+    label = name if filename == "~" else f"{os.path.basename(filename)}:{lineno}:{name}"
+    return label.replace(";", ",")
+
+def collapsed_stacks(stats: pstats.Stats) -> Counter:
+    # {"root;...;leaf": microseconds of own time on that stack}
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    stacks = Counter()
+
+    def walk(func, share, path, seen):
+        _, _, own, total, _ = entries[func]
+        scale = share / total if total else 0.0
+        path = path + (frame_label(func),)
+        if own * scale > 0:
+            stacks[";".join(path)] += own * scale
+        if len(path) >= MAX_DEPTH: return
+        small = 0.0
+        for callee, edge_total in callees.get(func, ()):
+            if callee in seen or callee not in entries: continue
+            if edge_total * scale < MIN_SHARE:
+                small += edge_total * scale
+                continue
+            walk(callee, edge_total * scale, path, seen | {callee})
+        if small: stacks[";".join(path + ("(small callees)",))] += small
+
+    for func, (_, _, _, total, callers) in entries.items():
+        if not any(caller in entries for caller in callers):
+            walk(func, total, (), frozenset((func,)))
+    return Counter({stack: round(seconds * 1e6) for stack, seconds in stacks.items() if round(seconds * 1e6) > 0})
+
+def summary(stats: pstats.Stats, top: int = TOP_N, watch=WATCH) -> list:
+    # Top functions by own time, then any WATCH function not already listed.
+    total = sum(entry[2] for entry in stats.stats.values()) or 1.0
+    def row(func, rank):
+        calls, _, own, cumulative, _ = stats.stats[func]
+        return {"rank": rank, "function": frame_label(func), "calls": calls, "own_s": round(own, 4),
+                "own_pct": round(own / total * 100, 1), "cumulative_s": round(cumulative, 4),
+                "per_call_us": round(own / calls * 1e6, 2) if calls else 0.0}
+    ranked = sorted(stats.stats, key=lambda f: stats.stats[f][2], reverse=True)
+    rows = [row(func, rank) for rank, func in enumerate(ranked[:top], 1)]
+    for rank, func in enumerate(ranked, 1):
+        if rank > top and (os.path.basename(func[0]), func[2]) in watch:
+            rows.append(row(func, rank))
+    return rows
+
+def format_summary(rows: list) -> str:
+    lines = [f"{'#':>4} {'own s':>9} {'own %':>6} {'cum s':>9} {'calls':>10} {'us/call':>9}  function"]
+    for r in rows:
+        lines.append(f"{r['rank']:>4} {r['own_s']:>9.4f} {r['own_pct']:>6.1f} {r['cumulative_s']:>9.4f} {r['calls']:>10} {r['per_call_us']:>9.2f}  {r['function']}")
+    return "\n".join(lines)
+
+def save(stats: pstats.Stats, prefix: str) -> tuple:
+    # Writes <prefix>.pstats and <prefix>.collapsed.txt; returns both paths.
+    pstats_path, collapsed_path = f"{prefix}.pstats", f"{prefix}.collapsed.txt"
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    stats.dump_stats(pstats_path)
+    with open(collapsed_path, 'w') as f:
+        for stack, micros in sorted(collapsed_stacks(stats).items()):
+            f.write(f"{stack} {micros}\n")
+    return pstats_path, collapsed_path
+
+def merge(paths, prefix: str) -> pstats.Stats:
+    # Combines per-worker .pstats files into one profile written under prefix.
+    stats = pstats.Stats(*paths)
+    save(stats, prefix)
+    return stats
+
+@contextmanager
+def profiled(prefix: str = None, top: int = TOP_N, report=print):
+    # Profiles the block. With a prefix, the profile is saved and the top-N
+    # summary printed (pass report=None to skip it). Yields the Profile.
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if prefix:
+            stats = pstats.Stats(profile)
+            pstats_path, collapsed_path = save(stats, prefix)
+            if report:
+                report(f"\n--- PROFILE: {pstats_path}, {collapsed_path} ---")
+                report(format_summary(summary(stats, top)))
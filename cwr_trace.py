@@ -0,0 +1,188 @@
+import json
+import os
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# ==============================================================================
+# STAGE TRACING
+# ==============================================================================
+# Context-manager spans around the pipeline stages: header detection,
+# gatekeeper, dry run, generation, pre-flight, Drive write and validation.
+# Each span records wall time plus the rows, records and bytes it handled.
+# Nested spans are named parent/child. The default NULL_TRACER hands out one
+# shared span that ignores everything, so instrumented code costs next to
+# nothing unless a caller passes a real Tracer.
+#
+# Tracer(memory=True) also runs tracemalloc for the duration of the outermost
+# span. Each span then reports its peak (above the memory in use when it
+# started) and the bytes it leaves allocated, plus the top allocation sites
+# among the bytes it leaves, attributed to the innermost line of our own
+# modules on the allocating stack (so a pandas or str.join allocation lands on
+# the cwr_engine line that called it). Snapshots are taken outside the measured
+# window and their own size is kept out of parent peaks, but profiling is
+# still slow (generation runs 10-50x slower) and memory-hungry: opt-in only.
+# tracemalloc is process-wide, so figures from concurrent profiled runs in one
+# process (two Streamlit sessions) include each other's allocations.
+
+PROFILE_MODULES = ("cwr_engine", "cwr_validator", "streamlit_app")
+MEMORY_FRAMES = 16
+TOP_SITES = 5
+
+class Span:
+    __slots__ = ("name", "depth", "seconds", "rows", "records", "bytes", "peak", "retained", "sites",
+                 "_base", "_high", "_snapshot", "_overhead")
+
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.rows = 0
+        self.records = 0
+        self.bytes = 0
+        self.peak = None
+        self.retained = None
+        self.sites = None
+
+    def add(self, rows: int = 0, records: int = 0, bytes: int = 0):
+        self.rows += rows
+        self.records += records
+        self.bytes += bytes
+
+    def as_dict(self) -> dict:
+        entry = {"stage": self.name, "depth": self.depth, "seconds": round(self.seconds, 6)}
+        for unit in ("rows", "records", "bytes"):
+            count = getattr(self, unit)
+            if count:
+                entry[unit] = count
+                if self.seconds: entry[f"{unit}_per_s"] = round(count / self.seconds, 1)
+        if self.peak is not None:
+            entry.update(peak_bytes=self.peak, retained_bytes=self.retained, sites=self.sites)
+        return entry
+
+class _NullSpan:
+    __slots__ = ()
+
+    def add(self, rows: int = 0, records: int = 0, bytes: int = 0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class Tracer:
+    """Collects spans in the order they start."""
+    enabled = True
+
+    def __init__(self, memory: bool = False, modules=PROFILE_MODULES, top: int = TOP_SITES, frames: int = MEMORY_FRAMES):
+        self.spans = []
+        self._stack = []
+        self.memory = memory
+        self.modules = frozenset(modules)
+        self.top = top
+        self.frames = frames
+        self._owns_tracing = False
+
+    @contextmanager
+    def span(self, name: str):
+        if self._stack: name = f"{self._stack[-1].name}/{name}"
+        span = Span(name, len(self._stack))
+        self.spans.append(span)
+        if self.memory: self._memory_enter(span)
+        self._stack.append(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - started
+            self._stack.pop()
+            if self.memory: self._memory_exit(span)
+
+    # --- MEMORY (tracemalloc) ---
+    def _memory_enter(self, span: Span):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._owns_tracing = True
+        before, peak = tracemalloc.get_traced_memory()
+        for parent in self._stack: parent._high = max(parent._high, peak)
+        span._snapshot = tracemalloc.take_snapshot()
+        span._base, _ = tracemalloc.get_traced_memory()
+        span._overhead = span._base - before
+        span._high = span._base
+        tracemalloc.reset_peak()
+
+    def _memory_exit(self, span: Span):
+        if not tracemalloc.is_tracing():
+            # Stopped under us (tracemalloc is process-wide); no figures for this span
+            span._snapshot = None
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        span._high = max(span._high, peak)
+        span.peak = span._high - span._base
+        span.retained = current - span._base
+        span.sites = self._sites(span._snapshot, tracemalloc.take_snapshot())
+        span._snapshot = None
+        # Parents never see this span's snapshot in their peak
+        for parent in self._stack: parent._high = max(parent._high, span._high - span._overhead)
+        if not self._stack and self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+        else:
+            tracemalloc.reset_peak()
+
+    def _sites(self, before, after) -> list:
+        # Bytes allocated in the span and still live, by innermost line in self.modules.
+        sizes, counts = Counter(), Counter()
+        for stat in after.compare_to(before, "traceback"):
+            if stat.size_diff <= 0: continue
+            for frame in reversed(stat.traceback):
+                module = os.path.splitext(os.path.basename(frame.filename))[0]
+                if module in self.modules:
+                    site = f"{module}.py:{frame.lineno}"
+                    sizes[site] += stat.size_diff
+                    counts[site] += max(stat.count_diff, 0)
+                    break
+        return [{"site": site, "bytes": size, "blocks": counts[site]} for site, size in sizes.most_common(self.top)]
+
+    def report(self) -> list:
+        return [span.as_dict() for span in self.spans]
+
+    def total(self) -> float:
+        return sum(span.seconds for span in self.spans if span.depth == 0)
+
+    def peak(self) -> int:
+        # Highest per-stage peak, None unless memory profiling is on
+        peaks = [span.peak for span in self.spans if span.peak is not None]
+        return max(peaks) if peaks else None
+
+    def to_json(self, **kw) -> str:
+        report = {"total_seconds": round(self.total(), 6), "stages": self.report()}
+        if self.memory: report["peak_bytes"] = self.peak()
+        return json.dumps(report, **kw)
+
+class NullTracer:
+    """Disabled tracer: every span is the same do-nothing object."""
+    enabled = False
+    memory = False
+    spans = ()
+    _span = _NullSpan()
+
+    def span(self, name: str):
+        return self._span
+
+    def report(self) -> list:
+        return []
+
+    def total(self) -> float:
+        return 0.0
+
+    def peak(self):
+        return None
+
+    def to_json(self, **kw) -> str:
+        return json.dumps({"total_seconds": 0.0, "stages": []}, **kw)
+
+NULL_TRACER = NullTracer()
@@ -1,148 +1,393 @@
-import pandas as pd
+import csv
 import io
+import itertools
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from cwr_engine import clean_value
+from cwr_ingest import PREVIEW_ROWS, is_header_row
+from cwr_trace import NULL_TRACER
 
-class CWRValidator:
-    def process_file(self, cwr_content: str, csv_content: bytes = None, filename: str = None) -> tuple:
-        rep = []
-        stats = {"transactions": 0}
-        
-        # --- 0. FILENAME AUDIT ---
-        if filename:
-            import re
-            pattern = r"^CW\d{2}\d{4}LUM_319\.V22$"
-            if not re.match(pattern, filename):
+# ==============================================================================
+# STREAMING RECORD AUDIT
+# ==============================================================================
+# Records are checked one line at a time, so a transmission never has to be
+# split into a list. The only state kept across transactions is the per-t_seq
+# writer PR share total (an 8-char key and an int per work), because an SWR is
+# credited to whichever earlier NWR carries its t_seq.
+
+STRICT_182_RECORDS = ('NWR', 'SPU', 'SWR', 'SPT', 'SWT')
+
+def iter_record_lines(source):
+    # Yields non-empty lines with CR/LF stripped from a str, a file-like object
+    # (text or binary) or any iterable of lines. In-memory bytes and mmaps are
+    # scanned in place as MappedLine views (see below).
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        yield from iter_mapped_lines(source)
+        return
+    if isinstance(source, str):
+        start, size = 0, len(source)
+        while start <= size:
+            end = source.find('\n', start)
+            if end == -1: end = size
+            line = source[start:end].strip('\r\n')
+            if line: yield line
+            start = end + 1
+        return
+    for raw in source:
+        if isinstance(raw, bytes): raw = raw.decode('latin-1')
+        for part in raw.split('\n'):
+            line = part.strip('\r\n')
+            if line: yield line
+
+# ==============================================================================
+# BYTE-LEVEL RECORD VIEWS
+# ==============================================================================
+# A .V22 is latin-1, so byte offsets are character offsets. MappedLine lets
+# RecordAudit run directly over an mmap (or bytes): len() and find() work on
+# the buffer, and slicing decodes only the few bytes a check reads. One view
+# is reused for every line, so consumers must not keep it past feed().
+
+class MappedLine:
+    __slots__ = ("buf", "start", "end")
+
+    def __init__(self, buf):
+        self.buf, self.start, self.end = buf, 0, 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        lo, hi, _ = key.indices(self.end - self.start)
+        return self.buf[self.start + lo:self.start + max(lo, hi)].decode('latin-1')
+
+    def find(self, sub):
+        idx = self.buf.find(sub.encode('latin-1'), self.start, self.end)
+        return idx if idx == -1 else idx - self.start
+
+    def __str__(self):
+        return self.buf[self.start:self.end].decode('latin-1')
+
+def iter_mapped_lines(buf):
+    # Mirrors iter_record_lines: split on LF, strip CR/LF from both ends, skip blanks.
+    view = MappedLine(buf)
+    pos, size = 0, len(buf)
+    while pos <= size:
+        end = buf.find(b'\n', pos)
+        if end == -1: end = size
+        start, stop = pos, end
+        while start < stop and buf[start] == 13: start += 1
+        while stop > start and buf[stop - 1] == 13: stop -= 1
+        if start < stop:
+            view.start, view.end = start, stop
+            yield view
+        pos = end + 1
+
+class RecordAudit:
+    """Line-by-line state machine for the geometry, syntax and PR share checks."""
+    def __init__(self, rep: list, line_offset: int = 0):
+        self.rep = rep
+        self.line_num = line_offset
+        self.transactions = 0
+        self.swr_shares = {}
+        # Set to a dict when auditing a partition: SWR credits for t_seqs whose
+        # NWR lies in an earlier partition, resolved by absorb().
+        self.foreign = None
+        # Set to a dict when a mirror audit follows: NWR title -> [count, first line].
+        self.titles = None
+
+    def _note_title(self, title: str, line_num: int, count: int = 1):
+        seen = self.titles.get(title)
+        if seen is None:
+            self.titles[title] = [count, line_num]
+        else:
+            seen[0] += count
+
+    def feed(self, line: str):
+        self.line_num += 1
+        line_num = self.line_num
+        record_type = line[0:3]
+        rep = self.rep
+
+        if record_type == 'NWR':
+            self.transactions += 1
+            if self.titles is not None:
+                self._note_title(line[19:79].strip(), line_num)
+            if len(line) >= 144 and line[141:144] != 'ORI':
                 rep.append({
                     "level": "CRITICAL",
-                    "line": 0,
-                    "message": f"FILENAME REJECTION: '{filename}' does not match mandatory CWR 2.2 pattern CW[YY][NNNN]LUM_319.V22",
-                    "content": ""
+                    "line": line_num,
+                    "message": "ORI Anchor point shifted. Must be at Position 142.",
+                    "content": line[130:150]
                 })
-        
-        # Strip newlines but preserve exact trailing space geometry per line
-        lines = [line.strip('\r\n') for line in cwr_content.split('\n') if line.strip('\r\n')]
-        
-        nwr_records = []
-        rec_records = []
-        
-        # --- 1. GEOMETRY AND SYNTAX AUDIT ---
-        strict_182_records = ['NWR', 'SPU', 'SWR', 'SPT', 'SWT']
-        
-        for i, line in enumerate(lines):
-            line_num = i + 1
-            record_type = line[0:3]
-            
-            if record_type == 'NWR':
-                stats["transactions"] += 1
-                nwr_records.append({"line_num": line_num, "content": line})
-                if len(line) >= 144 and line[141:144] != 'ORI':
-                    rep.append({
-                        "level": "CRITICAL",
-                        "line": line_num,
-                        "message": "ORI Anchor point shifted. Must be at Position 142.",
-                        "content": line[130:150]
-                    })
-            elif record_type == 'REC':
-                rec_records.append({"line_num": line_num, "content": line})
-            elif record_type == 'SPU':
-                pg_idx = line.find('PG')
-                if pg_idx != -1 and pg_idx != 160:
-                    rep.append({
-                        "level": "CRITICAL",
-                        "line": line_num,
-                        "message": f"SPU GEOMETRY FAIL: 'PG' string found at index {pg_idx} (Pos {pg_idx+1}). MUST be exactly at Index 160 (Position 161).",
-                        "content": line[140:175]
-                    })
-            
-            # Geometry Audit
-            if record_type in strict_182_records:
-                if len(line) != 182:
-                    rep.append({
-                        "level": "CRITICAL",
-                        "line": line_num,
-                        "message": f"GEOMETRY FAIL: {record_type} record length is {len(line)}, MUST be exactly 182 characters.",
-                        "content": f"Length: {len(line)} | Preview: {line[:50]}..."
-                    })
-            
-            # CD Source Lock Audit
-            if record_type == 'REC':
-                if len(line) < 264:
+        elif record_type == 'SPU':
+            pg_idx = line.find('PG')
+            if pg_idx != -1 and pg_idx != 160:
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": line_num,
+                    "message": f"SPU GEOMETRY FAIL: 'PG' string found at index {pg_idx} (Pos {pg_idx+1}). MUST be exactly at Index 160 (Position 161).",
+                    "content": line[140:175]
+                })
+
+        # Geometry Audit
+        if record_type in STRICT_182_RECORDS:
+            if len(line) != 182:
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": line_num,
+                    "message": f"GEOMETRY FAIL: {record_type} record length is {len(line)}, MUST be exactly 182 characters.",
+                    "content": f"Length: {len(line)} | Preview: {line[:50]}..."
+                })
+
+        # CD Source Lock Audit
+        if record_type == 'REC':
+            if len(line) < 264:
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": line_num,
+                    "message": f"REC GEOMETRY FAIL: REC record length is {len(line)}, cannot inspect Position 263.",
+                    "content": line[:50] + "..."
+                })
+            else:
+                source_val = line[262:264]
+                if source_val != 'CD':
                     rep.append({
                         "level": "CRITICAL",
                         "line": line_num,
-                        "message": f"REC GEOMETRY FAIL: REC record length is {len(line)}, cannot inspect Position 263.",
-                        "content": line[:50] + "..."
+                        "message": f"CRITICAL: REC Source must be 'CD'. Found '{source_val}' at pos 263.",
+                        "content": line[250:270]
                     })
-                else:
-                    source_val = line[262:264]
-                    if source_val != 'CD':
-                        rep.append({
-                            "level": "CRITICAL",
-                            "line": line_num,
-                            "message": f"CRITICAL: REC Source must be 'CD'. Found '{source_val}' at pos 263.",
-                            "content": line[250:270]
-                        })
-                        
-        # --- 1.5. PR SHARE AUDIT (WRITER TOTAL = 10000) ---
-        swr_shares = {}
-        for line in lines:
-            if len(line) < 11:
+
+        # PR Share Tally (WRITER TOTAL = 10000)
+        if len(line) < 11:
+            return
+        if record_type == 'NWR':
+            self.swr_shares[line[3:11]] = 0
+        elif record_type == 'SWR':
+            t_seq = line[3:11]
+            shares = self.swr_shares if t_seq in self.swr_shares else self.foreign
+            if shares is not None:
+                try:
+                    shares[t_seq] = shares.get(t_seq, 0) + int(line[129:134].strip() or 0)
+                except ValueError:
+                    pass
+
+    def feed_buffer(self, buf, lo: int = 0, hi: int = None):
+        # Byte-level fast path over an mmap or bytes. Clean lines are tallied
+        # with byte comparisons; any line that fails a check goes through feed()
+        # as a MappedLine, so report entries are built in one place.
+        view = MappedLine(buf)
+        shares = self.swr_shares
+        find = buf.find
+        line_num = self.line_num
+        pos, size = lo, len(buf) if hi is None else hi
+        while pos <= size:
+            end = find(b'\n', pos, size)
+            if end == -1: end = size
+            start, stop = pos, end
+            pos = end + 1
+            while stop > start and buf[stop - 1] == 13: stop -= 1
+            while start < stop and buf[start] == 13: start += 1
+            if start == stop:
+                continue
+            line_num += 1
+            size_ok = stop - start == 182
+            rt = buf[start:start + 3]
+            if rt == b'NWR':
+                clean = size_ok and buf[start + 141:start + 144] == b'ORI'
+            elif rt == b'SPU':
+                clean = size_ok and find(b'PG', start, stop) in (-1, start + 160)
+            elif rt == b'REC':
+                clean = stop - start >= 264 and buf[start + 262:start + 264] == b'CD'
+            elif rt in (b'SWR', b'SPT', b'SWT'):
+                clean = size_ok
+            else:
+                clean = True
+            if not clean:
+                view.start, view.end = start, stop
+                self.line_num = line_num - 1
+                self.feed(view)
                 continue
-            rec_type = line[0:3]
-            if rec_type == 'NWR':
-                swr_shares[line[3:11]] = 0
-            elif rec_type == 'SWR':
-                t_seq = line[3:11]
-                if t_seq in swr_shares:
+            if rt == b'NWR':
+                self.transactions += 1
+                if self.titles is not None:
+                    self._note_title(buf[start + 19:start + 79].decode('latin-1').strip(), line_num)
+                shares[buf[start + 3:start + 11].decode('latin-1')] = 0
+            elif rt == b'SWR':
+                t_seq = buf[start + 3:start + 11].decode('latin-1')
+                target = shares if t_seq in shares else self.foreign
+                if target is not None:
                     try:
-                        swr_shares[t_seq] += int(line[129:134].strip() or 0)
+                        target[t_seq] = target.get(t_seq, 0) + int(buf[start + 129:start + 134].decode('latin-1').strip() or 0)
                     except ValueError:
                         pass
-        
-        for t_seq, total_share in swr_shares.items():
+        self.line_num = line_num
+
+    def absorb(self, part: "RecordAudit"):
+        # Appends the audit of the partition that directly follows this one.
+        for entry in part.rep:
+            entry["line"] += self.line_num
+        self.rep.extend(part.rep)
+        for t_seq, credit in (part.foreign or {}).items():
+            if t_seq in self.swr_shares:
+                self.swr_shares[t_seq] += credit
+        # A repeated NWR resets the total but keeps its first-seen position.
+        self.swr_shares.update(part.swr_shares)
+        if self.titles is not None:
+            for title, (count, line_num) in part.titles.items():
+                self._note_title(title, line_num + self.line_num, count)
+        self.transactions += part.transactions
+        self.line_num += part.line_num
+
+    def finish(self):
+        # Share failures are reported after all per-line findings, in first-NWR order.
+        for t_seq, total_share in self.swr_shares.items():
             if total_share != 10000:
-                rep.append({
+                self.rep.append({
                     "level": "CRITICAL",
                     "line": 0,
                     "message": f"PR SHARE FAIL: Work with seq '{t_seq}' has Writer PR shares summing to {total_share}. MUST be exactly 10000 (no 0.5 multiplier).",
                     "content": ""
                 })
+
+# ==============================================================================
+# PARALLEL AUDIT
+# ==============================================================================
+# Large files are cut into byte ranges that start on an NWR line, audited in a
+# process pool (each worker maps the file itself) and absorbed in file order.
+
+MIN_PARTITION_BYTES = 4 << 20
+
+def partition_offsets(buf, parts: int) -> list:
+    # Byte offsets [0, ..., len(buf)] where every inner offset begins an NWR line.
+    size = len(buf)
+    bounds = [0]
+    for k in range(1, parts):
+        idx = buf.find(b'\nNWR', max(size * k // parts, bounds[-1]))
+        if idx == -1:
+            break
+        if idx + 1 > bounds[-1]:
+            bounds.append(idx + 1)
+    bounds.append(size)
+    return bounds
+
+def _audit_range(path, lo: int, hi: int, titles: bool = False) -> RecordAudit:
+    part = RecordAudit([])
+    part.foreign = {}
+    part.titles = {} if titles else None
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        part.feed_buffer(mm, lo, hi)
+    return part
+
+def audit_path_parallel(path, audit: RecordAudit, workers: int) -> RecordAudit:
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        parts = min(workers * 4, size // MIN_PARTITION_BYTES)
+        if parts < 2:
+            if size:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    audit.feed_buffer(mm)
+            return audit
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            bounds = partition_offsets(mm, parts)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        n = len(bounds) - 1
+        for part in pool.map(_audit_range, [path] * n, bounds[:-1], bounds[1:], [audit.titles is not None] * n):
+            audit.absorb(part)
+    return audit
+
+# ==============================================================================
+# MIRROR AUDIT SOURCE
+# ==============================================================================
+# The source CSV is streamed with the stdlib csv reader; only the title column
+# is kept, and only as a title -> count table.
+
+def iter_csv_rows(csv_content):
+    # Yields non-blank rows from CSV bytes or a binary file object (UTF-8, BOM optional).
+    source = io.BytesIO(csv_content) if isinstance(csv_content, (bytes, bytearray)) else csv_content
+    text = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    try:
+        for row in csv.reader(text):
+            if row:
+                yield row
+    finally:
+        text.detach()
+
+def split_csv_header(rows):
+    # Returns (header, data rows). The header is the first MARKERS row within the
+    # preview window (Harvest exports carry metadata rows above it), else row 0.
+    rows = iter(rows)
+    preview = []
+    for row in rows:
+        preview.append(row)
+        if is_header_row(row):
+            return row, rows
+        if len(preview) == PREVIEW_ROWS:
+            break
+    if not preview:
+        return [], rows
+    return preview[0], itertools.chain(preview[1:], rows)
+
+
+class CWRValidator:
+    def __init__(self, tracer=NULL_TRACER):
+        # Stage timings (record audit, mirror audit) go to `tracer` (see cwr_trace).
+        self.tracer = tracer
+
+    def process_path(self, path, csv_content: bytes = None, filename: str = None, workers: int = None) -> tuple:
+        # Validates a .V22 on disk through a read-only mmap, without decoding it.
+        # With workers > 1, large files are audited in parallel partitions.
+        if workers and workers > 1:
+            return self._process(lambda audit: audit_path_parallel(path, audit, workers), csv_content, filename)
+        with open(path, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return self.process_file(b'', csv_content, filename)
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return self.process_file(mm, csv_content, filename)
+
+    def process_file(self, cwr_content, csv_content: bytes = None, filename: str = None) -> tuple:
+        def run_audit(audit):
+            if isinstance(cwr_content, (bytes, bytearray, mmap.mmap)):
+                audit.feed_buffer(cwr_content)
+            else:
+                for line in iter_record_lines(cwr_content):
+                    audit.feed(line)
+            return audit
+        return self._process(run_audit, csv_content, filename)
+
+    def _process(self, run_audit, csv_content: bytes = None, filename: str = None) -> tuple:
+        rep = []
+        stats = {"transactions": 0}
+        
+        # --- 0. FILENAME AUDIT ---
+        if filename:
+            import re
+            pattern = r"^CW\d{2}\d{4}LUM_319\.V22$"
+            if not re.match(pattern, filename):
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": 0,
+                    "message": f"FILENAME REJECTION: '{filename}' does not match mandatory CWR 2.2 pattern CW[YY][NNNN]LUM_319.V22",
+                    "content": ""
+                })
+        
+        # --- 1. SINGLE-PASS RECORD AUDIT (GEOMETRY, SYNTAX, PR SHARES) ---
+        audit = RecordAudit(rep)
+        if csv_content:
+            audit.titles = {}
+        with self.tracer.span("validate.records") as span:
+            run_audit(audit)
+            audit.finish()
+            span.add(rows=audit.transactions, records=audit.line_num)
+        stats["transactions"] = audit.transactions
                         
         # --- 2. MIRROR AUDIT (CONTEXTUAL TRUTH CHECK) ---
         if csv_content:
             try:
-                df = pd.read_csv(io.BytesIO(csv_content))
-                
-                # Header Target Match
-                df.columns = [str(c).replace('ï»¿', '').replace('"', '').strip().upper() for c in df.columns]
-                
-                if 'TRACK: TITLE' not in df.columns:
-                    rep.append({
-                        "level": "CRITICAL",
-                        "line": 0,
-                        "message": "MIRROR AUDIT FAIL: CSV missing required 'TRACK: TITLE' column.",
-                        "content": "Headers: " + ", ".join(df.columns)
-                    })
-                else:
-                    csv_titles = df['TRACK: TITLE'].astype(str).str.strip().tolist()
-                    
-                    # Zero-Truncation Match: Count Verification
-                    if len(nwr_records) != len(csv_titles):
-                        rep.append({
-                            "level": "CRITICAL",
-                            "line": 0,
-                            "message": f"MIRROR AUDIT FAIL: NWR generation count ({len(nwr_records)}) does not match source CSV row count ({len(csv_titles)}).",
-                            "content": ""
-                        })
-                        
-                    # Truncation Rule Verification
-                    for idx, csv_title in enumerate(csv_titles):
-                        if len(csv_title) > 60:
-                            rep.append({
-                                "level": "CRITICAL",
-                                "line": idx + 1,
-                                "message": f"CRITICAL_MISMATCH: CSV Title '{csv_title}' exceeds 60 characters. File contains illegal silent truncation.",
-                                "content": f"Title Length: {len(csv_title)}"
-                            })
+                with self.tracer.span("validate.mirror") as span:
+                    self._mirror_audit(rep, csv_content, audit)
+                    span.add(bytes=len(csv_content))
             except Exception as e:
                 rep.append({
                     "level": "ERROR",
@@ -152,3 +397,91 @@ class CWRValidator:
                 })
 
         return rep, stats
+
+    def _mirror_audit(self, rep: list, csv_content, audit: RecordAudit):
+        header, rows = split_csv_header(iter_csv_rows(csv_content))
+
+        # Header Target Match
+        columns = [str(c).replace('ï»¿', '').replace('"', '').strip().upper() for c in header]
+        if 'TRACK: TITLE' not in columns:
+            rep.append({
+                "level": "CRITICAL",
+                "line": 0,
+                "message": "MIRROR AUDIT FAIL: CSV missing required 'TRACK: TITLE' column.",
+                "content": "Headers: " + ", ".join(columns)
+            })
+            return
+        col = columns.index('TRACK: TITLE')
+
+        # One pass over the title column: normalized title -> [count, first row]
+        csv_titles = {}
+        too_long = []
+        row_count = 0
+        for row_count, row in enumerate(rows, 1):
+            csv_title = row[col].strip() if col < len(row) else ""
+            # Truncation Rule Verification
+            if len(csv_title) > 60:
+                too_long.append({
+                    "level": "CRITICAL",
+                    "line": row_count,
+                    "message": f"CRITICAL_MISMATCH: CSV Title '{csv_title}' exceeds 60 characters. File contains illegal silent truncation.",
+                    "content": f"Title Length: {len(csv_title)}"
+                })
+            key = clean_value(csv_title)
+            seen = csv_titles.get(key)
+            if seen is None:
+                csv_titles[key] = [1, row_count]
+            else:
+                seen[0] += 1
+
+        # Zero-Truncation Match: Count Verification
+        if audit.transactions != row_count:
+            rep.append({
+                "level": "CRITICAL",
+                "line": 0,
+                "message": f"MIRROR AUDIT FAIL: NWR generation count ({audit.transactions}) does not match source CSV row count ({row_count}).",
+                "content": ""
+            })
+        rep.extend(too_long)
+
+        # Per-NWR Title Cross-Check (hash join on normalized titles)
+        nwr_titles = audit.titles
+        extras = {}
+        for title, (count, line_num) in nwr_titles.items():
+            surplus = count - csv_titles.get(title, (0,))[0]
+            if surplus > 0:
+                extras[title] = [surplus, line_num]
+        missing = []
+        for title, (count, row_num) in csv_titles.items():
+            short = count - nwr_titles.get(title, (0,))[0]
+            if short > 0:
+                missing.append([title, short, row_num])
+
+        for item in missing:
+            title, short, row_num = item
+            clipped = extras.get(title[:60].rstrip()) if len(title) > 60 else None
+            while clipped and clipped[0] and item[1]:
+                clipped[0] -= 1
+                item[1] -= 1
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": clipped[1],
+                    "message": f"MIRROR AUDIT FAIL: NWR title is a truncated copy of source CSV row {row_num} title '{title}'.",
+                    "content": title[:60]
+                })
+        for title, (surplus, line_num) in extras.items():
+            if surplus:
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": line_num,
+                    "message": f"MIRROR AUDIT FAIL: NWR title '{title}' has no matching source CSV row ({surplus} unmatched).",
+                    "content": title
+                })
+        for title, short, row_num in missing:
+            if short:
+                rep.append({
+                    "level": "CRITICAL",
+                    "line": row_num,
+                    "message": f"MIRROR AUDIT FAIL: Source CSV title '{title}' (row {row_num}) has no matching NWR record ({short} unmatched).",
+                    "content": ""
+                })
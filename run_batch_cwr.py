@@ -0,0 +1,257 @@
+import argparse
+import errno
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Ensure we can import from local directory
+sys.path.append(os.getcwd())
+
+import config
+from cwr_cache import TransactionCache
+from cwr_engine import GENERATION_MODES, GenerationStats, check_cwr, write_cwr
+from cwr_gatekeeper import find_violations
+from cwr_ingest import load_csv_buffer
+from cwr_ledger import LEDGER_FILE, SequenceLedger
+from cwr_output import AtomicWriter
+from cwr_profile import TOP_N, format_summary, merge, profiled, summary
+from cwr_trace import Tracer
+from cwr_validator import CWRValidator
+
+# ==============================================================================
+# BATCH RUNNER
+# ==============================================================================
+# Generates and validates every CSV in a directory in a process pool. Quarter-end
+# releases arrive as 40+ album exports at once. Each worker writes its .V22
+# under a private temp name. The parent walks the results in filename order and
+# publishes each clean transmission under the next free CW[YY][NNNN]LUM_319.V22
+# name. Each number is reserved in the sequence ledger (cwr_ledger), then the
+# file is hard-linked into place. The link fails if the name already exists, so
+# a number is never shared with a concurrent run, the app, or a stray file.
+# Failed files never consume a number. A JSON manifest records per-stage
+# timings (cwr_trace), record counts and validation results per file. With
+# profile_dir, every worker runs under cProfile (cwr_profile). The per-file
+# profiles are merged into <profile_dir>/batch.pstats and batch.collapsed.txt.
+# With cache_path (rows mode), workers share a TransactionCache (cwr_cache):
+# re-running a corrected export re-renders only the rows that changed.
+
+def cwr_filename(year: int, sequence: int) -> str:
+    return f"CW{str(year)[-2:]}{int(sequence):04d}LUM_319.V22"
+
+def process_csv(csv_path: str, tmp_path: str, agreement_map: dict, mode: str = "rows", profile_memory: bool = False,
+                cache_path: str = None) -> dict:
+    # Worker: gatekeeper, engine dry run, generation and validation of one CSV.
+    # profile_memory adds tracemalloc peak/retained bytes to every stage.
+    result = {"csv": os.path.basename(csv_path), "status": "failed", "sequence": None, "filename": None,
+              "timings": {}, "stages": [], "records": {}, "bytes": 0, "validation": None, "errors": []}
+    tracer = Tracer(memory=profile_memory)
+    started = time.perf_counter()
+
+    try:
+        with tracer.span("load") as span:
+            with open(csv_path, 'rb') as f:
+                data = f.read()
+            header_row, catalog = load_csv_buffer(data)
+            span.add(rows=0 if catalog is None else len(catalog), bytes=len(data))
+        if catalog is None:
+            result["errors"].append({"message": "Schema not recognized: no header row found."})
+            return result
+
+        with tracer.span("gatekeeper") as span:
+            violations = find_violations(catalog)
+            span.add(rows=len(catalog))
+        if not violations.empty:
+            result["errors"] = violations.to_dict("records")
+            return result
+
+        with tracer.span("dry_run"):
+            findings = check_cwr(catalog, agreement_map=agreement_map, tracer=tracer)
+        critical = [f for f in findings if f["level"] == "CRITICAL"]
+        if critical:
+            result["errors"] = critical
+            return result
+
+        stats = GenerationStats()
+        if cache_path:
+            with tracer.span("generate"), TransactionCache(cache_path) as cache, AtomicWriter(tmp_path) as f:
+                result["bytes"] = write_cwr(f, catalog, agreement_map, mode=mode, stats=stats, tracer=tracer, cache=cache)
+            result["cache"] = {"hits": cache.hits, "misses": cache.misses}
+        else:
+            with tracer.span("generate"), AtomicWriter(tmp_path) as f:
+                result["bytes"] = write_cwr(f, catalog, agreement_map, mode=mode, stats=stats, tracer=tracer)
+        result["records"] = dict(stats.counts)
+
+        with tracer.span("validate"):
+            report, v_stats = CWRValidator(tracer=tracer).process_path(tmp_path, csv_content=data)
+        levels = {}
+        for item in report:
+            levels[item["level"]] = levels.get(item["level"], 0) + 1
+        result["validation"] = {**v_stats, "levels": levels,
+                                "critical": [{"line": r["line"], "message": r["message"]} for r in report if r["level"] == "CRITICAL"]}
+        if levels.get("CRITICAL"):
+            result["errors"].append({"message": f"Validator reported {levels['CRITICAL']} CRITICAL issue(s)."})
+            return result
+        result["status"] = "generated"
+        return result
+    except Exception as e:
+        result["errors"].append({"message": f"{type(e).__name__}: {e}"})
+        return result
+    finally:
+        # Top-level stages as {stage: seconds}; the full nested report under "stages"
+        result["stages"] = tracer.report()
+        result["timings"] = {s["stage"]: round(s["seconds"], 4) for s in result["stages"] if s["depth"] == 0}
+        result["timings"]["total"] = round(time.perf_counter() - started, 4)
+        if profile_memory: result["peak_bytes"] = tracer.peak()
+        if result["status"] != "generated" and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def profile_csv(prefix: str, *args) -> dict:
+    # Worker: process_csv under cProfile, saved as <prefix>.pstats / .collapsed.txt.
+    with profiled(prefix, report=None):
+        result = process_csv(*args)
+    result["profile"] = f"{prefix}.pstats"
+    return result
+
+# errnos for a filesystem (or mount, e.g. some Drive / FUSE / SMB folders)
+# that cannot hard-link; publish falls back to an exclusive-create claim.
+NO_LINK_ERRNOS = {errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EXDEV}
+
+def place_exclusive(tmp_path: str, final_path: str):
+    # Moves tmp_path to final_path without ever replacing an existing file;
+    # raises FileExistsError if the name is taken. A hard link is one atomic
+    # step. Without links the name is first claimed with O_CREAT|O_EXCL (an
+    # empty placeholder) and the finished file is renamed over the claim.
+    try:
+        os.link(tmp_path, final_path)
+    except OSError as e:
+        if isinstance(e, FileExistsError) or e.errno not in NO_LINK_ERRNOS: raise
+        os.close(os.open(final_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        try:
+            os.replace(tmp_path, final_path)
+        except OSError:
+            os.remove(final_path)
+            raise
+        return
+    os.remove(tmp_path)
+
+def publish(tmp_path: str, output_dir: str, year: int, ledger: SequenceLedger, owner: str, minimum: int = 1) -> tuple:
+    # Claims the first free sequence >= minimum; returns (sequence, path). The
+    # number is marked issued once the file is in place. A number whose file
+    # already exists is marked issued too, so it is not handed out again.
+    while True:
+        sequence = ledger.reserve(year, owner=owner, minimum=minimum)
+        filename = cwr_filename(year, sequence)
+        final_path = os.path.join(output_dir, filename)
+        try:
+            place_exclusive(tmp_path, final_path)
+        except FileExistsError:
+            ledger.issue(sequence, f"{filename} (already on disk)", year, owner=owner)
+            minimum = sequence + 1
+            continue
+        except OSError:
+            ledger.release(sequence, year, owner=owner)
+            raise
+        ledger.issue(sequence, filename, year, owner=owner)
+        return sequence, final_path
+
+def run_batch(input_dir: str, output_dir: str, agreement_map: dict = None, workers: int = None,
+              start_sequence: int = None, year: int = None, mode: str = "rows", ledger_path: str = LEDGER_FILE,
+              profile_memory: bool = False, profile_dir: str = None, top: int = TOP_N, cache_path: str = None) -> tuple:
+    # Returns (manifest path, manifest). start_sequence is a lower bound on the
+    # numbers handed out; by default the ledger's next sequence is used.
+    started = time.perf_counter()
+    year = year or datetime.now().year
+    agreement_map = dict(agreement_map if agreement_map is not None else config.AGREEMENT_MAP)
+    owner = f"batch:{os.getpid()}:{time.time():.0f}"
+    os.makedirs(output_dir, exist_ok=True)
+    csv_files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.csv'))
+    workers = workers or min(len(csv_files), os.cpu_count() or 1) or 1
+
+    files = []
+    with SequenceLedger(ledger_path) as ledger, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for n, name in enumerate(csv_files):
+            tmp_path = os.path.join(output_dir, f".batch-{os.getpid()}-{n:04d}.V22.tmp")
+            args = (os.path.join(input_dir, name), tmp_path, agreement_map, mode, profile_memory, cache_path)
+            if profile_dir:
+                futures.append((tmp_path, pool.submit(profile_csv, os.path.join(profile_dir, os.path.splitext(name)[0]), *args)))
+            else:
+                futures.append((tmp_path, pool.submit(process_csv, *args)))
+        # Results are taken in submission (filename) order, so sequences are too
+        for tmp_path, future in futures:
+            result = future.result()
+            if result["status"] == "generated":
+                try:
+                    sequence, final_path = publish(tmp_path, output_dir, year, ledger, owner, start_sequence or 1)
+                    result.update(status="published", sequence=sequence, filename=os.path.basename(final_path))
+                except (OSError, ValueError) as e:
+                    result.update(status="failed")
+                    result["errors"].append({"message": f"{type(e).__name__}: {e}"})
+                    if os.path.exists(tmp_path): os.remove(tmp_path)
+            files.append(result)
+            peak = f", peak {result['peak_bytes'] / 1e6:.1f} MB" if result.get("peak_bytes") else ""
+            print(f"[{result['status'].upper()}] {result['csv']} -> {result['filename'] or '-'} ({result['timings'].get('total', 0):.2f}s{peak})")
+
+    profile = None
+    profiles = [f["profile"] for f in files if os.path.exists(f.get("profile") or "")]
+    if profiles:
+        prefix = os.path.join(profile_dir, "batch")
+        stats = merge(profiles, prefix)
+        profile = {"pstats": f"{prefix}.pstats", "collapsed": f"{prefix}.collapsed.txt", "top": summary(stats, top)}
+        print(f"\n--- PROFILE ({len(profiles)} file(s)): {profile['pstats']}, {profile['collapsed']} ---")
+        print(format_summary(profile["top"]))
+
+    manifest = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "input_dir": os.path.abspath(input_dir),
+        "output_dir": os.path.abspath(output_dir),
+        "workers": workers,
+        "mode": mode,
+        "elapsed": round(time.perf_counter() - started, 4),
+        "published": sum(f["status"] == "published" for f in files),
+        "failed": sum(f["status"] != "published" for f in files),
+        "profile": profile,
+        "files": files,
+    }
+    manifest_path = os.path.join(output_dir, f"batch_manifest_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.json")
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest_path, manifest
+
+def main(argv=None):
+    drive = getattr(config, "LOCAL_DRIVE_PATH", ".")
+    parser = argparse.ArgumentParser(description="Generate and validate a directory of catalog CSVs as CWR 2.2 transmissions.")
+    parser.add_argument("input_dir", nargs="?", default=os.path.join(drive, "INPUT_CSVS"))
+    parser.add_argument("--output-dir", default=os.path.join(drive, "OUTPUT_V22"))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--start-sequence", type=int, default=None, help="Lowest sequence to hand out (defaults to the ledger's next sequence).")
+    parser.add_argument("--ledger", default=LEDGER_FILE)
+    parser.add_argument("--agreements", default=None, help="JSON file of publisher name -> agreement number (defaults to config.AGREEMENT_MAP).")
+    parser.add_argument("--mode", choices=GENERATION_MODES, default="rows")
+    parser.add_argument("--cache", default=None, metavar="PATH", help="Transaction cache (sqlite) shared by the workers; rows mode only.")
+    parser.add_argument("--profile", nargs="?", const="profiles", default=None, metavar="DIR",
+                        help="Run every worker under cProfile; per-file and merged .pstats/.collapsed.txt go to DIR (default: profiles).")
+    parser.add_argument("--top", type=int, default=TOP_N, help="Functions in the profile summary.")
+    parser.add_argument("--profile-memory", action="store_true", help="Record tracemalloc peak/retained bytes and top allocation sites per stage (slow).")
+    args = parser.parse_args(argv)
+    if args.cache and args.mode != "rows":
+        parser.error("--cache requires --mode rows")
+
+    agreement_map = None
+    if args.agreements:
+        with open(args.agreements, 'r') as f:
+            agreement_map = json.load(f)
+    manifest_path, manifest = run_batch(args.input_dir, args.output_dir, agreement_map, workers=args.workers,
+                                        start_sequence=args.start_sequence, mode=args.mode, ledger_path=args.ledger,
+                                        profile_memory=args.profile_memory, profile_dir=args.profile, top=args.top,
+                                        cache_path=args.cache)
+    print(f"\n{manifest['published']} published, {manifest['failed']} failed in {manifest['elapsed']:.2f}s")
+    print(f"Manifest: {manifest_path}")
+    return 1 if manifest["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
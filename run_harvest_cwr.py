@@ -1,12 +1,17 @@
-
-import pandas as pd
+import argparse
 import sys
 import os
 
 # Ensure we can import from local directory
 sys.path.append(os.getcwd())
 
-from cwr_engine import generate_cwr_content
+from cwr_cache import TransactionCache
+from cwr_engine import write_cwr
+from cwr_ingest import detect_header_row, read_csv_chunks
+from cwr_index import IndexedTransmission
+from cwr_output import AtomicWriter
+from cwr_profile import TOP_N, profiled
+from cwr_trace import Tracer
 from cwr_validator import CWRValidator
 import config
 
@@ -15,7 +20,7 @@ import config
 # Let's inspect the CSV first to see publisher names, but for now we'll add a catch-all or dynamic map if possible.
 # actually, generate_cwr_content takes agreement_map as arg.
 
-def run_harvest_test():
+def run_harvest_test(cache_path=None):
     input_csv = "rC055_Metadata 2.csv"
     output_dir = "OUTPUT_CWR"
     os.makedirs(output_dir, exist_ok=True)
@@ -23,7 +28,8 @@ def run_harvest_test():
 
     print(f"Reading {input_csv}...")
     try:
-        df = pd.read_csv(input_csv, encoding='latin1')
+        h_idx = detect_header_row(input_csv, encoding='latin1')
+        chunks = read_csv_chunks(input_csv, header_row=h_idx, encoding='latin1')
     except Exception as e:
         print(f"Error reading CSV: {e}")
         return
@@ -39,45 +45,33 @@ def run_harvest_test():
     # We will use the string "4316161" and let the Assembler ljust it, or we can explicity pad.
     # Let's map it explicitly.
     agreement_map["PASHALINA PUBLISHING COMPANY"] = "4316161"
-    
-    # scan for publisher columns to catch others
-    pub_cols = [c for c in df.columns if "PUBLISHER" in c and "Name" in c]
-    for col in pub_cols:
-        names = df[col].unique()
-        for name in names:
-            if pd.isna(name): continue
-            name = str(name).strip().upper()
-            if name not in agreement_map:
-                # NO FALLBACK allowed. Engine will raise ValueError.
-                pass
+    # NO FALLBACK allowed. Publishers missing from the map halt the engine.
     
     print(f"Agreement Map: {len(agreement_map)} entries.")
     print(f"Mapped PASHALINA: '{agreement_map.get('PASHALINA PUBLISHING COMPANY', 'NOT FOUND')}'")
 
-    from cwr_engine import Blueprints
-    print("\n--- SPU BLUEPRINT (MATH PROOF) ---")
-    print(Blueprints.SPU)
-
+    tracer = Tracer()
     print("Generating CWR Content...")
+    print(f"Streaming records to {output_file}...")
     try:
-        content, warnings = generate_cwr_content(df, agreement_map)
+        if cache_path:
+            # Rows unchanged since the last run are spliced from the transaction cache
+            with TransactionCache(cache_path) as cache, AtomicWriter(output_file) as f:
+                write_cwr(f, chunks, agreement_map, tracer=tracer, cache=cache)
+            print(f"Transaction cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+        else:
+            with AtomicWriter(output_file) as f:
+                write_cwr(f, chunks, agreement_map, tracer=tracer)
+        print(f"Wrote {f.bytes} bytes in {f.elapsed:.2f}s ({f.throughput:.1f} MB/s)")
     except Exception as e:
         print(f"CRITICAL ERROR in Engine: {e}")
         import traceback
         traceback.print_exc()
         return
 
-    if warnings:
-        print(f"Engine Warnings: {len(warnings)}")
-        # for w in warnings[:5]: print(f" - {w}")
-
-    print(f"Writing parsed content to {output_file}...")
-    with open(output_file, 'w', encoding='latin1') as f:
-        f.write(content)
-
     print("\n--- VALIDATING OUTPUT ---")
-    validator = CWRValidator()
-    report, stats = validator.process_file(content)
+    validator = CWRValidator(tracer=tracer)
+    report, stats = validator.process_path(output_file)
     
     critical_errors = [r for r in report if r['level'] == 'CRITICAL']
     errors = [r for r in report if r['level'] == 'ERROR']
@@ -95,12 +89,12 @@ def run_harvest_test():
     
     # Specific Checks requested by user
     print("\n--- AUDIT CHECKS ---")
+    tx = IndexedTransmission.open(output_file)
     
     # 1. REC Record Layout
-    rec_lines = [line for line in content.splitlines() if line.startswith("REC")]
-    if rec_lines:
-        print(f"Checking {len(rec_lines)} REC records...")
-        first_rec = rec_lines[0]
+    first_rec = tx.first("REC")
+    if first_rec:
+        print(f"Checking {tx.index.count('REC')} REC records...")
         print(f"Sample REC Length: {len(first_rec)} (Target: 508)")
         if len(first_rec) == 508:
             print("PASS: REC Length is 508.")
@@ -135,9 +129,8 @@ def run_harvest_test():
              print(f"WARNING: Label '{label_check}' found. Verify this matches CSV.")
 
         # Check ORN too
-        orn_lines = [line for line in content.splitlines() if line.startswith("ORN")]
-        if orn_lines:
-             first_orn = orn_lines[0]
+        first_orn = tx.first("ORN")
+        if first_orn:
              # ORN blueprint: (22,60,"{library}"), (100,60,"{label}")
              # Library at 22 (length 60) -> Index 22-82? No, 22+60=82.
              # Label at 100 (length 60)
@@ -152,10 +145,9 @@ def run_harvest_test():
                   print("FAIL: ORN/REC Label Mismatch.")
 
     # 2. SPU Layout & Agreement Position
-    spu_lines = [line for line in content.splitlines() if line.startswith("SPU")]
-    if spu_lines:
-        print(f"Checking {len(spu_lines)} SPU records...")
-        first_spu = spu_lines[0]
+    first_spu = tx.first("SPU")
+    if first_spu:
+        print(f"Checking {tx.index.count('SPU')} SPU records...")
         print(f"Sample SPU Length: {len(first_spu)} (Target: 166)")
         
         if len(first_spu) == 166:
@@ -181,5 +173,23 @@ def run_harvest_test():
         else:
              print(f"FAIL: Expected 'PG' at Pos 165, found '{pg_check}'")
 
+    tx.close()
+
+    # Per-stage timings (cwr_trace), beside the output
+    with open(output_file + ".trace.json", 'w') as f:
+        f.write(tracer.to_json(indent=2))
+    print(f"\n--- STAGE TIMINGS ({output_file}.trace.json) ---")
+    print(tracer.to_json(indent=2))
+
 if __name__ == "__main__":
-    run_harvest_test()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", nargs="?", const=os.path.join("OUTPUT_CWR", "rC055_GoldStandard"), default=None, metavar="PREFIX",
+                        help="Run under cProfile; writes PREFIX.pstats and PREFIX.collapsed.txt (flamegraph input).")
+    parser.add_argument("--cache", default=None, metavar="PATH", help="Transaction cache (sqlite): re-renders only rows changed since the last run.")
+    parser.add_argument("--top", type=int, default=TOP_N, help="Functions in the profile summary.")
+    args = parser.parse_args()
+    if args.profile:
+        with profiled(args.profile, args.top):
+            run_harvest_test(args.cache)
+    else:
+        run_harvest_test(args.cache)
@@ -4,13 +4,19 @@ import os
 import time
 from datetime import datetime
 import config
-import io
-import zipfile
-import json
+import hashlib
+import uuid
 
 try:
-    from cwr_engine import generate_cwr_content
+    from cwr_engine import generate_cwr_content, AgreementResolver
     from cwr_validator import CWRValidator
+    from cwr_ingest import load_csv_buffer
+    from cwr_gatekeeper import find_violations
+    from cwr_index import IndexedTransmission
+    from cwr_ledger import SequenceLedger, LEDGER_FILE, SEQ_FILE
+    from cwr_output import AtomicWriter, latin1_chunks
+    from cwr_artifacts import ArtifactStore
+    from cwr_trace import Tracer, NULL_TRACER
 except ImportError as e:
     st.error(f"SYSTEM ERROR: Component missing. {e}")
     st.stop() 
@@ -23,6 +29,87 @@ else:
     LUMINA_CONFIG = config.LUMINA_CONFIG
     AGREEMENT_MAP = config.AGREEMENT_MAP
 
+# --- CACHED LOADERS ---
+# Streamlit reruns the script on every widget click; parsed catalogs and the
+# agreement resolver are memoized across reruns and sessions.
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_catalog_file(path: str, mtime_ns: int, size: int):
+    # mtime/size are part of the key, so a Drive sync of an edited CSV reparses it.
+    with open(path, 'rb') as f:
+        return load_csv_buffer(f.read())
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_catalog_upload(content_hash: str, _data: bytes):
+    return load_csv_buffer(_data)
+
+@st.cache_resource(show_spinner=False)
+def agreement_resolver(map_items: tuple) -> AgreementResolver:
+    return AgreementResolver(dict(map_items))
+
+@st.cache_resource(show_spinner=False)
+def artifact_store() -> ArtifactStore:
+    return ArtifactStore()
+
+@st.cache_resource(show_spinner=False)
+def sequence_ledger() -> SequenceLedger:
+    # One connection for the server process, shared by every session and rerun.
+    return SequenceLedger(LEDGER_FILE, import_json=SEQ_FILE)
+
+def offer_download(state_key: str):
+    # The ZIP is compressed once from the spilled .V22 and served from disk on every rerun.
+    saved = st.session_state.get(state_key)
+    if not saved: return
+    digest, filename = saved
+    zip_path = artifact_store().zip_path(st.session_state["session_id"], digest, filename)
+    if zip_path is None:
+        del st.session_state[state_key]
+        st.info("The last output has expired from the session store. Generate it again to download.")
+        return
+    with open(zip_path, 'rb') as f:
+        st.download_button(
+            label="Download Secure CWR Archive (ZIP)",
+            data=f,
+            file_name=f"{filename}.zip",
+            mime="application/zip"
+        )
+
+def show_trace(report: list, expanded: bool = False):
+    # Per-stage wall time and throughput from a cwr_trace.Tracer report, plus
+    # peak/retained memory and top allocation sites when profiling was on.
+    if not report: return
+    with st.expander(f"Stage timings ({sum(r['seconds'] for r in report if r['depth'] == 0):.2f}s)", expanded=expanded):
+        table = pd.DataFrame(report).drop(columns=["depth", "sites"], errors="ignore")
+        for col in ("peak_bytes", "retained_bytes"):
+            if col in table: table[col.replace("_bytes", "_mb")] = (table.pop(col) / 1e6).round(2)
+        st.dataframe(table.fillna(""), use_container_width=True, hide_index=True)
+        sites = [{"stage": r["stage"], "site": site["site"], "mb": round(site["bytes"] / 1e6, 3), "blocks": site["blocks"]}
+                 for r in report for site in r.get("sites") or []]
+        if sites:
+            st.caption("Top allocation sites still live at the end of each stage")
+            st.dataframe(pd.DataFrame(sites), use_container_width=True, hide_index=True)
+
+def run_gatekeeper(df, status_box, resolver, tracer=NULL_TRACER):
+    # Shared by the sync and manual paths: halts with every offending row listed.
+    with tracer.span("gatekeeper") as span:
+        violations = find_violations(df)
+        span.add(rows=len(df))
+    if not violations.empty:
+        status_box.update(label=f"Gatekeeper: {len(violations)} violation(s)", state="error")
+        st.error(f"CRITICAL: {len(violations)} pre-flight violation(s). Fix every row listed below, then rerun.")
+        st.dataframe(violations, use_container_width=True, hide_index=True)
+        st.stop()
+    # Engine dry run: every length / agreement / share problem before generating
+    _, findings = generate_cwr_content(df, agreement_map=resolver, validate_only=True, tracer=tracer)
+    critical = [f for f in findings if f["level"] == "CRITICAL"]
+    if critical:
+        status_box.update(label=f"Dry run: {len(critical)} violation(s)", state="error")
+        st.error(f"CRITICAL: {len(critical)} engine violation(s). Generation would halt on the first one; fix every row listed below, then rerun.")
+        st.dataframe(pd.DataFrame(findings), use_container_width=True, hide_index=True)
+        st.stop()
+    if findings:
+        st.warning(f"{len(findings)} share value(s) are unparseable (written as 00000) or outside 0-100%. Review them below.")
+        st.dataframe(pd.DataFrame(findings), use_container_width=True, hide_index=True)
+
 # --- 2. DEFAULT UI SETUP & CSS ---
 st.set_page_config(page_title="Lumina CWR Suite", layout="centered", initial_sidebar_state="collapsed")
 
@@ -159,24 +246,15 @@ if os.path.exists("lumina_logo.png"):
 st.markdown("<h1 class='main-title'>Lumina CWR Suite</h1>", unsafe_allow_html=True)
 
 # --- 3. SEQUENCE VAULT LOGIC ---
-SEQ_FILE = "cwr_sequence_log.json"
+# sqlite ledger (WAL): concurrent sessions reserve numbers atomically, each
+# year starts at 1, and the legacy cwr_sequence_log.json is imported once.
 current_year = datetime.now().year
+ledger = sequence_ledger()
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
 
-if not os.path.exists(SEQ_FILE):
-    with open(SEQ_FILE, 'w') as f:
-        json.dump({"year": current_year, "history": []}, f)
-
-with open(SEQ_FILE, 'r') as f:
-    seq_data = json.load(f)
-
-if current_year > seq_data.get("year", 0):
-    seq_data["year"] = current_year
-    seq_data["history"] = []
-    with open(SEQ_FILE, 'w') as f:
-        json.dump(seq_data, f)
-
-history = seq_data.get("history", [])
-next_sequence = max([item["sequence"] for item in history] + [0]) + 1
+history = ledger.history(current_year)
+next_sequence = ledger.next_sequence(current_year)
 
 # --- 4. NAVIGATION TABS ---
 st.write("") # Spacer
@@ -192,6 +270,7 @@ with tab_gen:
         st.subheader("Sequence Logic")
         st.write("")
         cwr_sequence = st.number_input("Next Sequence Override", min_value=1, max_value=9999, value=int(next_sequence), step=1)
+        profile_memory = st.checkbox("Profile memory per stage", help="tracemalloc peak/retained bytes and top allocation sites. Generation runs much slower.")
         
         with st.expander("Log Accepted Registration"):
             uploaded_v22 = st.file_uploader("Upload accepted .V22", type=["V22", "cwr"], key="logger_uploader")
@@ -203,24 +282,18 @@ with tab_gen:
                 except ValueError:
                     extracted_seq = 0
                     
-                content = uploaded_v22.getvalue().decode("latin-1")
-                lines = content.replace('\r\n', '\n').split('\n')
                 library_name = "UNKNOWN"
                 album_code = "UNKNOWN"
-                for line in lines:
-                    if line.startswith("ORN") and len(line) >= 96:
-                        library_name = line[22:82].strip()
-                        album_code = line[82:96].strip()
-                        break
+                orn_line = IndexedTransmission(uploaded_v22.getvalue()).first("ORN", min_length=96)
+                if orn_line:
+                    library_name = orn_line[22:82].strip()
+                    album_code = orn_line[82:96].strip()
                 
                 new_label = f"{extracted_seq:04d} {album_code} {library_name}".strip()
                 st.write(f"Detected: **{new_label}**")
                 
                 if st.button("Mark as Officially Accepted"):
-                    if not any(item["sequence"] == extracted_seq for item in history):
-                        seq_data["history"].append({"sequence": extracted_seq, "label": new_label})
-                        with open(SEQ_FILE, 'w') as f:
-                            json.dump(seq_data, f)
+                    if ledger.commit(extracted_seq, new_label, year=current_year):
                         st.success("Logged successfully!")
                         time.sleep(1)
                         st.rerun()
@@ -253,18 +326,17 @@ with tab_gen:
         if local_files:
             selected_file = st.selectbox("Select CSV from Google Drive (Local Sync)", local_files)
             if st.button("Process & Auto-Sync"):
+                tracer = Tracer(memory=profile_memory)
+                reserved = None
                 try:
                     with st.status("Running V22 Engine...", expanded=True) as status:
                         st.write("Fetching IDs from Secure Vault...")
                         # 1. Read CSV
                         csv_path = os.path.join(input_dir, selected_file)
-                        df_preview = pd.read_csv(csv_path, header=None, nrows=20)
-                        h_idx = -1
-                        MARKERS = ["TRACK: TITLE", "SOURCEAUDIO ID", "TITLE", "LIBRARY: NAME"]
-                        for i, row in df_preview.iterrows():
-                            row_str = row.astype(str).str.cat(sep=" ").upper()
-                            if any(m in row_str for m in MARKERS):
-                                h_idx = i; break
+                        csv_stat = os.stat(csv_path)
+                        with tracer.span("load_csv") as span:
+                            h_idx, catalog = load_catalog_file(csv_path, csv_stat.st_mtime_ns, csv_stat.st_size)
+                            span.add(rows=0 if catalog is None else len(catalog), bytes=csv_stat.st_size)
                 
                         if h_idx == -1:
                             status.update(label="Error: Schema not recognized", state="error")
@@ -272,78 +344,52 @@ with tab_gen:
                             st.stop()
 
                         st.write("Running Pre-Flight Data Gatekeeper...")
-                        df = pd.read_csv(csv_path, header=h_idx)
                         
-                        # Apply Gatekeeper Checks
-                        for i, row in df.iterrows():
-                            # Work Title (60 chars)
-                            title_val = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['TRACK: TITLE', 'TITLE', 'TRACK TITLE']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['TRACK: TITLE', 'TITLE', 'TRACK TITLE']]) > 0 else '').strip()
-                            if len(title_val) > 60:
-                                st.error(f"CRITICAL: Change the Work Title ('{title_val}'). It exceeds 60 characters.")
-                                st.stop()
-                                
-                            # ISRC (12 chars strictly)
-                            isrc = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['CODE: ISRC', 'ISRC']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['CODE: ISRC', 'ISRC']]) > 0 else '').strip()
-                            if isrc and len(isrc) != 12:
-                                st.error(f"CRITICAL: Change the ISRC ('{isrc}'). It must be exactly 12 characters.")
-                                st.stop()
-                                
-                            # Album Code (exists and <= 60 chars)
-                            album_val = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['ALBUM: CODE', 'ALBUM CODE', 'ALBUM']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['ALBUM: CODE', 'ALBUM CODE', 'ALBUM']]) > 0 else '').strip()
-                            if not album_val:
-                                st.error("CRITICAL: Missing ALBUM: CODE.")
-                                st.stop()
-                            if len(album_val) > 60:
-                                st.error(f"CRITICAL: Change the Album Code ('{album_val}'). It exceeds 60 characters.")
-                                st.stop()
-                                
-                            # Label / Library (60 chars)
-                            label_val = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['LIBRARY NAME', 'LABEL', 'LIBRARY: NAME']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['LIBRARY NAME', 'LABEL', 'LIBRARY: NAME']]) > 0 else '').strip()
-                            if len(label_val) > 60:
-                                st.error(f"CRITICAL: Change the Label Name ('{label_val}'). It exceeds 60 characters.")
-                                st.stop()
+                        # Apply Gatekeeper Checks (every violation, one table)
+                        run_gatekeeper(catalog, status, agreement_resolver(tuple(AGREEMENT_MAP.items())), tracer)
 
                         st.write("Generating HDR/GRH/NWR Records...")
                         # Generate CWR with Map & Warnings
-                        cwr, warnings = generate_cwr_content(df, agreement_map=AGREEMENT_MAP)
+                        cwr, gen_stats = generate_cwr_content(catalog, agreement_map=agreement_resolver(tuple(AGREEMENT_MAP.items())), tracer=tracer)
                         
-                        if warnings:
-                            for w in warnings:
+                        if gen_stats.warnings:
+                            for w in gen_stats.warnings:
                                 st.warning(w)
                         
                         # Generate Strict Filename (CW[YY][NNNN]LUM_319.V22)
                         yr = str(current_year)[-2:]
                         filename = f"CW{yr}{int(cwr_sequence):04d}LUM_319.V22"
-                        
                         # --- PRE-FLIGHT CHECKLIST ---
                         st.write("Running Mandatory Pre-Flight Checks...")
+                        with tracer.span("preflight") as span:
+                            # CHECK 1: Filename compliance
+                            if not (filename.startswith("CW") and "LUM_" in filename and filename.endswith(".V22")):
+                                raise ValueError(f"PRE-FLIGHT FAIL: Invalid filename format '{filename}'")
                         
-                        # CHECK 1: Filename compliance
-                        if not (filename.startswith("CW") and "LUM_" in filename and filename.endswith(".V22")):
-                            raise ValueError(f"PRE-FLIGHT FAIL: Invalid filename format '{filename}'")
-                        
-                        cwr_lines = cwr.replace('\r\n', '\n').split('\n')
-                        hdr_line = cwr_lines[0] if cwr_lines else ""
+                            # Checks 2-4 read the generation stats instead of re-splitting the output
+                            hdr_line = cwr[:cwr.find('\r\n')]
                         
-                        # CHECK 2: HDR Submitter LUM and Version 2.200
-                        if "LUM" not in hdr_line or "2.200" not in hdr_line:
-                            raise ValueError("PRE-FLIGHT FAIL: HDR record does not contain Submitter LUM and/or Version 2.200")
+                            # CHECK 2: HDR Submitter LUM and Version 2.200
+                            if "LUM" not in hdr_line or "2.200" not in hdr_line:
+                                raise ValueError("PRE-FLIGHT FAIL: HDR record does not contain Submitter LUM and/or Version 2.200")
                             
-                        # CHECK 3: Symmetry Group exactly 182 characters
-                        for l in cwr_lines:
-                            rec_type = l[:3]
-                            if rec_type in ["NWR", "SWR", "SWT", "SPU", "SPT", "REV"]:
-                                if len(l) != 182:
-                                    raise ValueError(f"PRE-FLIGHT FAIL: {rec_type} record length must be exactly 182 characters. Found: {len(l)}")
+                            # CHECK 3: Symmetry Group exactly 182 characters
+                            for rec_type in ["NWR", "SWR", "SWT", "SPU", "SPT", "REV"]:
+                                for length in gen_stats.lengths(rec_type):
+                                    if length != 182:
+                                        raise ValueError(f"PRE-FLIGHT FAIL: {rec_type} record length must be exactly 182 characters. Found: {length}")
                             
-                        # CHECK 4: Single CD Source REC record validation
-                        import re
-                        rec_lines = [l for l in cwr_lines if l.startswith("REC")]
-                        nwr_count = len([l for l in cwr_lines if l.startswith("NWR")])
-                        cd_sources = len([l for l in rec_lines if len(l) > 264 and l[262:265] == 'CD ' or l[262:264] == 'CD'])
+                            # CHECK 4: Single CD Source REC record validation
+                            nwr_count = gen_stats.count("NWR")
+                            cd_sources = gen_stats.rec_sources["CD"]
+                        
+                            if cd_sources != nwr_count:
+                                raise ValueError(f"PRE-FLIGHT FAIL: Works are missing matching CD Source REC records (Found {cd_sources} REC 'CD' for {nwr_count} NWR Works)")
+                            span.add(rows=nwr_count, records=sum(gen_stats.counts.values()))
                         
-                        if cd_sources != nwr_count:
-                            raise ValueError(f"PRE-FLIGHT FAIL: Works are missing matching CD Source REC records (Found {cd_sources} REC 'CD' for {nwr_count} NWR Works)")
+                        # Claim the number only once the output is known good; raises
+                        # SequenceTaken if another session holds it
+                        reserved = ledger.reserve(current_year, int(cwr_sequence), owner=st.session_state["session_id"])
                         
                         st.write(f"Syncing {filename} to Google Drive...")
                         
@@ -354,56 +400,50 @@ with tab_gen:
                         
                         final_path = os.path.join(output_path, filename)
                         
-                        # Timeout Logic
-                        start_time = time.time()
-                        with open(final_path, "w") as f:
-                            f.write(cwr)
+                        # Atomic latin-1 write: temp file + fsync + rename, timeout checked per chunk
+                        with tracer.span("drive_write") as span, AtomicWriter(final_path, timeout=15) as out:
+                            out.writelines(latin1_chunks(cwr))
+                        span.add(records=sum(gen_stats.counts.values()), bytes=out.bytes)
                             
                         # Verify
                         if not os.path.exists(final_path):
                             raise Exception("File verified as missing after write.")
-                        
-                        elapsed = time.time() - start_time
-                        if elapsed > 15:
-                             raise TimeoutError("Write operation took too long.")
+                        ledger.issue(reserved, filename, current_year, owner=st.session_state["session_id"])
+                        reserved = None
+                        st.write(f"Wrote {out.bytes / 1e6:.2f} MB in {out.elapsed:.2f}s ({out.throughput:.1f} MB/s)")
 
                         status.update(label="Sync Successful!", state="complete")
                         st.success(f"Success! File synced to OUTPUT_V22: {filename}")
                         
-                        # State Management for Download Rerun Fix
-                        st.session_state[f'cwr_bytes_sync'] = cwr.encode('latin-1')
-                        st.session_state[f'filename_sync'] = filename
+                        # State Management for Download Rerun Fix (bytes spill to the artifact store)
+                        with tracer.span("artifact_spill") as span:
+                            st.session_state['artifact_sync'] = (artifact_store().put(st.session_state["session_id"], filename, cwr), filename)
+                            span.add(bytes=len(cwr))
+                        st.session_state['trace_sync'] = tracer.report()
                         
                         st.rerun()
                 except Exception as e:
+                    if reserved is not None:
+                        # Failed before the file was written: give the number back
+                        ledger.release(reserved, current_year, owner=st.session_state["session_id"])
                     st.error(f"FATAL ERROR: {e}")
+                    show_trace(tracer.report(), expanded=True)
                     
-            if 'cwr_bytes_sync' in st.session_state and 'filename_sync' in st.session_state:
-                filename = st.session_state['filename_sync']
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-                    zf.writestr(filename, st.session_state['cwr_bytes_sync'])
-                
-                st.download_button(
-                    label="Download Secure CWR Archive (ZIP)",
-                    data=zip_buffer.getvalue(),
-                    file_name=f"{filename}.zip",
-                    mime="application/zip"
-                )
+            offer_download('artifact_sync')
+            show_trace(st.session_state.get('trace_sync'))
         else:
             uploaded_file = st.file_uploader("Upload CSV file manually", type="csv")
             if uploaded_file:
                 if st.button("Generate & Download"):
+                    tracer = Tracer(memory=profile_memory)
+                    reserved = None
                     try:
                         with st.status("Generating CWR File...", expanded=True) as s:
                             st.write("Reading Agreement Vault...")
-                            df_preview = pd.read_csv(uploaded_file, header=None, nrows=20)
-                            h_idx = -1
-                            MARKERS = ["TRACK: TITLE", "SOURCEAUDIO ID", "TITLE", "LIBRARY: NAME"]
-                            for i, row in df_preview.iterrows():
-                                row_str = row.astype(str).str.cat(sep=" ").upper()
-                                if any(m in row_str for m in MARKERS):
-                                    h_idx = i; break
+                            csv_bytes = uploaded_file.getvalue()
+                            with tracer.span("load_csv") as span:
+                                h_idx, catalog = load_catalog_upload(hashlib.sha256(csv_bytes).hexdigest(), csv_bytes)
+                                span.add(rows=0 if catalog is None else len(catalog), bytes=len(csv_bytes))
                     
                             if h_idx == -1:
                                 s.update(label="Error: Schema not recognized", state="error")
@@ -411,45 +451,17 @@ with tab_gen:
                                 st.stop()
 
                             st.write("Running Pre-Flight Data Gatekeeper...")
-                            uploaded_file.seek(0)
-                            df = pd.read_csv(uploaded_file, header=h_idx)
                             
-                            # Apply Gatekeeper Checks
-                            for i, row in df.iterrows():
-                                # Work Title (60 chars)
-                                title_val = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['TRACK: TITLE', 'TITLE', 'TRACK TITLE']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['TRACK: TITLE', 'TITLE', 'TRACK TITLE']]) > 0 else '').strip()
-                                if len(title_val) > 60:
-                                    st.error(f"CRITICAL: Change the Work Title ('{title_val}'). It exceeds 60 characters.")
-                                    st.stop()
-                                    
-                                # ISRC (12 chars strictly)
-                                isrc = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['CODE: ISRC', 'ISRC']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['CODE: ISRC', 'ISRC']]) > 0 else '').strip()
-                                if isrc and len(isrc) != 12:
-                                    st.error(f"CRITICAL: Change the ISRC ('{isrc}'). It must be exactly 12 characters.")
-                                    st.stop()
-                                    
-                                # Album Code (exists and <= 60 chars)
-                                album_val = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['ALBUM: CODE', 'ALBUM CODE', 'ALBUM']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['ALBUM: CODE', 'ALBUM CODE', 'ALBUM']]) > 0 else '').strip()
-                                if not album_val:
-                                    st.error("CRITICAL: Missing ALBUM: CODE.")
-                                    st.stop()
-                                if len(album_val) > 60:
-                                    st.error(f"CRITICAL: Change the Album Code ('{album_val}'). It exceeds 60 characters.")
-                                    st.stop()
-                                    
-                                # Label / Library (60 chars)
-                                label_val = str(pd.Series([row[c] for c in df.columns if str(c).upper() in ['LIBRARY NAME', 'LABEL', 'LIBRARY: NAME']]).dropna().iloc[0] if len([row[c] for c in df.columns if str(c).upper() in ['LIBRARY NAME', 'LABEL', 'LIBRARY: NAME']]) > 0 else '').strip()
-                                if len(label_val) > 60:
-                                    st.error(f"CRITICAL: Change the Label Name ('{label_val}'). It exceeds 60 characters.")
-                                    st.stop()
+                            # Apply Gatekeeper Checks (every violation, one table)
+                            run_gatekeeper(catalog, s, agreement_resolver(tuple(AGREEMENT_MAP.items())), tracer)
 
                             st.write("Aligning Record Positions...")
                             
                             # Generate CWR with Map & Warnings
-                            cwr, warnings = generate_cwr_content(df, agreement_map=AGREEMENT_MAP)
+                            cwr, gen_stats = generate_cwr_content(catalog, agreement_map=agreement_resolver(tuple(AGREEMENT_MAP.items())), tracer=tracer)
                             
-                            if warnings:
-                                for w in warnings:
+                            if gen_stats.warnings:
+                                for w in gen_stats.warnings:
                                     st.warning(w)
                             
                             s.update(label="Conversion Complete!", state="complete")
@@ -457,58 +469,58 @@ with tab_gen:
                             # Generate Strict Filename (CW[YY][NNNN]LUM_319.V22)
                             yr = str(current_year)[-2:]
                             filename = f"CW{yr}{int(cwr_sequence):04d}LUM_319.V22"
-                            
                             # --- PRE-FLIGHT CHECKLIST ---
                             st.write("Running Mandatory Pre-Flight Checks...")
+                            with tracer.span("preflight") as span:
+                                # CHECK 1: Filename compliance
+                                if not (filename.startswith("CW") and "LUM_" in filename and filename.endswith(".V22")):
+                                    raise ValueError(f"PRE-FLIGHT FAIL: Invalid filename format '{filename}'")
                             
-                            # CHECK 1: Filename compliance
-                            if not (filename.startswith("CW") and "LUM_" in filename and filename.endswith(".V22")):
-                                raise ValueError(f"PRE-FLIGHT FAIL: Invalid filename format '{filename}'")
-                            
-                            cwr_lines = cwr.replace('\r\n', '\n').split('\n')
-                            hdr_line = cwr_lines[0] if cwr_lines else ""
+                                # Checks 2-4 read the generation stats instead of re-splitting the output
+                                hdr_line = cwr[:cwr.find('\r\n')]
                             
-                            # CHECK 2: HDR Submitter LUM and Version 2.200
-                            if "LUM" not in hdr_line or "2.200" not in hdr_line:
-                                raise ValueError("PRE-FLIGHT FAIL: HDR record does not contain Submitter LUM and/or Version 2.200")
+                                # CHECK 2: HDR Submitter LUM and Version 2.200
+                                if "LUM" not in hdr_line or "2.200" not in hdr_line:
+                                    raise ValueError("PRE-FLIGHT FAIL: HDR record does not contain Submitter LUM and/or Version 2.200")
                                 
-                            # CHECK 3: Symmetry Group exactly 182 characters
-                            for l in cwr_lines:
-                                rec_type = l[:3]
-                                if rec_type in ["NWR", "SWR", "SWT", "SPU", "SPT", "REV"]:
-                                    if len(l) != 182:
-                                        raise ValueError(f"PRE-FLIGHT FAIL: {rec_type} record length must be exactly 182 characters. Found: {len(l)}")
+                                # CHECK 3: Symmetry Group exactly 182 characters
+                                for rec_type in ["NWR", "SWR", "SWT", "SPU", "SPT", "REV"]:
+                                    for length in gen_stats.lengths(rec_type):
+                                        if length != 182:
+                                            raise ValueError(f"PRE-FLIGHT FAIL: {rec_type} record length must be exactly 182 characters. Found: {length}")
                                 
-                            # CHECK 4: Single CD Source REC record validation
-                            rec_lines = [l for l in cwr_lines if l.startswith("REC")]
-                            nwr_count = len([l for l in cwr_lines if l.startswith("NWR")])
-                            cd_sources = len([l for l in rec_lines if len(l) > 264 and l[262:265] == 'CD ' or l[262:264] == 'CD'])
+                                # CHECK 4: Single CD Source REC record validation
+                                nwr_count = gen_stats.count("NWR")
+                                cd_sources = gen_stats.rec_sources["CD"]
                             
-                            if cd_sources != nwr_count:
-                                raise ValueError(f"PRE-FLIGHT FAIL: Works are missing matching CD Source REC records (Found {cd_sources} REC 'CD' for {nwr_count} NWR Works)")
+                                if cd_sources != nwr_count:
+                                    raise ValueError(f"PRE-FLIGHT FAIL: Works are missing matching CD Source REC records (Found {cd_sources} REC 'CD' for {nwr_count} NWR Works)")
+                                span.add(rows=nwr_count, records=sum(gen_stats.counts.values()))
                                 
+                            # Claim the number only once the output is known good; raises
+                            # SequenceTaken if another session holds it
+                            reserved = ledger.reserve(current_year, int(cwr_sequence), owner=st.session_state["session_id"])
+                            
                             st.success("CWR 2.2 File Ready")
                             
-                            # State Management for Download Rerun Fix
-                            st.session_state['cwr_bytes_manual'] = cwr.encode('latin-1')
-                            st.session_state['filename_manual'] = filename
+                            # State Management for Download Rerun Fix (bytes spill to the artifact store)
+                            with tracer.span("artifact_spill") as span:
+                                st.session_state['artifact_manual'] = (artifact_store().put(st.session_state["session_id"], filename, cwr), filename)
+                                span.add(bytes=len(cwr))
+                            ledger.issue(reserved, filename, current_year, owner=st.session_state["session_id"])
+                            reserved = None
+                            st.session_state['trace_manual'] = tracer.report()
                             
                             st.rerun()
                     except Exception as e:
+                        if reserved is not None:
+                            # Failed before the file was handed out: give the number back
+                            ledger.release(reserved, current_year, owner=st.session_state["session_id"])
                         st.error(f"FATAL ERROR: {e}")
+                        show_trace(tracer.report(), expanded=True)
                         
-                if 'cwr_bytes_manual' in st.session_state and 'filename_manual' in st.session_state:
-                    filename = st.session_state['filename_manual']
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-                        zf.writestr(filename, st.session_state['cwr_bytes_manual'])
-                    
-                    st.download_button(
-                        label="Download Secure CWR Archive (ZIP)",
-                        data=zip_buffer.getvalue(),
-                        file_name=f"{filename}.zip",
-                        mime="application/zip"
-                    )
+                offer_download('artifact_manual')
+                show_trace(st.session_state.get('trace_manual'))
 
 # --- 6. TASK: VALIDATOR ---
 with tab_val:
@@ -522,19 +534,22 @@ with tab_val:
         csv_source = st.file_uploader("2. Upload Source CSV (Optional, enables Mirror Audit)", type=["csv"])
         
     if v22_file:
-        cwr_content = v22_file.getvalue().decode("latin-1")
+        cwr_content = v22_file.getvalue()  # scanned as latin-1 bytes, never decoded whole
         csv_content = csv_source.getvalue() if csv_source else None
         
         st.markdown("<div class='run-btn-container'>", unsafe_allow_html=True)
         run_inspection = st.button("Run Strict Inspection", use_container_width=True)
+        profile_validation = st.checkbox("Profile memory per stage", key="profile_validation")
         st.markdown("</div>", unsafe_allow_html=True)
         
         if run_inspection:
-            validator = CWRValidator()
+            tracer = Tracer(memory=profile_validation)
+            validator = CWRValidator(tracer=tracer)
             rep, stats = validator.process_file(cwr_content, csv_content=csv_content, filename=v22_file.name)
             
             st.write("---")
             st.metric("Transactions (NWR Count)", stats["transactions"])
+            show_trace(tracer.report())
             
             if not rep and stats["transactions"] > 0: 
                 st.success("Syntax & Geometry Valid. Mirror Audit Passed.")
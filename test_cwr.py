@@ -59,3 +59,641 @@ def test_validator_cd_source():
     rec_line_bad = "REC" + " " * 259 + "OT" + " " * 243
     report, _ = validator.process_file(rec_line_bad)
     assert any("REC Source must be 'CD'" in item['message'] for item in report)
+
+def test_compiled_templates_match_canvas_stamp():
+    """Verify compiled record templates render byte-identically to per-field canvas stamping."""
+    from cwr_engine import FormatterEngine, COMPILED_SCHEMA
+    engine = FormatterEngine()
+    data = {"t_seq": "00000007", "rec_seq": "00000003", "title": "Night Drive", "pub_name": "Lumina Publishing UK",
+            "agreement_1": "4316161", "agreement_2": "4316161", "pr_share": "05000", "label": "L" * 60,
+            "library": "Red Cola", "cd_id": "RC055", "cut_number": "0007", "isrc": "GBABC2600001", "source": "CD"}
+    for record_type, record_def in CWR_SCHEMA.items():
+        canvas = [' '] * record_def.length
+        for field in record_def.fields:
+            val = field.name if field.is_constant else data.get(field.name, "")
+            engine.stamp(canvas, field.start, field.length, val, field.data_type, field.pad_char, field.name, data)
+        assert COMPILED_SCHEMA[record_type].render(data) == "".join(canvas)
+        assert len(engine.build(record_type, data)) == record_def.length
+
+    # Length firewall still halts before padding
+    with pytest.raises(ValueError, match="Field 'title' exceeds max length of 60"):
+        engine.build("NWR", {"title": "A" * 61})
+
+def _harvest_frame(titles):
+    return pd.DataFrame({
+        'Track: Title': titles,
+        'Code: ISRC': [f"GBABC26{i:05d}" for i in range(len(titles))],
+        'Album: Code': ['RC055'] * len(titles),
+        'Library: Name': ['Red Cola'] * len(titles),
+        'PUBLISHER:1: Name': ['Lumina Publishing UK', None, 'Lumina Publishing UK'][:len(titles)],
+        'PUBLISHER:1: Owner Performance Share %': [100, 50.0, None][:len(titles)],
+        'WRITER:1: Last Name': ['Smith', 'Jones', 'nan'][:len(titles)],
+        'WRITER:1: Owner Performance Share %': [100, 100, 100][:len(titles)],
+        'WRITER:1: PRO': [52.0, None, 21.0][:len(titles)],
+        'WRITER:1: Original Publisher': ['lumina publishing uk', None, None][:len(titles)],
+    })
+
+def test_vectorized_mode_matches_row_mode():
+    """Verify the column-wise engine emits the same records and raises the same firewall error."""
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    rows_cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', None]), agreement_map=test_map)
+    vec_cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', None]), agreement_map=test_map, mode="vectorized")
+    # HDR carries the creation timestamp
+    assert vec_cwr.split('\r\n')[1:] == rows_cwr.split('\r\n')[1:]
+
+    with pytest.raises(ValueError) as rows_err:
+        generate_cwr_content(_harvest_frame(['One', 'B' * 61, 'C' * 61]), agreement_map=test_map)
+    with pytest.raises(ValueError) as vec_err:
+        generate_cwr_content(_harvest_frame(['One', 'B' * 61, 'C' * 61]), agreement_map=test_map, mode="vectorized")
+    assert str(vec_err.value) == str(rows_err.value)
+
+def test_write_cwr_streams_identical_transmission():
+    """Verify the streamed writer produces the joined transmission with correct GRT/TRL counts."""
+    import io
+    from cwr_engine import generate_cwr_content, write_cwr
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    buf = io.BytesIO()
+    written = write_cwr(buf, _harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map, buffer_size=500)
+    streamed = buf.getvalue().decode('latin-1')
+    assert written == len(buf.getvalue())
+    assert streamed.split('\r\n')[1:] == cwr.split('\r\n')[1:]
+
+    trl = streamed.split('\r\n')[-2]
+    assert trl.startswith('TRL') and trl[8:16] == '00000003'
+
+def test_chunked_ingestion_continues_sequences():
+    """Verify chunked CSV ingestion detects the header once and keeps t_seq/work_id/cut_number monotonic."""
+    import io
+    from cwr_engine import generate_cwr_content
+    from cwr_ingest import detect_header_row, read_csv_chunks
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    body = _harvest_frame(['One', 'Two', 'Three']).to_csv(index=False)
+    csv_bytes = ("Harvest Export" + "," * 9 + "\nGenerated,2026-01-01" + "," * 8 + "\n" + body).encode('utf-8')
+
+    h_idx = detect_header_row(io.BytesIO(csv_bytes))
+    assert h_idx == 2
+    whole = pd.read_csv(io.BytesIO(csv_bytes), header=h_idx)
+    cwr, _ = generate_cwr_content(whole, agreement_map=test_map)
+    chunked, _ = generate_cwr_content(read_csv_chunks(io.BytesIO(csv_bytes), chunksize=1), agreement_map=test_map)
+    assert chunked.split('\r\n')[1:] == cwr.split('\r\n')[1:]
+
+    orn_cuts = [l[97:101] for l in chunked.split('\r\n') if l.startswith('ORN')]
+    assert orn_cuts == ['0001', '0002', '0003']
+
+def test_chunked_ingestion_is_independent_of_chunksize():
+    """Verify numeric-looking titles and IPIs render the same whatever rows share their chunk."""
+    import io
+    from cwr_engine import generate_cwr_content
+    from cwr_ingest import load_csv_buffer, read_csv_chunks
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    df = _harvest_frame(['1999', None, 'Night Drive'])
+    df['WRITER:1: IPI'] = ['12345678901', None, '00012345678']
+    csv_bytes = ("Harvest Export" + "," * 10 + "\n" + df.to_csv(index=False)).encode('utf-8')
+    _, whole = load_csv_buffer(csv_bytes)
+    expected = generate_cwr_content(whole, agreement_map=test_map)[0].split('\r\n')[1:]
+    assert '1999.0' not in '\r\n'.join(expected) and '12345678901' in '\r\n'.join(expected)
+    for chunksize in (1, 2, 3, 50_000):
+        chunked, _ = generate_cwr_content(read_csv_chunks(io.BytesIO(csv_bytes), chunksize=chunksize), agreement_map=test_map)
+        assert chunked.split('\r\n')[1:] == expected, chunksize
+
+def test_header_detection_accepts_ragged_preamble(tmp_path):
+    """Verify a preamble with fewer fields than the header is detected the same way for paths, buffers and bytes."""
+    import io
+    from bench_cwr import synthetic_catalog
+    from cwr_ingest import detect_header_row, load_csv_buffer, read_csv_chunks
+    csv_bytes, _ = synthetic_catalog(5)
+    path = tmp_path / 'ragged.csv'
+    path.write_bytes(csv_bytes)
+    header_row, whole = load_csv_buffer(csv_bytes)
+    binary = io.BytesIO(csv_bytes)
+    assert detect_header_row(path) == detect_header_row(binary) == detect_header_row(io.StringIO(csv_bytes.decode())) == header_row == 2
+    assert not binary.closed and binary.tell() == 0
+    chunked = pd.concat(read_csv_chunks(str(path), chunksize=2))
+    pd.testing.assert_frame_equal(chunked, whole)
+
+def test_sharded_generation_is_byte_identical():
+    """Verify process-pool shards merge back into the serial transmission, errors included."""
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    serial, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    sharded, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map, workers=2, shard_size=1)
+    assert sharded.split('\r\n')[1:] == serial.split('\r\n')[1:]
+
+    with pytest.raises(ValueError, match="Track 'BBBBB"):
+        generate_cwr_content(_harvest_frame(['One', 'B' * 61, 'C' * 61]), agreement_map=test_map, workers=2, shard_size=1)
+
+def test_agreement_resolver_matches_linear_scan():
+    """Verify the indexed resolver keeps the map-order substring precedence of the old linear scan."""
+    from cwr_engine import AgreementResolver
+    agreement_map = {'Red Cola': '1111', 'lumina publishing uk': '4316161', 'LUMINA': '2222', 'cola': '3333', 'Empty Deal': ''}
+    resolver = AgreementResolver(agreement_map)
+    names = ['Lumina Publishing UK', 'lumina music', 'Red Cola Songs', 'Big Cola', 'Unknown', 'The Empty Deal Co', 'Lumina Red Cola']
+    for name in names * 2:
+        expected = next((v for k, v in agreement_map.items() if k.upper() in name.upper()), "")
+        assert resolver.resolve(name) == expected
+
+def test_column_plan_discovers_all_writer_slots():
+    """Verify writer/publisher slots come from the header, including 10+ writers, in both engine modes."""
+    from cwr_engine import ColumnPlan, generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    df = _harvest_frame(['One'])
+    for w in range(2, 13):
+        df[f'WRITER:{w}: Last Name'] = f'Writer {w}'
+    df.columns = [str(c).strip().upper() for c in df.columns]
+
+    plan = ColumnPlan(df.columns)
+    assert [w[0] for w in plan.writers] == list(range(1, 13))
+    assert [p[0] for p in plan.publishers] == [1]
+
+    rows_cwr, _ = generate_cwr_content(df.copy(), agreement_map=test_map)
+    vec_cwr, _ = generate_cwr_content(df.copy(), agreement_map=test_map, mode="vectorized")
+    assert vec_cwr.split('\r\n')[1:] == rows_cwr.split('\r\n')[1:]
+    writer_ids = [l[19:28] for l in rows_cwr.split('\r\n') if l.startswith('SWR')]
+    assert writer_ids == [f"{w:09d}" for w in range(1, 13)]
+
+def test_streaming_validator_accepts_lines_and_files():
+    """Verify str, line-iterable and binary file inputs produce the same single-pass report."""
+    import io
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    lines = cwr.split('\r\n')
+    nwr = next(i for i, l in enumerate(lines) if l.startswith('NWR'))
+    lines[nwr] = lines[nwr][:141] + 'XXX' + lines[nwr][144:]
+    lines.insert(nwr + 1, '')
+    cwr = '\r\n'.join(lines)
+
+    expected = CWRValidator().process_file(cwr)
+    assert expected[1] == {"transactions": 3}
+    assert expected[0][0]["line"] == nwr + 1 and "ORI" in expected[0][0]["message"]
+    assert CWRValidator().process_file(iter(cwr.splitlines(True))) == expected
+    assert CWRValidator().process_file(io.BytesIO(cwr.encode('latin-1'))) == expected
+
+def test_mapped_validation_matches_decoded(tmp_path):
+    """Verify the mmap byte-level path reports exactly what the decoded path reports."""
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    lines = cwr.split('\r\n')
+    for i, line in enumerate(lines):
+        if line.startswith('SPU'): lines[i] = line[:100] + 'PG' + line[102:]
+        if line.startswith('REC'): lines[i] = line[:262] + 'DW' + line[264:]
+    cwr = '\r\n'.join(lines)
+    path = tmp_path / 'CW260001LUM_319.V22'
+    path.write_bytes(cwr.encode('latin-1'))
+
+    expected = CWRValidator().process_file(cwr, filename=path.name)
+    assert any('SPU GEOMETRY' in r['message'] for r in expected[0])
+    assert any("Found 'DW'" in r['message'] for r in expected[0])
+    assert CWRValidator().process_path(path, filename=path.name) == expected
+    assert CWRValidator().process_file(cwr.encode('latin-1'), filename=path.name) == expected
+
+def test_parallel_validation_merges_partitions(tmp_path, monkeypatch):
+    """Verify NWR-partitioned validation matches serial output, including cross-partition share credits."""
+    import cwr_validator
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    df = pd.concat([_harvest_frame(['One', 'Two', 'Three'])] * 4, ignore_index=True)
+    cwr, _ = generate_cwr_content(df, agreement_map=test_map)
+    lines = cwr.split('\r\n')
+    nwr = [i for i, l in enumerate(lines) if l.startswith('NWR')]
+    swr = next(l for l in lines if l.startswith('SWR'))
+    lines[nwr[5]] = lines[nwr[5]][:141] + 'XXX' + lines[nwr[5]][144:]
+    lines.insert(nwr[9], swr)  # credits the first work from a later partition
+    path = tmp_path / 'big.V22'
+    path.write_bytes('\r\n'.join(lines).encode('latin-1'))
+
+    monkeypatch.setattr(cwr_validator, 'MIN_PARTITION_BYTES', 1000)
+    serial = CWRValidator().process_path(path)
+    assert len(cwr_validator.partition_offsets(path.read_bytes(), 4)) == 5
+    assert CWRValidator().process_path(path, workers=2) == serial
+    assert serial[1] == {"transactions": 12}
+    assert [r['line'] for r in serial[0]][0] == nwr[5] + 1
+
+def test_mirror_audit_joins_titles_per_nwr():
+    """Verify the streamed mirror audit skips metadata rows and BOM, and reports unmatched titles both ways."""
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    csv_ok = "﻿Export,,\n,,\nTrack: Title,Album: Code\n one ,RC055\nTwo,RC055\nTHREE,RC055\n".encode('utf-8')
+    rep, stats = CWRValidator().process_file(cwr, csv_content=csv_ok)
+    assert not any('MIRROR' in r['message'] for r in rep)
+
+    csv_bad = "Track: Title,Album: Code\nOne,RC055\nTwo,RC055\nFour,RC055\n".encode('utf-8')
+    rep, _ = CWRValidator().process_file(cwr, csv_content=csv_bad)
+    messages = [r['message'] for r in rep if 'MIRROR' in r['message']]
+    assert len(messages) == 2
+    assert "NWR title 'THREE'" in messages[0]
+    assert "Source CSV title 'FOUR' (row 3)" in messages[1]
+
+def test_offset_index_lookups_and_sidecar(tmp_path):
+    """Verify the offset index finds records by type, work id, ISRC and title, and reloads from its sidecar."""
+    from cwr_engine import generate_cwr_content
+    from cwr_index import IndexedTransmission, SIDECAR_SUFFIX
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    cwr, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    lines = cwr.split('\r\n')[:-1]
+    path = tmp_path / 'CW260001LUM_319.V22'
+    path.write_bytes(cwr.encode('latin-1'))
+
+    with IndexedTransmission.open(path) as tx:
+        assert len(tx.index) == len(lines)
+        assert tx.index.count('NWR') == 3
+        assert tx.first('ORN', min_length=96) == next(l for l in lines if l.startswith('ORN'))
+        assert tx.index.find('title', 'two') == [1]
+        assert tx.index.find('isrc', 'GBABC2600002') == [2]
+        assert tx.index.find('work_id', '00000000000003') == [2]
+        assert tx.transaction(1) == [l for l in lines if l[3:11] == '00000001' and l[:3] not in ('HDR', 'GRH', 'GRT', 'TRL')]
+    assert (tmp_path / (path.name + SIDECAR_SUFFIX)).exists()
+    with IndexedTransmission.open(path) as tx:
+        assert tx.line(0) == lines[0]
+
+def test_transaction_cache_splices_shifted_rows(tmp_path, monkeypatch):
+    """Verify cached bodies are re-stamped with new sequence fields, evicted by size and dropped on schema change."""
+    import cwr_cache
+    from cwr_cache import TransactionCache
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    df = _harvest_frame(['One', 'Two', 'Three'])
+    shifted = pd.concat([_harvest_frame(['Zero']), df], ignore_index=True)
+    db = tmp_path / 'tx.db'
+
+    with TransactionCache(db) as cache:
+        generate_cwr_content(df.copy(), agreement_map=test_map, cache=cache)
+        assert (cache.hits, cache.misses) == (0, 3)
+        cached, _ = generate_cwr_content(shifted.copy(), agreement_map=test_map, cache=cache)
+        assert (cache.hits, cache.misses) == (3, 4)
+    plain, _ = generate_cwr_content(shifted.copy(), agreement_map=test_map)
+    assert cached.split('\r\n')[1:] == plain.split('\r\n')[1:]
+
+    with TransactionCache(db, max_bytes=2000) as cache:
+        cache.flush()
+        assert len(cache) < 4
+    monkeypatch.setattr(cwr_cache, 'schema_fingerprint', lambda: 'changed')
+    with TransactionCache(db) as cache:
+        assert len(cache) == 0
+
+def test_single_parse_csv_load_matches_chunked_reader():
+    """Verify the one-pass buffer loader finds the same header row and frame as the chunked reader."""
+    import io
+    from cwr_ingest import load_csv_buffer, read_csv_chunks
+    data = ("﻿Lumina Export,,\n,,\n\nTrack: Title,Code: ISRC,Album: Code\n"
+            "One,GBABC2600001,RC055\nTwo,GBABC2600002,RC055\n").encode('utf-8')
+    header_row, df = load_csv_buffer(data)
+    assert header_row == 2
+    chunked = pd.concat(read_csv_chunks(io.BytesIO(data), chunksize=1))
+    pd.testing.assert_frame_equal(df, chunked)
+    assert load_csv_buffer(b"a,b\n1,2\n") == (-1, None)
+
+def test_gatekeeper_reports_every_violation():
+    """Verify the pre-flight gatekeeper lists every offending row and field in one table."""
+    from cwr_gatekeeper import find_violations
+    df = pd.DataFrame({
+        'TRACK: TITLE': ['Fine', 'T' * 61, None],
+        'TITLE': [None, None, 'Fallback'],
+        'CODE: ISRC': ['GBABC2600001', 'SHORT', None],
+        'ALBUM: CODE': ['RC055', None, 'A' * 61],
+        'LIBRARY NAME': ['Lumina', 'Lumina', 'L' * 61],
+    })
+    v = find_violations(df)
+    assert list(v['row']) == [2, 2, 2, 3, 3]
+    assert list(v['field']) == ['title', 'isrc', 'album', 'album', 'label']
+    assert v['message'][1] == "CRITICAL: Change the ISRC ('SHORT'). It must be exactly 12 characters."
+    assert find_violations(df.iloc[:1]).empty
+
+def test_validate_only_collects_every_violation():
+    """Verify the dry run reports every length/agreement/share problem, first entry matching the raised error."""
+    from cwr_engine import generate_cwr_content
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    df = _harvest_frame(['One', 'T' * 61, 'Three'])
+    df.loc[0, 'PUBLISHER:1: Name'] = 'Unknown Pub'
+    df['PUBLISHER:1: Owner Performance Share %'] = [100, 50.0, 'half']
+    content, findings = generate_cwr_content(df.copy(), agreement_map=test_map, validate_only=True)
+    assert content is None
+    assert [(f['level'], f['row'], f['field']) for f in findings] == [
+        ('CRITICAL', 1, 'PUBLISHER:1: NAME'), ('CRITICAL', 2, 'title'), ('WARNING', 3, 'PUBLISHER:1: OWNER PERFORMANCE SHARE %')]
+    with pytest.raises(KeyError) as exc:
+        generate_cwr_content(df.copy(), agreement_map=test_map)
+    assert exc.value.args[0] == findings[0]['message']
+    assert generate_cwr_content(_harvest_frame(['One']), agreement_map=test_map, validate_only=True) == (None, [])
+
+def test_generation_stats_match_output():
+    """Verify the stats returned with the content tally exactly what a rescan of the output finds."""
+    import io
+    from collections import Counter
+    from cwr_engine import generate_cwr_content, write_cwr, GenerationStats
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    cwr, stats = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map)
+    lines = cwr.split('\r\n')[:-1]
+    assert stats.shapes == Counter((l[:3], len(l)) for l in lines)
+    assert stats.count('NWR') == stats.counts['NWR'] == 3
+    assert stats.lengths('NWR') == {len(lines[2]): 3}
+    assert stats.rec_sources == Counter({'CD': 3})
+    assert stats.warnings == []
+    streamed = GenerationStats()
+    write_cwr(io.BytesIO(), _harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map, stats=streamed)
+    assert streamed.shapes == stats.shapes
+
+def test_batch_runner_publishes_in_sequence_order(tmp_path):
+    """Verify batch sequences follow filename order, skip taken names and are not spent on failed files."""
+    import json
+    from cwr_ledger import SequenceLedger
+    from run_batch_cwr import run_batch
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    input_dir, output_dir = tmp_path / 'INPUT_CSVS', tmp_path / 'OUTPUT_V22'
+    input_dir.mkdir(); output_dir.mkdir()
+    _harvest_frame(['One', 'Two']).to_csv(input_dir / 'a.csv', index=False)
+    _harvest_frame(['T' * 61]).to_csv(input_dir / 'b.csv', index=False)
+    _harvest_frame(['Three']).to_csv(input_dir / 'c.csv', index=False)
+    _harvest_frame(['Four']).to_csv(input_dir / 'd.csv', index=False)
+    (output_dir / 'CW260006LUM_319.V22').write_text('taken')
+
+    path, manifest = run_batch(input_dir, output_dir, test_map, workers=2, start_sequence=5, year=2026, ledger_path=tmp_path / 'ledger.db')
+    assert [(f['csv'], f['status'], f['filename']) for f in manifest['files']] == [
+        ('a.csv', 'published', 'CW260005LUM_319.V22'), ('b.csv', 'failed', None),
+        ('c.csv', 'published', 'CW260007LUM_319.V22'), ('d.csv', 'published', 'CW260008LUM_319.V22')]
+    assert manifest['files'][0]['records']['NWR'] == 2
+    assert manifest['files'][0]['validation']['transactions'] == 2
+    with open(path) as f:
+        assert json.load(f)['published'] == 3
+    with SequenceLedger(tmp_path / 'ledger.db', import_json=None) as ledger:
+        assert [ledger.status(n, 2026) for n in (5, 6, 7, 8, 9)] == ['issued'] * 4 + [None]
+    assert not [p for p in output_dir.iterdir() if p.name.endswith('.tmp')]
+
+def test_publish_without_hard_links(tmp_path, monkeypatch):
+    """Verify publish claims names exclusively on filesystems that refuse hard links."""
+    import errno
+    import os
+    from cwr_ledger import SequenceLedger
+    from run_batch_cwr import publish
+    def no_link(src, dst):
+        raise OSError(errno.EPERM, "Operation not permitted")
+    monkeypatch.setattr(os, 'link', no_link)
+    (tmp_path / 'CW260001LUM_319.V22').write_text('taken')
+    tmp = tmp_path / '.batch.V22.tmp'
+    tmp.write_bytes(b'HDR')
+    with SequenceLedger(tmp_path / 'ledger.db', import_json=None) as ledger:
+        sequence, final_path = publish(str(tmp), str(tmp_path), 2026, ledger, 'batch')
+        assert (sequence, os.path.basename(final_path)) == (2, 'CW260002LUM_319.V22')
+        assert [ledger.status(n, 2026) for n in (1, 2)] == ['issued', 'issued']
+    assert (tmp_path / 'CW260001LUM_319.V22').read_text() == 'taken'
+    assert (tmp_path / 'CW260002LUM_319.V22').read_bytes() == b'HDR'
+    assert not tmp.exists()
+
+def test_sequence_ledger_reserves_atomically(tmp_path):
+    """Verify the ledger imports the JSON log, hands out unique numbers across connections and keys them by year."""
+    import json
+    import threading
+    from cwr_ledger import SequenceLedger, SequenceTaken
+    log = tmp_path / 'cwr_sequence_log.json'
+    log.write_text(json.dumps({"year": 2026, "history": [{"sequence": 3, "label": "0003 RC055 LUMINA"}]}))
+    db = tmp_path / 'ledger.db'
+    with SequenceLedger(db, import_json=log) as ledger:
+        assert ledger.history(2026) == [{"sequence": 3, "label": "0003 RC055 LUMINA"}]
+        assert ledger.next_sequence(2026) == 4 and ledger.next_sequence(2027) == 1
+        assert ledger.import_json(log) == 0
+
+    taken = []
+    def reserve():
+        with SequenceLedger(db, import_json=None) as ledger:
+            taken.extend(ledger.reserve(2026, owner=threading.current_thread().name) for _ in range(10))
+    threads = [threading.Thread(target=reserve) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sorted(taken) == list(range(4, 44))
+
+    # One ledger shared by threads, as the app's cached instance is across sessions
+    taken.clear()
+    with SequenceLedger(db, import_json=None) as shared:
+        def reserve_shared():
+            taken.extend(shared.reserve(2026, owner=threading.current_thread().name) for _ in range(10))
+        threads = [threading.Thread(target=reserve_shared) for _ in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        assert sorted(taken) == list(range(44, 84))
+        for n in taken: shared.release(n, 2026)
+
+    with SequenceLedger(db, import_json=None) as ledger:
+        with pytest.raises(SequenceTaken):
+            ledger.reserve(2026, sequence=4, owner='someone else')
+        assert ledger.commit(4, '0004 RC056 LUMINA', year=2026)
+        assert not ledger.commit(4, '0004 RC056 LUMINA', year=2026)
+        assert [e["sequence"] for e in ledger.history(2026)] == [3, 4]
+        assert ledger.reserve(2026, sequence=50, owner='me') == ledger.reserve(2026, sequence=50, owner='me') == 50
+        assert ledger.release(50, 2026, owner='me') and ledger.next_sequence(2026) == 44
+
+def test_failed_run_leaves_next_sequence_unchanged(tmp_path):
+    """Verify released and stale reservations give their number back while issued numbers never expire."""
+    from cwr_ledger import SequenceLedger, ISSUED
+    db = tmp_path / 'ledger.db'
+    with SequenceLedger(db, import_json=None) as ledger:
+        before = ledger.next_sequence(2026)
+        seq = ledger.reserve(2026, before, owner='session-a')
+        assert ledger.next_sequence(2026) == before + 1
+        ledger.release(seq, 2026, owner='session-a')  # pre-flight or write failed
+        assert ledger.next_sequence(2026) == before
+
+    # A reservation abandoned by a crash or page refresh goes stale
+    with SequenceLedger(db, import_json=None, reservation_ttl=0) as ledger:
+        ledger.reserve(2026, before, owner='session-a')
+        assert ledger.next_sequence(2026) == before
+        assert ledger.reserve(2026, before, owner='session-b') == before
+        assert ledger.issue(before, 'CW260001LUM_319.V22', 2026, owner='session-b')
+        assert not ledger.issue(before, 'CW260001LUM_319.V22', 2026, owner='session-a')
+        ledger.reserve(2026, before + 5, owner='session-c')  # sweeps stale rows, keeps issued
+        assert ledger.status(before, 2026) == ISSUED and ledger.next_sequence(2026) == before + 1
+
+def test_owner_can_regenerate_under_its_issued_number(tmp_path):
+    """Verify a session re-reserves and re-issues its own issued number while others stay locked out."""
+    from cwr_ledger import SequenceLedger, SequenceTaken, ISSUED
+    with SequenceLedger(tmp_path / 'ledger.db', import_json=None) as ledger:
+        seq = ledger.reserve(2026, 7, owner='session-a')
+        assert ledger.issue(seq, 'CW260007LUM_319.V22', 2026, owner='session-a')
+        assert ledger.reserve(2026, 7, owner='session-a') == 7
+        ledger.release(7, 2026, owner='session-a')  # failed regeneration keeps the number issued
+        assert ledger.status(7, 2026) == ISSUED and ledger.next_sequence(2026) == 8
+        assert ledger.issue(7, 'CW260007LUM_319.V22 (regenerated)', 2026, owner='session-a')
+        with pytest.raises(SequenceTaken):
+            ledger.reserve(2026, 7, owner='session-b')
+        assert not ledger.issue(7, 'CW260007LUM_319.V22', 2026, owner='session-b')
+        assert ledger.commit(7, 'CW260007LUM_319.V22', 2026)
+        with pytest.raises(SequenceTaken):
+            ledger.reserve(2026, 7, owner='session-a')
+
+def test_atomic_writer_replaces_only_on_success(tmp_path, monkeypatch):
+    """Verify output lands as latin-1 via a temp file and rename, and a timeout or error leaves the old file alone."""
+    import os
+    import cwr_output
+    from cwr_output import AtomicWriter, WriteTimeout, latin1_chunks
+    target = tmp_path / 'CW260001LUM_319.V22'
+    target.write_bytes(b'previous')
+    content = 'HDR CAFÉ\r\n' * 1000
+    with AtomicWriter(target) as out:
+        out.writelines(latin1_chunks(content, size=64))
+    assert target.read_bytes() == content.encode('latin-1')
+    assert out.bytes == len(content) and out.throughput > 0
+
+    clock = iter(range(100))
+    monkeypatch.setattr(cwr_output.time, 'perf_counter', lambda: next(clock))
+    with pytest.raises(WriteTimeout):
+        with AtomicWriter(target, timeout=2) as out:
+            out.writelines(latin1_chunks('X' * 1000, size=100))
+    with pytest.raises(UnicodeEncodeError):
+        with AtomicWriter(target) as out:
+            out.writelines(latin1_chunks('snowman ☃'))
+    assert target.read_bytes() == content.encode('latin-1')
+    assert [p.name for p in tmp_path.iterdir()] == [target.name]
+
+    # Not mkstemp's 0600: a new file gets 0666 under the umask, a replaced one keeps its mode
+    fresh = tmp_path / 'CW260002LUM_319.V22'
+    with AtomicWriter(fresh) as out:
+        out.write(b'HDR')
+    assert fresh.stat().st_mode & 0o777 == 0o666 & ~cwr_output.UMASK
+    os.chmod(target, 0o640)
+    with AtomicWriter(target) as out:
+        out.write(b'HDR')
+    assert target.stat().st_mode & 0o777 == 0o640
+
+def test_artifact_store_spills_and_evicts(tmp_path):
+    """Verify outputs are stored once per content hash, zipped once from disk and evicted by age and size."""
+    import os
+    import time
+    import zipfile
+    from cwr_artifacts import ArtifactStore
+    store = ArtifactStore(tmp_path, max_age=3600, max_bytes=1 << 20)
+    content = 'HDR CAFÉ\r\n' * 100
+    key = store.put('session-a', 'CW260001LUM_319.V22', content)
+    assert store.put('session-a', 'CW260001LUM_319.V22', content) == key
+    zip_path = store.zip_path('session-a', key, 'CW260001LUM_319.V22')
+    built = os.stat(zip_path).st_mtime_ns
+    assert store.zip_path('session-a', key, 'CW260001LUM_319.V22') == zip_path and os.stat(zip_path).st_mtime_ns == built
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.read('CW260001LUM_319.V22') == content.encode('latin-1')
+
+    stale = store.put('session-b', 'CW260002LUM_319.V22', 'OLD\r\n')
+    old = time.time() - 7200
+    os.utime(os.path.dirname(store.path('session-b', stale, 'CW260002LUM_319.V22')), (old, old))
+    assert store.evict() == 1 and store.path('session-b', stale, 'CW260002LUM_319.V22') is None
+
+    store.max_bytes = 1500
+    newest = store.put('session-c', 'CW260003LUM_319.V22', 'X' * 1000)
+    assert store.zip_path('session-a', key, 'CW260001LUM_319.V22') is None
+    assert store.path('session-c', newest, 'CW260003LUM_319.V22') is not None
+
+def test_benchmark_catalog_and_regression_check(monkeypatch):
+    """Verify the synthetic catalog is deterministic and valid, and the comparison flags slowdowns only."""
+    import bench_cwr
+    from cwr_engine import generate_cwr_content
+    from cwr_ingest import load_csv_buffer
+    from bench_cwr import synthetic_catalog, run_suite, compare
+    csv_bytes, agreement_map = synthetic_catalog(40, writers=4, publishers=3, agreements=10, seed=7)
+    assert synthetic_catalog(40, writers=4, publishers=3, agreements=10, seed=7)[0] == csv_bytes
+    header_row, df = load_csv_buffer(csv_bytes)
+    assert header_row == 2 and len(df) == 40
+    content, _ = generate_cwr_content(df.copy(), agreement_map=agreement_map)
+    report, stats = CWRValidator().process_file(content, csv_content=csv_bytes)
+    assert report == [] and stats['transactions'] == 40
+
+    # Split catalogs: every transmission is mirror-audited against its own rows only
+    monkeypatch.setattr(bench_cwr, 'MAX_WORKS_PER_TRANSMISSION', 15)
+    ctx = bench_cwr.bench_context(csv_bytes, agreement_map)
+    assert [len(p) for p in ctx["parts"]] == [15, 15, 10]
+    bench_cwr.BENCHMARKS["generate_rows"](ctx)
+    bench_cwr.BENCHMARKS["validate_mirror"](ctx)
+    assert ctx["reports"] == [[], [], []]
+
+    report = run_suite(["25"], ["validate", "gatekeeper"], memory=False)
+    assert [(r["bench"], r["works"]) for r in report["results"]] == [("validate", 25), ("gatekeeper", 25)]
+    baseline = {"results": [{"bench": "validate", "works": 25, "seconds": 1.0}, {"bench": "gatekeeper", "works": 25, "seconds": 1.0}]}
+    current = {"results": [{"bench": "validate", "works": 25, "seconds": 1.5}, {"bench": "gatekeeper", "works": 25, "seconds": 0.5}]}
+    assert [(r["bench"], r["ratio"]) for r in compare(current, baseline, 0.2)] == [("validate", 1.5)]
+
+def test_tracer_spans_and_null_tracer():
+    """Verify spans nest by name, report throughput, and the null tracer records nothing."""
+    import json
+    from cwr_engine import generate_cwr_content
+    from cwr_trace import Tracer, NULL_TRACER
+    tracer = Tracer()
+    with tracer.span("outer") as outer:
+        outer.add(rows=10)
+        with tracer.span("inner") as inner:
+            inner.add(records=4, bytes=100)
+    report = tracer.report()
+    assert [(r["stage"], r["depth"]) for r in report] == [("outer", 0), ("outer/inner", 1)]
+    assert report[0]["rows"] == 10 and "records" not in report[0] and report[1]["bytes_per_s"] > 0
+    assert tracer.total() == tracer.spans[0].seconds
+    with NULL_TRACER.span("ignored") as span:
+        span.add(rows=1)
+    assert NULL_TRACER.report() == [] and json.loads(NULL_TRACER.to_json())["stages"] == []
+
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    tracer = Tracer()
+    content, stats = generate_cwr_content(_harvest_frame(['One', 'Two']), agreement_map=test_map, tracer=tracer)
+    stages = {r["stage"]: r for r in tracer.report()}
+    assert stages["engine.render"]["rows"] == 2 and stages["engine.render"]["records"] == sum(stats.counts.values())
+    assert stages["engine.join"]["bytes"] == len(content)
+    rep, _ = CWRValidator(tracer=tracer).process_file(content)
+    assert rep == [] and tracer.report()[-1]["stage"] == "validate.records"
+
+def test_memory_tracer_reports_peak_and_sites():
+    """Verify memory profiling reports per-stage peak/retained bytes and attributes them to engine lines."""
+    import tracemalloc
+    from cwr_engine import generate_cwr_content
+    from cwr_trace import Tracer
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    tracer = Tracer(memory=True)
+    with tracer.span("generate"):
+        content, _ = generate_cwr_content(_harvest_frame(['One', 'Two', 'Three']), agreement_map=test_map, tracer=tracer)
+    assert not tracemalloc.is_tracing()
+    stages = {r["stage"]: r for r in tracer.report()}
+    join = stages["generate/engine.join"]
+    assert join["retained_bytes"] >= len(content) and join["peak_bytes"] >= join["retained_bytes"]
+    assert join["sites"][0]["site"].startswith("cwr_engine.py:") and join["sites"][0]["bytes"] >= len(content)
+    assert stages["generate"]["peak_bytes"] >= max(stages["generate/engine.render"]["retained_bytes"], join["retained_bytes"])
+    assert tracer.peak() == max(r["peak_bytes"] for r in stages.values())
+    assert "peak_bytes" not in Tracer().to_json()
+
+def test_profiled_run_writes_pstats_and_collapsed_stacks(tmp_path):
+    """Verify the profile is saved, collapsed stacks carry all own time, and watched engine functions are summarized."""
+    import pstats
+    from cwr_engine import generate_cwr_content
+    from cwr_profile import profiled, summary
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    printed = []
+    with profiled(str(tmp_path / 'run'), top=3, report=printed.append):
+        generate_cwr_content(_harvest_frame(['One', 'Two']), agreement_map=test_map, mode="rows")
+    stats = pstats.Stats(str(tmp_path / 'run.pstats'))
+    own_us = sum(entry[2] for entry in stats.stats.values()) * 1e6
+    lines = (tmp_path / 'run.collapsed.txt').read_text().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert abs(sum(int(line.rsplit(' ', 1)[1]) for line in lines) - own_us) <= len(lines) + 1
+    rows = summary(stats, top=3)
+    assert [r['rank'] for r in rows[:3]] == [1, 2, 3]
+    for hot in ('build', 'render', 'pad_ipi'):
+        assert any(r['function'].startswith('cwr_engine.py:') and r['function'].endswith(f':{hot}') for r in rows), hot
+    assert 'pad_ipi' in printed[-1]
+
+def test_batch_worker_cache_warm_run_is_byte_identical(tmp_path, monkeypatch):
+    """Verify a warm transaction cache splices every row and writes the same bytes as an uncached run."""
+    import datetime as dt
+    import cwr_engine
+    from run_batch_cwr import process_csv
+    class FrozenDatetime(dt.datetime):
+        @classmethod
+        def utcnow(cls):
+            return cls(2026, 1, 2, 3, 4, 5)
+    monkeypatch.setattr(cwr_engine, 'datetime', FrozenDatetime)
+    test_map = {'LUMINA PUBLISHING UK': '4316161'}
+    csv_path = tmp_path / 'a.csv'
+    _harvest_frame(['One', 'Two']).to_csv(csv_path, index=False)
+    outputs = []
+    for n, cache_path in enumerate([None, tmp_path / 'tx.db', tmp_path / 'tx.db']):
+        tmp = tmp_path / f'{n}.V22'
+        result = process_csv(str(csv_path), str(tmp), test_map, cache_path=cache_path and str(cache_path))
+        assert result['status'] == 'generated', result['errors']
+        outputs.append((tmp.read_bytes(), result.get('cache')))
+    (plain, _), (cold, cold_stats), (warm, warm_stats) = outputs
+    assert cold_stats == {'hits': 0, 'misses': 2} and warm_stats == {'hits': 2, 'misses': 0}
+    assert plain == cold == warm
@@ -1,5 +1,4 @@
-
-import pandas as pd
+import argparse
 import sys
 import os
 from datetime import datetime
@@ -7,10 +6,16 @@ from datetime import datetime
 # Ensure we can import from local directory
 sys.path.append(os.getcwd())
 
-from cwr_engine import generate_cwr_content, Blueprints
+from cwr_cache import TransactionCache
+from cwr_engine import write_cwr
+from cwr_ingest import detect_header_row, read_csv_chunks
+from cwr_index import IndexedTransmission
+from cwr_output import AtomicWriter
+from cwr_profile import TOP_N, profiled
+from cwr_trace import Tracer
 from cwr_validator import CWRValidator
 
-def run_transparency_test():
+def run_transparency_test(cache_path=None):
     input_csv = "INPUT_CSVS/EPP060_Metadata.csv"
     output_dir = "OUTPUT_CWR"
     os.makedirs(output_dir, exist_ok=True)
@@ -18,7 +23,8 @@ def run_transparency_test():
 
     print(f"Reading {input_csv}...")
     try:
-        df = pd.read_csv(input_csv, encoding='latin1')
+        h_idx = detect_header_row(input_csv, encoding='latin1')
+        chunks = read_csv_chunks(input_csv, header_row=h_idx, encoding='latin1')
     except Exception as e:
         print(f"Error reading CSV: {e}")
         return
@@ -29,28 +35,35 @@ def run_transparency_test():
     
     print(f"Agreement Map: {len(agreement_map)} entries.")
 
+    tracer = Tracer()
     print("Generating CWR Content...")
+    print(f"Streaming records to {output_file}...")
     try:
-        content, warnings = generate_cwr_content(df, agreement_map)
+        if cache_path:
+            # Rows unchanged since the last run are spliced from the transaction cache
+            with TransactionCache(cache_path) as cache, AtomicWriter(output_file) as f:
+                write_cwr(f, chunks, agreement_map, tracer=tracer, cache=cache)
+            print(f"Transaction cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+        else:
+            with AtomicWriter(output_file) as f:
+                write_cwr(f, chunks, agreement_map, tracer=tracer)
+        print(f"Wrote {f.bytes} bytes in {f.elapsed:.2f}s ({f.throughput:.1f} MB/s)")
     except Exception as e:
         print(f"CRITICAL ERROR in Engine: {e}")
         return
 
-    print(f"Writing parsed content to {output_file}...")
-    with open(output_file, 'w', encoding='latin1') as f:
-        f.write(content)
-
     print("\n--- VALIDATING OUTPUT ---")
-    validator = CWRValidator()
-    report, stats = validator.process_file(content)
+    validator = CWRValidator(tracer=tracer)
+    report, stats = validator.process_path(output_file)
     
     critical_errors = [r for r in report if r['level'] == 'CRITICAL']
     print(f"Critical Errors: {len(critical_errors)}")
 
     print("\n--- AUDIT CHECKS ---")
+    tx = IndexedTransmission.open(output_file)
     
     # 0. HDR Timestamp Check
-    hdr_line = [line for line in content.splitlines() if line.startswith("HDR")][0]
+    hdr_line = tx.first("HDR")
     file_time_str = hdr_line[74:80] # HHMMSS
     now = datetime.now()
     print(f"HDR Timestamp: {file_time_str}")
@@ -63,9 +76,8 @@ def run_transparency_test():
          print(f"WARNING: Timestamp {file_time_str} vs Now {now_hm}??")
 
     # 1. REC Record Layout
-    rec_lines = [line for line in content.splitlines() if line.startswith("REC")]
-    if rec_lines:
-        first_rec = rec_lines[0]
+    first_rec = tx.first("REC")
+    if first_rec:
         print(f"Sample REC Length: {len(first_rec)}")
         if len(first_rec) == 508: print("PASS: REC Length is 508.")
         else: print(f"FAIL: REC Length is {len(first_rec)}")
@@ -81,9 +93,8 @@ def run_transparency_test():
              print(f"FAIL: Label is '{label_check}', expected '{target_label}'")
 
     # 2. SPU Layout & Math
-    spu_lines = [line for line in content.splitlines() if line.startswith("SPU")]
-    if spu_lines:
-        first_spu = spu_lines[0]
+    first_spu = tx.first("SPU")
+    if first_spu:
         print(f"Sample SPU Length: {len(first_spu)}")
         
         if len(first_spu) == 166: print("PASS: SPU Length is 166.")
@@ -100,5 +111,23 @@ def run_transparency_test():
         else:
              print(f"FAIL: Gap content is '{gap_content}' (Len: {len(gap_content)})")
 
+    tx.close()
+
+    # Per-stage timings (cwr_trace), beside the output
+    with open(output_file + ".trace.json", 'w') as f:
+        f.write(tracer.to_json(indent=2))
+    print(f"\n--- STAGE TIMINGS ({output_file}.trace.json) ---")
+    print(tracer.to_json(indent=2))
+
 if __name__ == "__main__":
-    run_transparency_test()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", nargs="?", const=os.path.join("OUTPUT_CWR", "EPP060_GoldStandard"), default=None, metavar="PREFIX",
+                        help="Run under cProfile; writes PREFIX.pstats and PREFIX.collapsed.txt (flamegraph input).")
+    parser.add_argument("--cache", default=None, metavar="PATH", help="Transaction cache (sqlite): re-renders only rows changed since the last run.")
+    parser.add_argument("--top", type=int, default=TOP_N, help="Functions in the profile summary.")
+    args = parser.parse_args()
+    if args.profile:
+        with profiled(args.profile, args.top):
+            run_transparency_test(args.cache)
+    else:
+        run_transparency_test(args.cache)